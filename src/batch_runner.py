@@ -0,0 +1,399 @@
+"""
+Batch Runner Module
+Processes an offline backlog through the Message Batches API, one batch per stage, chunk and cascade tier
+"""
+
+import itertools
+import json
+import sys
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from email_processor import Preprocessor, TextReducer
+from intent_detector import IntentDetector
+from rag_system import RAGSystem
+from draft_generator import DraftGenerator
+from quality_checker import QualityChecker
+from pipeline import choose_top_k, route_email
+from request_scheduler import estimate_request_tokens
+from stage_planner import StagePlanner
+
+BATCH_STAGES = ["intent", "rag", "draft", "quality"]
+
+
+class LocalBatchEndpoint:
+    """
+    Stand-in for client.messages.batches that answers each request with messages.create
+
+    Implements the create / retrieve / results subset BatchRunner uses. A
+    batch reports "in_progress" for the first `polls_until_done - 1` polls,
+    then runs all of its requests and reports "ended".
+    """
+
+    def __init__(self, create: Callable, polls_until_done: int = 1):
+        """
+        Args:
+            create: A messages.create callable (real client or a fake)
+            polls_until_done: Number of retrieve() calls before a batch ends
+        """
+        self.create_message = create
+        self.polls_until_done = polls_until_done
+        self.batches: Dict[str, Dict] = {}
+        self._ids = itertools.count(1)
+
+    def create(self, requests: List[Dict]):
+        batch_id = f"msgbatch_local_{next(self._ids)}"
+        self.batches[batch_id] = {"requests": requests, "polls": 0, "results": None}
+        return SimpleNamespace(id=batch_id, processing_status="in_progress")
+
+    def retrieve(self, batch_id: str):
+        batch = self.batches[batch_id]
+        batch['polls'] += 1
+        if batch['results'] is None and batch['polls'] >= self.polls_until_done:
+            batch['results'] = [self._run(request) for request in batch['requests']]
+        status = "ended" if batch['results'] is not None else "in_progress"
+        return SimpleNamespace(id=batch_id, processing_status=status)
+
+    def results(self, batch_id: str):
+        for entry in self.batches[batch_id]['results']:
+            yield entry
+
+    def _run(self, request: Dict):
+        try:
+            message = self.create_message(**request['params'])
+            result = SimpleNamespace(type="succeeded", message=message)
+        except Exception as e:
+            result = SimpleNamespace(type="errored", error=e)
+        return SimpleNamespace(custom_id=request['custom_id'], result=result)
+
+
+class BatchRunner:
+    """
+    Offline backlog mode
+
+    The backlog is split into chunks. Each chunk moves through intent → RAG →
+    draft → QC on its own: as soon as one of its stage batches ends, the
+    results are joined back by custom id and the next stage's batch is
+    submitted, while other chunks are still in flight. Work that needs no
+    API call (fast path, result cache, local retrieval, planner skips,
+    template drafts, rule-based pre-QC) is resolved before a batch is built.
+
+    Each stage's ModelCascade is kept: requests go to its first model, and
+    responses it would escalate (low score, invalid output, errored request)
+    are resubmitted in a batch for the next model before the chunk moves
+    on. Cached results are therefore keyed on the cascade like the
+    interactive path's.
+    """
+
+    def __init__(self, detector: IntentDetector, rag: RAGSystem, generator: DraftGenerator,
+                 checker: QualityChecker, endpoint=None, planner: Optional[StagePlanner] = None,
+                 chunk_size: int = 1000, poll_interval: float = 30.0,
+                 reducer: Optional[TextReducer] = None, reduce_bodies: bool = True):
+        """
+        Args:
+            detector, rag, generator, checker: The stage implementations
+            endpoint: Object with the messages.batches interface (defaults to the detector's client)
+            planner: Decides which stages to skip (defaults to StagePlanner's default policy)
+            chunk_size: Emails per batch; smaller chunks start later stages sooner
+            poll_interval: Seconds between polls while every submitted batch is still running
+            reducer: Body reducer (defaults to TextReducer())
+            reduce_bodies: Strip quoted history, signatures and boilerplate before building requests
+        """
+        self.detector = detector
+        self.rag = rag
+        self.generator = generator
+        self.checker = checker
+        self.endpoint = endpoint if endpoint is not None else detector.client.messages.batches
+        self.planner = planner or StagePlanner()
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.preprocessor = Preprocessor()
+        self.reducer = (reducer or TextReducer()) if reduce_bodies else None
+        if checker.grounding_verifier is not None:
+            # Drafts may repeat what the system prompt tells the model about the persona
+            checker.grounding_verifier.add_known_text(generator._system_prompt())
+        self.modules = {"intent": detector, "rag": rag, "draft": generator, "quality": checker}
+        # The same scores the interactive path passes to ModelCascade.call
+        self.scores = {
+            "intent": lambda payload: payload['confidence'],
+            "rag": rag._ranking_score,
+            "draft": lambda payload: payload['confidence'],
+            "quality": lambda payload: payload['quality_score']
+        }
+        self.stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
+            "emails": 0,
+            "batches": 0,
+            "wall_seconds": 0.0,
+            "stages": {stage: {"submitted": 0, "resolved_locally": 0, "escalated": 0, "errored": 0}
+                       for stage in BATCH_STAGES}
+        }
+
+    # ------------------------------------------------------------------
+    # Per-stage request building and result handling
+    # ------------------------------------------------------------------
+
+    def _prepare(self, stage: str, job: Dict) -> Optional[Tuple[Dict, Dict]]:
+        """Resolve the stage locally and return None, or return (request params, parse context)"""
+        body = job['text']
+
+        if stage == "intent":
+            known = self.detector._known_intent(body)
+            if known is not None:
+                job['intent'] = known
+                return None
+            return self.detector._intent_request(body), {}
+
+        if stage == "rag":
+            top_k = choose_top_k(job['email'], job['intent'])
+            results, search = self.rag._prepare_search(body, job['intent']['category'], top_k)
+            if results is not None:
+                job['relevant_faqs'] = results
+                return None
+            return search['request'], search
+
+        if stage == "draft":
+            mode = self.planner.plan_draft(job['preprocessed'])
+            if mode == "none":
+                job['draft'] = self.planner.skipped_draft(self.generator.persona['name'])
+                return None
+            brief = mode == "brief"
+            templated = self.generator._template_draft(body, job['relevant_faqs'], brief, job['preprocessed'])
+            if templated is not None:
+                job['draft'] = templated
+                return None
+            cache_key, cached = self.generator._cache_lookup(body, job['relevant_faqs'], brief)
+            if cached is not None:
+                job['draft'] = cached
+                return None
+            return self.generator._draft_request(body, job['relevant_faqs'], brief), {"cache_key": cache_key}
+
+        skip_reason = self.planner.plan_quality(job['preprocessed'], job['draft'])
+        if skip_reason is not None:
+            job['quality'] = self.planner.skipped_quality(job['draft'], skip_reason)
+            return None
+        draft_text = job['draft']['draft']
+        local, grounding = self.checker._pre_check(job['preprocessed']['cleaned_text'], draft_text,
+                                                   job['relevant_faqs'], job.get('grounding'))
+        if local is not None:
+            job['quality'] = local
+            return None
+        cache_key, cached = self.checker._cache_lookup(body, draft_text, job['relevant_faqs'])
+        if cached is not None:
+            job['quality'] = cached
+            return None
+        return self.checker._quality_request(body, draft_text, job['relevant_faqs']), \
+            {"cache_key": cache_key, "grounding": grounding}
+
+    def _complete(self, stage: str, job: Dict, message, context: Dict):
+        """Parse a succeeded batch result into the job"""
+        body = job['text']
+        if stage == "intent":
+            job['intent'] = self.detector._parse_intent(message, body)
+        elif stage == "rag":
+            job['relevant_faqs'] = self.rag._parse_ranking(message, context)
+        elif stage == "draft":
+            job['draft'] = self.generator._parse_draft(message, body, context['cache_key'])
+        else:
+            job['quality'] = self.checker._parse_quality(message, context['cache_key'], context['grounding'])
+
+    def _fail(self, stage: str, job: Dict, error: Exception, context: Dict):
+        """Apply the same fallback the interactive path uses"""
+        self.stats['stages'][stage]['errored'] += 1
+        if stage == "intent":
+            job['intent'] = self.detector._intent_error(error)
+        elif stage == "rag":
+            job['relevant_faqs'] = self.rag._ranking_fallback(error, context)
+        elif stage == "draft":
+            print(f"Error generating draft: {error}")
+            job['draft'] = self.generator._create_fallback_response(job['text'])
+        else:
+            job['quality'] = self.checker._quality_error(error)
+
+    def _verify_grounding(self, jobs: List[Dict]):
+        """Score every generated draft of a chunk against its snippets with one similarity matrix"""
+        verifier = self.checker.grounding_verifier
+        drafted = [job for job in jobs if not job['draft'].get('skipped')]
+        if verifier is None or not drafted:
+            return
+        results = verifier.verify_batch(
+            [job['draft']['draft'] for job in drafted],
+            [job['relevant_faqs'] for job in drafted],
+            [job['preprocessed']['cleaned_text'] for job in drafted]
+        )
+        for job, grounding in zip(drafted, results):
+            job['grounding'] = grounding
+
+    # ------------------------------------------------------------------
+    # Chunk state machine
+    # ------------------------------------------------------------------
+
+    def _advance(self, chunk: Dict):
+        """Move the chunk forward until a stage needs a batch (submitted here) or all stages are done"""
+        while chunk['stage'] < len(BATCH_STAGES):
+            stage = BATCH_STAGES[chunk['stage']]
+            if stage == "quality":
+                self._verify_grounding(chunk['jobs'])
+            first_model = self.modules[stage].cascade.models[0]
+            pending = {}
+            for job in chunk['jobs']:
+                prepared = self._prepare(stage, job)
+                if prepared is None:
+                    self.stats['stages'][stage]['resolved_locally'] += 1
+                    continue
+                params, context = prepared
+                pending[f"{stage}-{job['index']}"] = (job, context, {**params, "model": first_model})
+
+            if pending:
+                self._submit(chunk, stage, pending)
+                return
+            chunk['stage'] += 1
+
+        chunk['batch_id'] = None
+        for job in chunk['jobs']:
+            job['routing'] = route_email(job['preprocessed'], job['draft'], job['quality'])
+
+    def _submit(self, chunk: Dict, stage: str, pending: Dict[str, Tuple[Dict, Dict, Dict]]):
+        """Send one batch for the chunk: custom id -> (job, parse context, request params)"""
+        requests = [{"custom_id": custom_id, "params": params} for custom_id, (_, _, params) in pending.items()]
+        chunk['pending'] = pending
+        chunk['batch_id'] = self.endpoint.create(requests=requests).id
+        self.stats['batches'] += 1
+        self.stats['stages'][stage]['submitted'] += len(requests)
+
+    def _collect(self, chunk: Dict) -> bool:
+        """
+        Join the ended batch's results back to their jobs by custom id
+
+        Returns:
+            True when the stage is done, False when escalations went out in a next-tier batch
+        """
+        stage = BATCH_STAGES[chunk['stage']]
+        pending = chunk['pending']
+        module = self.modules[stage]
+        escalated = {}
+        for entry in self.endpoint.results(chunk['batch_id']):
+            if entry.custom_id not in pending:
+                continue
+            job, context, params = pending.pop(entry.custom_id)
+            result = entry.result
+            if result.type != "succeeded":
+                next_model = module.cascade.review_error(params['model'])
+                if next_model is not None:
+                    escalated[entry.custom_id] = (job, context, {**params, "model": next_model})
+                    continue
+                error = getattr(result, 'error', None) or RuntimeError(f"Batch request {result.type}")
+                self._fail(stage, job, error, context)
+                continue
+            # Batch results bypass the scheduler, so report prompt sizes to the budget here
+            module.budget.observe(params, estimate_request_tokens(params), result.message)
+            next_model = module.cascade.review(params['model'], result.message, self.scores[stage], module.output)
+            if next_model is not None:
+                escalated[entry.custom_id] = (job, context, {**params, "model": next_model})
+                continue
+            try:
+                self._complete(stage, job, result.message, context)
+            except Exception as e:
+                self._fail(stage, job, e, context)
+
+        # Requests the batch never returned are failed rather than silently dropped
+        for job, context, _ in pending.values():
+            self._fail(stage, job, RuntimeError("Missing from batch results"), context)
+        chunk['pending'] = {}
+        if escalated:
+            self.stats['stages'][stage]['escalated'] += len(escalated)
+            self._submit(chunk, stage, escalated)
+            return False
+        chunk['stage'] += 1
+        return True
+
+    def run(self, emails: List[Dict]) -> List[Dict]:
+        """
+        Process a backlog and block until every email is routed
+
+        Args:
+            emails: List of dicts with 'subject' and 'body' keys
+
+        Returns:
+            One job dict per email, in input order, with the same keys Pipeline.run produces
+        """
+        self.stats = self._empty_stats()
+        run_start = time.perf_counter()
+
+        jobs = []
+        for index, (email, preprocessed) in enumerate(zip(emails, self.preprocessor.preprocess_batch(emails))):
+            reduction = self.reducer.reduce(email['body']) if self.reducer is not None else None
+            jobs.append({
+                "index": index,
+                "email": email,
+                "preprocessed": preprocessed,
+                "reduction": reduction,
+                # The body every request is built from
+                "text": reduction['body'] if reduction is not None else email['body']
+            })
+        chunks = [
+            {"jobs": jobs[start:start + self.chunk_size], "stage": 0, "batch_id": None, "pending": {}}
+            for start in range(0, len(jobs), self.chunk_size)
+        ]
+        for chunk in chunks:
+            self._advance(chunk)
+
+        while True:
+            running = [chunk for chunk in chunks if chunk['batch_id'] is not None]
+            if not running:
+                break
+            progressed = False
+            for chunk in running:
+                if self.endpoint.retrieve(chunk['batch_id']).processing_status == "ended":
+                    if self._collect(chunk):
+                        self._advance(chunk)
+                    progressed = True
+            if not progressed:
+                time.sleep(self.poll_interval)
+
+        self.stats['emails'] = len(jobs)
+        self.stats['wall_seconds'] = time.perf_counter() - run_start
+        return jobs
+
+    def get_stats(self) -> Dict:
+        """Batches submitted and, per stage, requests sent, resolved without a request, escalated and failed"""
+        return self.stats
+
+
+def main():
+    """Run the test emails as an offline backlog (pass --local to use the stand-in batch endpoint)"""
+
+    with open('../data/test_emails.json', 'r') as f:
+        emails = json.load(f)['test_emails']
+
+    detector = IntentDetector()
+    endpoint = None
+    if '--local' in sys.argv:
+        # Answers each batch request with a regular messages.create call
+        endpoint = LocalBatchEndpoint(detector.client.messages.create)
+
+    runner = BatchRunner(detector, RAGSystem(), DraftGenerator(), QualityChecker(), endpoint=endpoint,
+                         chunk_size=5, poll_interval=1.0 if endpoint else 30.0)
+
+    print("="*70)
+    print("OFFLINE BATCH RUN")
+    print("="*70)
+
+    for job in runner.run(emails):
+        print(f"\n📧 Email #{job['email']['id']}: {job['email']['subject']}")
+        print(f"   Category: {job['intent']['category']}")
+        print(f"   → {job['routing']['label']}: {job['routing']['reason']}")
+
+    stats = runner.get_stats()
+    print(f"\n📦 {stats['emails']} emails in {stats['batches']} batches ({stats['wall_seconds']:.1f}s)")
+    for stage, counts in stats['stages'].items():
+        print(f"   {stage}: {counts['submitted']} batched, {counts['resolved_locally']} resolved locally, "
+              f"{counts['escalated']} escalated, {counts['errored']} errored")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+CPU Pool Benchmark
+Measures how preprocessing, text reduction and FAQ scoring scale from one core to all of them with CPUStagePool
+"""
+
+import os
+import sys
+import time
+from typing import Dict, List
+
+from benchmark_preprocessing import synthetic_emails
+from cpu_pool import CPUStagePool
+from email_processor import Preprocessor, TextReducer
+from rag_system import RAGSystem
+
+
+def worker_counts(cpus: int) -> List[int]:
+    """1, 2, 4, ... up to the CPU count, which is always included"""
+    counts = []
+    workers = 1
+    while workers < cpus:
+        counts.append(workers)
+        workers *= 2
+    counts.append(cpus)
+    return counts
+
+
+def run_serial(emails: List[Dict]) -> float:
+    """The in-process baseline: same work as a pool worker (preprocess, reduce, score), one core, no IPC"""
+    preprocessor = Preprocessor()
+    reducer = TextReducer()
+    rag = RAGSystem(use_llm=False)
+    start = time.perf_counter()
+    for email in emails:
+        preprocessor.preprocess(email)
+        rag.prefetch_scores(reducer.reduce(email['body'])['body'])
+    return time.perf_counter() - start
+
+
+def run_pool(emails: List[Dict], workers: int, chunk_size: int) -> float:
+    """Seconds to stream every email through a warm pool (worker start-up excluded)"""
+    with CPUStagePool(workers=workers, chunk_size=chunk_size) as pool:
+        pool.warm_up()
+        start = time.perf_counter()
+        for _ in pool.process(emails):
+            pass
+        return time.perf_counter() - start
+
+
+def main():
+    """Benchmark on 10k emails (pass a number to change the count, --chunk N for the chunk size)"""
+    chunk_size = 64
+    if '--chunk' in sys.argv:
+        position = sys.argv.index('--chunk')
+        chunk_size = int(sys.argv.pop(position + 1))
+        sys.argv.pop(position)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    cpus = os.cpu_count() or 1
+    emails = synthetic_emails(count)
+
+    print("="*70)
+    print(f"CPU POOL BENCHMARK ({count:,} emails, {cpus} CPUs, chunks of {chunk_size})")
+    print("="*70)
+
+    serial = run_serial(emails)
+    print(f"\n🐢 In-process, 1 core: {serial:.2f}s ({count / serial:,.0f} emails/s)")
+
+    print(f"\n{'workers':>8} {'seconds':>9} {'emails/s':>10} {'speedup':>9} {'efficiency':>11}")
+    single = None
+    for workers in worker_counts(cpus):
+        seconds = run_pool(emails, workers, chunk_size)
+        single = single or seconds
+        speedup = single / seconds
+        print(f"{workers:>8} {seconds:>9.2f} {count / seconds:>10,.0f} {speedup:>8.2f}x {speedup / workers:>10.0%}")
+
+    print(f"\n📦 Pool overhead at 1 worker: {(single / serial - 1) * 100:+.0f}% vs in-process "
+          f"(pickling and IPC per chunk)")
+    if cpus == 1:
+        print("⚠️  Only one CPU available: run on a multi-core machine to see scaling")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Preprocessing Benchmark
+Compares preprocess_email with the precompiled Preprocessor on a large synthetic backlog
+"""
+
+import json
+import random
+import sys
+import time
+from typing import Dict, List
+
+from email_processor import Preprocessor, preprocess_email
+
+# Fragments mixed into the synthetic emails so every branch is exercised
+FILLER = [
+    "Thanks for your help.",
+    "I really love the sound of this guitar.",
+    "This is URGENT, please answer ASAP!",
+    "I am still waiting for an answer!!!",
+    "My friend recommended your store.",
+    "I never received a confirmation email.",
+    "CAN SOMEONE PLEASE HELP ME",
+    "Best regards, Sam"
+]
+
+
+def synthetic_emails(count: int, seed: int = 42) -> List[Dict]:
+    """Variations of the test emails with random order numbers, filler and whitespace"""
+    with open('../data/test_emails.json', 'r') as f:
+        templates = json.load(f)['test_emails']
+
+    rng = random.Random(seed)
+    emails = []
+    for i in range(count):
+        template = templates[i % len(templates)]
+        body = template['body']
+        for _ in range(rng.randint(0, 3)):
+            body += rng.choice(["\n\n", " ", "  \t"]) + rng.choice(FILLER)
+        if rng.random() < 0.3:
+            body += f" Order #{rng.randint(10000, 9999999)}"
+        emails.append({"id": i, "subject": template['subject'], "body": body})
+    return emails
+
+
+def time_run(function, emails: List[Dict]):
+    """Run the function over the backlog; returns (results, seconds)"""
+    start = time.perf_counter()
+    results = function(emails)
+    return results, time.perf_counter() - start
+
+
+def main():
+    """Benchmark on 100k emails (pass a number to change the count)"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    emails = synthetic_emails(count)
+    preprocessor = Preprocessor()
+
+    print("="*70)
+    print(f"PREPROCESSING BENCHMARK ({count:,} emails)")
+    print("="*70)
+
+    reference, reference_seconds = time_run(lambda batch: [preprocess_email(email) for email in batch], emails)
+    batched, batched_seconds = time_run(preprocessor.preprocess_batch, emails)
+
+    identical = reference == batched
+    print(f"\n🐢 preprocess_email:            {reference_seconds:.2f}s "
+          f"({reference_seconds / count * 1e6:.1f} µs/email)")
+    print(f"⚡ Preprocessor.preprocess_batch: {batched_seconds:.2f}s "
+          f"({batched_seconds / count * 1e6:.1f} µs/email)")
+    print(f"\n🚀 Speedup: {reference_seconds / batched_seconds:.1f}x")
+    print(f"{'✅' if identical else '❌'} Results identical: {identical}")
+
+
+if __name__ == "__main__":
+    main()
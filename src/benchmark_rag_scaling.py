@@ -0,0 +1,146 @@
+"""
+RAG Scaling Benchmark
+Measures RAGSystem's per-query overhead (category filter, prompt, id lookup) from 10 to 100k FAQs
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+import numpy as np
+
+from faq_index import HashedNgramEmbedder
+from rag_system import RAGSystem
+
+QUESTIONS = [
+    ("Where is my order #45823? I ordered it last week.", "ORDER_TRACKING"),
+    ("The guitar I received has a crack in the neck. I want to return it.", "RETURN_REFUND"),
+    ("Does the Fender Stratocaster come with a case?", "PRODUCT_QUESTION"),
+    ("My amplifier is making buzzing noises. Is this covered under warranty?", "WARRANTY")
+]
+
+PRODUCTS = ["Stratocaster", "Les Paul", "Telecaster", "P-Bass", "Jazz Bass", "Rhodes", "Nord Stage",
+            "SM58", "Blues Junior", "Scarlett 2i2", "Roland TD-17", "Yamaha P-125"]
+
+
+def synthetic_kb(size: int, seed: int = 11) -> Dict:
+    """A knowledge base of `size` FAQs: the real ones varied by product and model year"""
+    with open('../data/faqs.json', 'r') as f:
+        faqs = json.load(f)['faqs']
+    rng = random.Random(seed)
+    generated = []
+    for i in range(size):
+        faq = faqs[i % len(faqs)]
+        product = f"{rng.choice(PRODUCTS)} ({2000 + rng.randrange(26)})"
+        generated.append({
+            "id": i + 1,
+            "category": faq['category'],
+            "question": f"{faq['question']} ({product})",
+            "answer": f"{faq['answer']} This applies to the {product}."
+        })
+    return {"faqs": generated}
+
+
+def ranking_message(candidate_faqs: List[Dict], top_k: int):
+    """A record_ranking tool call that ranks the shortlist in reverse"""
+    ranked = [{"id": faq['id'], "relevance_score": 0.9, "reason": "benchmark"}
+              for faq in reversed(candidate_faqs)][:top_k]
+    block = SimpleNamespace(type="tool_use", name="record_ranking", input={"ranked_faqs": ranked})
+    return SimpleNamespace(content=[block], stop_reason="tool_use")
+
+
+def legacy_lookup(faqs: List[Dict], masks: Dict[str, np.ndarray], category: str, candidate_faqs: List[Dict],
+                  ranked: List[Dict]) -> List[Dict]:
+    """The previous per-query work: filter the whole KB into a list, then scan the shortlist per ranked id"""
+    category_faqs = [faqs[i] for i in np.flatnonzero(masks[category])]
+    assert category_faqs
+    results = []
+    for item in ranked:
+        faq = next((f for f in candidate_faqs if f['id'] == item['id']), None)
+        if faq:
+            faq = faq.copy()
+            faq['relevance_score'] = item['relevance_score']
+            results.append(faq)
+    return results
+
+
+def measure(size: int, repeats: int) -> Dict:
+    """Average seconds per query for scoring and for everything around it, at one KB size"""
+    kb = synthetic_kb(size)
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(kb, f)
+        path = f.name
+    try:
+        start = time.perf_counter()
+        # 512 buckets keep the 100k-row vector matrix at 200 MB (the default 4096 needs 1.6 GB)
+        rag = RAGSystem(faq_file=path, embed_fn=HashedNgramEmbedder(dim=512))
+        load_seconds = time.perf_counter() - start
+    finally:
+        os.remove(path)
+    rag.cache = None
+
+    faqs = kb['faqs']
+    categories = np.array([faq['category'] for faq in faqs])
+    masks = {category: categories == category for category in set(categories.tolist())}
+
+    scoring = selection = overhead = legacy = 0.0
+    for _ in range(repeats):
+        for question, category in QUESTIONS:
+            start = time.perf_counter()
+            scores = rag.prefetch_scores(question)
+            scoring += time.perf_counter() - start
+
+            # Top-k selection is vectorised and scales with the category size, so it's timed on its own
+            start = time.perf_counter()
+            shortlist = rag._shortlist(question, rag.category_indexes.get(category), rag.shortlist_size, scores)
+            selection += time.perf_counter() - start
+
+            rag._shortlist = lambda *args: shortlist
+            start = time.perf_counter()
+            results, search = rag._prepare_search(question, category, 3, scores)
+            if search is not None:
+                message = ranking_message(search['candidate_faqs'], 3)
+                rag._parse_ranking(message, search)
+            overhead += time.perf_counter() - start
+            del rag._shortlist
+
+            if search is not None:
+                start = time.perf_counter()
+                legacy_lookup(faqs, masks, category, search['candidate_faqs'],
+                              message.content[0].input['ranked_faqs'])
+                legacy += time.perf_counter() - start
+
+    queries = repeats * len(QUESTIONS)
+    return {"size": size, "load_seconds": load_seconds, "scoring": scoring / queries,
+            "selection": selection / queries, "overhead": overhead / queries, "legacy": legacy / queries}
+
+
+def main():
+    """Benchmark KB sizes 10 to 100k (pass sizes to override); makes no API calls, indexing 100k takes minutes"""
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1_000, 10_000, 100_000]
+
+    print("="*70)
+    print("RAG SCALING BENCHMARK")
+    print("="*70)
+
+    rows = []
+    for size in sizes:
+        repeats = 50 if size <= 10_000 else 10
+        rows.append(measure(size, repeats))
+
+    print(f"\n{'FAQs':>8} {'load':>8} {'scoring':>10} {'top-k':>10} {'overhead':>10} {'old lookup':>11}")
+    for row in rows:
+        print(f"{row['size']:>8,} {row['load_seconds']:>7.2f}s {row['scoring'] * 1e3:>8.2f}ms "
+              f"{row['selection'] * 1e3:>8.2f}ms {row['overhead'] * 1e6:>8.0f}µs {row['legacy'] * 1e6:>9.0f}µs")
+    print("\n📈 Scoring and top-k selection are vectorised passes that grow with the KB; the overhead")
+    print("   around them (category view, prompt, id lookup, result dicts) should stay flat, while the")
+    print("   old per-query category filter grows linearly")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Text Reduction Benchmark
+Runs the pipeline on reply-chain emails with and without TextReducer and compares tokens and stage latency
+"""
+
+import json
+import random
+import sys
+from typing import Dict, List
+
+from email_processor import TextReducer
+from intent_detector import IntentDetector
+from rag_system import RAGSystem
+from draft_generator import DraftGenerator
+from quality_checker import QualityChecker
+from pipeline import Pipeline
+from request_scheduler import RequestScheduler
+
+SIGNATURES = [
+    "\n\nThanks,\nSam\n\n-- \nSam Lee | Sound Engineer\nBlue Room Studios\n+1 (555) 010-2200 | blueroom.example.com\n",
+    "\n\nBest,\nPriya\n\nSent from my iPhone\n",
+    "\n\nRegards,\nChris Novak\n\nGet Outlook for Android\n"
+]
+
+DISCLAIMER = ("\n\nCONFIDENTIALITY NOTICE: This email and any attachments are confidential and intended solely "
+              "for the addressee. If you are not the intended recipient, please notify the sender and delete "
+              "this message. Please consider the environment before printing this email.\n")
+
+
+def reply_chain_emails(count: int, seed: int = 3) -> List[Dict]:
+    """Test emails sent as replies: a signature, sometimes a disclaimer and the store's earlier answer quoted"""
+    with open('../data/test_emails.json', 'r') as f:
+        emails = json.load(f)['test_emails']
+    with open('../data/faqs.json', 'r') as f:
+        faqs = json.load(f)['faqs']
+
+    rng = random.Random(seed)
+    chains = []
+    for i in range(count):
+        email = emails[i % len(emails)]
+        body = email['body'] + rng.choice(SIGNATURES)
+        if rng.random() < 0.5:
+            body += DISCLAIMER
+        previous = rng.choice(faqs)['answer']
+        quoted = "\n".join(f"> {line}" for line in f"Hi there,\n\n{previous}\n\nHappy playing,\nNorman".split("\n"))
+        body += f"\nOn Mon, Mar 2, 2026 at 9:14 AM Harmony Music Support <support@harmoneymusic.com> wrote:\n{quoted}\n"
+        chains.append({**email, "id": f"{email['id']}-{i}", "body": body})
+    return chains
+
+
+def run(emails: List[Dict], reduce_bodies: bool) -> Dict:
+    """One pipeline run with fresh modules and scheduler, so tokens and latency aren't shared between runs"""
+    scheduler = RequestScheduler()
+    pipeline = Pipeline(
+        IntentDetector(scheduler=scheduler), RAGSystem(scheduler=scheduler),
+        DraftGenerator(scheduler=scheduler), QualityChecker(scheduler=scheduler),
+        reuse_near_duplicates=False, reduce_bodies=reduce_bodies
+    )
+    pipeline.run_sync(emails)
+    stats = pipeline.get_stats()
+    stats['input_tokens'] = scheduler.get_stats()['input_tokens']
+    stats['reducer'] = pipeline.reducer.get_stats() if pipeline.reducer is not None else None
+    return stats
+
+
+def main():
+    """Benchmark on 20 reply-chain emails (pass a number to change the count); makes real API calls"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    emails = reply_chain_emails(count)
+
+    print("="*70)
+    print(f"TEXT REDUCTION BENCHMARK ({count} reply-chain emails)")
+    print("="*70)
+
+    full = run(emails, reduce_bodies=False)
+    reduced = run(emails, reduce_bodies=True)
+
+    reducer = reduced['reducer']
+    print(f"\n📉 Body: {reducer['avg_original_tokens']:.0f} → {reducer['avg_tokens']:.0f} tokens per email "
+          f"({reducer['saved_rate']*100:.0f}% removed; spans: {reducer['removed_spans']})")
+    print(f"🧾 Input tokens sent: {full['input_tokens'] / count:.0f} → {reduced['input_tokens'] / count:.0f} per email "
+          f"({(full['input_tokens'] - reduced['input_tokens']) / count:.0f} saved across all prompts)")
+
+    print(f"\n{'stage':>12} {'full body':>10} {'reduced':>10} {'change':>8}")
+    for stage, before in full['avg_stage_seconds'].items():
+        after = reduced['avg_stage_seconds'][stage]
+        change = f"{(after / before - 1) * 100:+.0f}%" if before else "n/a"
+        print(f"{stage:>12} {before:>9.2f}s {after:>9.2f}s {change:>8}")
+    print(f"\n⏱️  Wall time: {full['wall_seconds']:.1f}s → {reduced['wall_seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+CPU Pool Module
+Runs the CPU-bound local stages (preprocessing, text reduction, FAQ scoring) on a process pool
+"""
+
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from email_processor import Preprocessor, TextReducer
+from rag_system import RAGSystem
+
+# Per-process state, built once by _init_worker and reused by every chunk the worker runs
+_worker_state: Dict = {}
+
+
+def _init_worker(rag_options: Dict, reducer_options: Optional[Dict], barrier):
+    """Process initializer: compile the patterns and build the FAQ index once per worker"""
+    _worker_state['barrier'] = barrier
+    _worker_state['preprocessor'] = Preprocessor()
+    _worker_state['reducer'] = TextReducer(**reducer_options) if reducer_options is not None else None
+    with contextlib.redirect_stdout(io.StringIO()):
+        # One "Loaded N FAQs" line per worker is noise
+        _worker_state['rag'] = RAGSystem(use_llm=False, **rag_options)
+
+
+def _local_stages(emails: List[Dict]) -> List[Dict]:
+    """Preprocessing, body reduction and category-independent FAQ scores for a chunk of emails (runs in a worker)"""
+    preprocess = _worker_state['preprocessor'].preprocess
+    reducer = _worker_state['reducer']
+    prefetch_scores = _worker_state['rag'].prefetch_scores
+    results = []
+    for email in emails:
+        body = email.get('body', '')
+        reduction = reducer.reduce(body) if reducer is not None else None
+        results.append({
+            "preprocessed": preprocess(email),
+            "reduction": reduction,
+            "faq_scores": prefetch_scores(reduction['body'] if reduction is not None else body)
+        })
+    return results
+
+
+def _worker_pid(timeout: float) -> int:
+    """Warm-up task: holds its worker until every worker runs one, so no worker answers two"""
+    _worker_state['barrier'].wait(timeout)
+    return os.getpid()
+
+
+class CPUStagePool:
+    """
+    Process pool for the local, CPU-bound stages
+
+    Work is sent in chunks of `chunk_size` items, so the pickling and IPC
+    cost is paid per chunk rather than per email. The compiled state
+    (Preprocessor patterns, BM25 and vector FAQ indexes) is built once
+    per worker by the pool initializer and never pickled.
+
+    process() and process_async() stream results back in input order while
+    keeping at most `max_pending` chunks in flight, so a lazy source such
+    as email_ingest.stream_emails() is consumed with bounded memory.
+
+    The QC pre-checks stay in the pipeline process: they run once per
+    draft, after the LLM stages, and their verifier and rule counters feed
+    the pipeline's report.
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 64,
+                 max_pending: Optional[int] = None, rag_options: Optional[Dict] = None,
+                 reduce_bodies: bool = True, reducer_options: Optional[Dict] = None):
+        """
+        Args:
+            workers: Worker processes (defaults to the CPU count)
+            chunk_size: Items per task sent to a worker
+            max_pending: Chunks in flight before waiting for the oldest (defaults to 2 per worker)
+            rag_options: RAGSystem keyword arguments for the workers' FAQ index; must match
+                         the pipeline's RAGSystem (e.g. faq_file, vector_weight) so the
+                         prefetched scores are the ones it would compute itself
+            reduce_bodies: Run TextReducer on each body (FAQ scores are then computed
+                           on the reduced text); must match the pipeline's setting
+            reducer_options: TextReducer keyword arguments (e.g. max_tokens)
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * self.workers
+        # Shared through the initializer: a Barrier can only reach a process by inheritance
+        self._barrier = multiprocessing.Barrier(self.workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(rag_options or {}, (reducer_options or {}) if reduce_bodies else None, self._barrier)
+        )
+        self.stats = {"chunks": 0, "items": 0}
+
+    def warm_up(self, timeout: float = 60.0) -> int:
+        """
+        Start every worker and run its initializer now rather than on the first chunk
+
+        Each worker gets one task that waits on a barrier for all the others,
+        so every worker is started regardless of machine load.
+
+        Args:
+            timeout: Seconds a worker waits for the rest (threading.BrokenBarrierError after that)
+
+        Returns:
+            Number of distinct worker processes that answered
+        """
+        futures = [self.executor.submit(_worker_pid, timeout) for _ in range(self.workers)]
+        return len({future.result() for future in futures})
+
+    def _chunks(self, items: Iterable) -> Iterator[List]:
+        iterator = iter(items)
+        while True:
+            chunk = list(islice(iterator, self.chunk_size))
+            if not chunk:
+                return
+            self.stats['chunks'] += 1
+            self.stats['items'] += len(chunk)
+            yield chunk
+
+    def _map(self, function: Callable, items: Iterable) -> Iterator[Tuple]:
+        """(item, result) pairs in input order, at most max_pending chunks in flight"""
+        pending = deque()
+        for chunk in self._chunks(items):
+            pending.append((chunk, self.executor.submit(function, chunk)))
+            if len(pending) >= self.max_pending:
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            yield from zip(chunk, future.result())
+
+    async def _map_async(self, function: Callable, items: Iterable) -> AsyncIterator[Tuple]:
+        """_map() for an event loop: waits for workers without blocking it"""
+        pending = deque()
+        for chunk in self._chunks(items):
+            pending.append((chunk, asyncio.wrap_future(self.executor.submit(function, chunk))))
+            if len(pending) >= self.max_pending:
+                chunk, future = pending.popleft()
+                for pair in zip(chunk, await future):
+                    yield pair
+        while pending:
+            chunk, future = pending.popleft()
+            for pair in zip(chunk, await future):
+                yield pair
+
+    def process(self, emails: Iterable[Dict]) -> Iterator[Tuple[Dict, Dict]]:
+        """
+        Run the local stages for a stream of emails
+
+        Returns:
+            Iterator of (email, local) pairs in input order, where local has
+            'preprocessed' (Preprocessor.preprocess), 'reduction'
+            (TextReducer.reduce of the body, or None) and 'faq_scores'
+            (RAGSystem.prefetch_scores of the reduced body)
+        """
+        return self._map(_local_stages, emails)
+
+    def process_async(self, emails: Iterable[Dict]) -> AsyncIterator[Tuple[Dict, Dict]]:
+        """process() as an async iterator, for feeding the async LLM stages"""
+        return self._map_async(_local_stages, emails)
+
+    def get_stats(self) -> Dict:
+        """Workers, chunks sent and items processed"""
+        return {"workers": self.workers, "chunk_size": self.chunk_size, **self.stats}
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self) -> 'CPUStagePool':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -6,15 +6,92 @@ Uses Norman persona for high-quality, brand-consistent responses
 import anthropic
 import os
 import json
+import sys
+import time
 from dotenv import load_dotenv
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional
+
+from email_processor import preprocess_email
+from json_stream import IncrementalJsonParser
+from priority_queue import LatencyTracker
+from model_cascade import ModelCascade
+from result_cache import ResultCache
+from prompt_budget import PromptBudget, get_default_budget
+from request_scheduler import RequestScheduler, cacheable_system, get_default_scheduler
+from structured_output import StructuredOutput
 
 load_dotenv()
 
+# Bump whenever the draft prompt changes so cached drafts are not reused
+PROMPT_VERSION = "3"
+
+# Output budget of a brief draft (see generate_draft)
+BRIEF_MAX_TOKENS = 400
+
+DRAFT_TOOL = {
+    "name": "record_draft",
+    "description": "Record the email reply and its metadata",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "draft_body": {"type": "string", "description": "The email reply text"},
+            "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+            "snippets_used": {
+                "type": "array",
+                "items": {"type": ["string", "integer"]},
+                "description": "IDs of the snippets the reply is based on"
+            },
+            "needs_human": {"type": "boolean"}
+        },
+        "required": ["draft_body", "confidence", "snippets_used", "needs_human"]
+    }
+}
+
 
 class DraftGenerator:
-    def __init__(self):
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, cache: Optional[ResultCache] = None, scheduler: Optional[RequestScheduler] = None,
+                 cascade: Optional[ModelCascade] = None,
+                 templates_file: Optional[str] = '../data/draft_templates.json',
+                 template_min_relevance: float = 0.85, template_max_runner_up: float = 0.6,
+                 budget: Optional[PromptBudget] = None):
+        """
+        Args:
+            cache: Optional shared ResultCache for generated drafts
+            scheduler: RequestScheduler for API calls (defaults to the shared one)
+            cascade: Models to try in order, escalating when "confidence" is below its
+                     threshold (defaults to Sonnet only)
+            templates_file: Draft templates keyed by FAQ id (None disables the template fast path)
+            template_min_relevance: Relevance the top snippet needs for its template to be used
+            template_max_runner_up: Highest relevance any other snippet may have, so only
+                                    single, unambiguous matches are templated
+            budget: PromptBudget for draft prompts (defaults to the shared one)
+        """
+        # Retries are handled by the scheduler
+        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.async_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.model = "claude-sonnet-4-20250514"
+        self.cache = cache
+        self.scheduler = scheduler or get_default_scheduler()
+        self.cascade = cascade or ModelCascade([self.model])
+        self.budget = budget or get_default_budget()
+        self.scheduler.add_observer(self.budget.observe)
+        self.output = StructuredOutput(DRAFT_TOOL)
+        # Seconds to first token, first draft text and full result of streamed drafts
+        self.stream_latency = LatencyTracker()
+        
+        # Template fast path: FAQ id -> template with variants
+        self.templates: Dict[int, Dict] = {}
+        if templates_file:
+            with open(templates_file, 'r') as f:
+                self.templates = {t['faq_id']: t for t in json.load(f)['templates']}
+        self.template_min_relevance = template_min_relevance
+        self.template_max_runner_up = template_max_runner_up
+        self.template_stats = {
+            "template_hits": {t['name']: 0 for t in self.templates.values()},
+            "llm_calls": 0,
+            "template_seconds": 0.0,
+            "llm_seconds": 0.0
+        }
         
         # Persona configuration
         self.persona = {
@@ -35,24 +112,232 @@ class DraftGenerator:
 - Never use corporate jargon or overly formal language
 """
     
-    def generate_draft(self, customer_email: str, knowledge_snippets: List[Dict]) -> Dict:
+    def generate_draft(self, customer_email: str, knowledge_snippets: List[Dict], brief: bool = False,
+                       preprocessed: Optional[Dict] = None) -> Dict:
         """
         Generate email draft using persona-based prompt
         
+        A single, high-relevance snippet with a template is answered from the
+        template without calling Claude.
+        
         Args:
             customer_email: The customer's message
             knowledge_snippets: Relevant FAQs/articles from knowledge base
+            brief: Ask for a short holding reply with a smaller output budget
+                   (for emails a human will handle anyway)
+            preprocessed: preprocess_email output for the email (template fields);
+                          computed from customer_email if not given
             
         Returns:
             Dict with draft and metadata
         """
+        templated = self._template_draft(customer_email, knowledge_snippets, brief, preprocessed)
+        if templated is not None:
+            return templated
+        
+        cache_key, cached = self._cache_lookup(customer_email, knowledge_snippets, brief)
+        if cached is not None:
+            return cached
+        
+        start = time.perf_counter()
+        try:
+            result = self.output.call(
+                lambda: self.cascade.call(
+                    self.scheduler, self.client.messages.create,
+                    self._draft_request(customer_email, knowledge_snippets, brief),
+                    score=lambda payload: payload['confidence'], output=self.output
+                ),
+                lambda message: self._parse_draft(message, customer_email, cache_key)
+            )
+        except Exception as e:
+            print(f"Error generating draft: {e}")
+            return self._create_fallback_response(customer_email)
+        
+        self._record_llm_draft(time.perf_counter() - start)
+        return result
+    
+    async def generate_draft_async(self, customer_email: str, knowledge_snippets: List[Dict],
+                                   brief: bool = False, preprocessed: Optional[Dict] = None) -> Dict:
+        """Same as generate_draft, using the AsyncAnthropic client"""
+        templated = self._template_draft(customer_email, knowledge_snippets, brief, preprocessed)
+        if templated is not None:
+            return templated
+        
+        cache_key, cached = self._cache_lookup(customer_email, knowledge_snippets, brief)
+        if cached is not None:
+            return cached
+        
+        start = time.perf_counter()
+        try:
+            result = await self.output.call_async(
+                lambda: self.cascade.call_async(
+                    self.scheduler, self.async_client.messages.create,
+                    self._draft_request(customer_email, knowledge_snippets, brief),
+                    score=lambda payload: payload['confidence'], output=self.output
+                ),
+                lambda message: self._parse_draft(message, customer_email, cache_key)
+            )
+        except Exception as e:
+            print(f"Error generating draft: {e}")
+            return self._create_fallback_response(customer_email)
+        
+        self._record_llm_draft(time.perf_counter() - start)
+        return result
+    
+    def generate_draft_stream(self, customer_email: str, knowledge_snippets: List[Dict],
+                              brief: bool = False, preprocessed: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        Generate a draft while it is being written
+        
+        Yields events as they become available:
+            {"type": "text", "text": "..."}  - next piece of draft_body
+            {"type": "field", "name": "confidence", "value": 0.92}  - a metadata field closed
+            {"type": "done", "result": {...}}  - the same dict generate_draft returns
+        
+        The tool input is parsed as it streams in. The final result is
+        authoritative: if generation fails part-way (or the output is invalid),
+        it is the fallback response even though some text was already streamed.
+        Streamed text can't be taken back, so this always uses the cascade's
+        last (most capable) model.
+        """
+        start = time.perf_counter()
+        cache_key, known = None, self._template_draft(customer_email, knowledge_snippets, brief, preprocessed)
+        if known is None:
+            cache_key, known = self._cache_lookup(customer_email, knowledge_snippets, brief)
+        if known is not None:
+            yield {"type": "text", "text": known['draft']}
+            for name in ("confidence", "snippets_used", "needs_human"):
+                yield {"type": "field", "name": name, "value": known[name]}
+            yield {"type": "done", "result": known}
+            return
         
-        # Format knowledge snippets
-        snippets_text = self._format_snippets(knowledge_snippets)
+        parser = IncrementalJsonParser(stream_fields=["draft_body"])
+        first_token = first_text = None
+        try:
+            request = {**self._draft_request(customer_email, knowledge_snippets, brief),
+                       "model": self.cascade.final_model}
+            with self.scheduler.stream(self.client.messages.stream, **request) as stream:
+                for event in stream:
+                    # Tool input arrives as partial JSON; plain text only if no tool was used
+                    if event.type == "input_json":
+                        chunk = event.partial_json
+                    elif event.type == "text":
+                        chunk = event.text
+                    else:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        self.stream_latency.record("first_token", first_token)
+                    for kind, name, value in parser.feed(chunk):
+                        if kind == "text":
+                            if first_text is None:
+                                first_text = time.perf_counter() - start
+                                self.stream_latency.record("first_draft_text", first_text)
+                            yield {"type": "text", "text": value}
+                        elif name != "draft_body":
+                            yield {"type": "field", "name": name, "value": value}
+                message = stream.get_final_message()
+            result = self._parse_draft(message, customer_email, cache_key)
+        except Exception as e:
+            print(f"Error generating draft: {e}")
+            result = self._create_fallback_response(customer_email)
+        
+        self.stream_latency.record("complete", time.perf_counter() - start)
+        yield {"type": "done", "result": result}
+    
+    def get_stream_stats(self) -> Dict:
+        """count, p50, p95 and max of time to first token, first draft text and completion"""
+        return self.stream_latency.report()
+    
+    def _template_draft(self, customer_email: str, knowledge_snippets: List[Dict], brief: bool,
+                        preprocessed: Optional[Dict]) -> Optional[Dict]:
+        """
+        Draft filled from the template of the single high-relevance snippet, or None
+        
+        Only Claude's reranking counts: local shortlist scores are relative to
+        the best candidate, so its top snippet always scores 1.0.
+        
+        Template fields: order_number (only when the email names exactly one),
+        order_numbers, subject and name (the persona).
+        """
+        if brief or not self.templates or not knowledge_snippets:
+            return None
         
-        # Build the professional prompt
-        prompt = f"""SYSTEM:
-You are "{self.persona['name']}", a {self.persona['role']} at {self.persona['company']}.
+        start = time.perf_counter()
+        ranked = sorted(knowledge_snippets, key=lambda s: s.get('relevance_score', 0), reverse=True)
+        top = ranked[0]
+        template = self.templates.get(top.get('id'))
+        if template is None or top.get('relevance_source') != "claude" or \
+                top.get('relevance_score', 0) < self.template_min_relevance:
+            return None
+        if len(ranked) > 1 and ranked[1].get('relevance_score', 0) > self.template_max_runner_up:
+            return None
+        
+        if preprocessed is None:
+            preprocessed = preprocess_email({"subject": "", "body": customer_email})
+        fields = {"name": self.persona['name']}
+        if preprocessed['order_numbers']:
+            fields['order_numbers'] = ", ".join(f"#{n}" for n in sorted(preprocessed['order_numbers']))
+        if len(preprocessed['order_numbers']) == 1:
+            fields['order_number'] = preprocessed['order_numbers'][0]
+        if preprocessed.get('subject'):
+            fields['subject'] = preprocessed['subject']
+        
+        variant = next((v for v in template['variants'] if all(f in fields for f in v['requires'])), None)
+        if variant is None:
+            return None
+        
+        self.template_stats['template_hits'][template['name']] += 1
+        self.template_stats['template_seconds'] += time.perf_counter() - start
+        return {
+            "draft": variant['body'].format_map(fields),
+            "confidence": top['relevance_score'],
+            "snippets_used": [top['id']],
+            "needs_human": False,
+            "persona": self.persona['name'],
+            "template": template['name']
+        }
+    
+    def _record_llm_draft(self, seconds: float):
+        self.template_stats['llm_calls'] += 1
+        self.template_stats['llm_seconds'] += seconds
+    
+    def get_template_stats(self) -> Dict:
+        """Template hit rate and the generation latency each template saved"""
+        stats = self.template_stats
+        hits = sum(stats['template_hits'].values())
+        total = hits + stats['llm_calls']
+        avg_llm = stats['llm_seconds'] / stats['llm_calls'] if stats['llm_calls'] else 0.0
+        avg_template = stats['template_seconds'] / hits if hits else 0.0
+        saved_per_hit = max(avg_llm - avg_template, 0.0)
+        
+        return {
+            "total": total,
+            "template_hits": hits,
+            "llm_calls": stats['llm_calls'],
+            "hit_rate": hits / total if total else 0.0,
+            "avg_llm_latency": avg_llm,
+            "avg_template_latency": avg_template,
+            "estimated_seconds_saved": hits * saved_per_hit,
+            "by_template": {
+                name: {"hits": count, "estimated_seconds_saved": count * saved_per_hit}
+                for name, count in stats['template_hits'].items()
+            }
+        }
+    
+    def _cache_lookup(self, customer_email: str, knowledge_snippets: List[Dict], brief: bool = False):
+        """Return (cache_key, cached_draft); both are None when caching is off"""
+        if self.cache is None:
+            return None, None
+        cache_key = ResultCache.make_key(
+            "draft", [customer_email, self._format_snippets(knowledge_snippets), self.persona, self.voice_rules, brief],
+            self.cascade.cache_id, PROMPT_VERSION
+        )
+        return cache_key, self.cache.get(cache_key)
+    
+    def _system_prompt(self) -> str:
+        """Persona, voice rules and output contract: the static, cacheable part of the prompt"""
+        return f"""You are "{self.persona['name']}", a {self.persona['role']} at {self.persona['company']}.
 You have {self.persona['experience']} of experience.
 
 Your job is to reply to customers:
@@ -66,20 +351,14 @@ VOICE & STYLE:
 {self.voice_rules}
 
 KNOWLEDGE BASE:
-You have access to internal FAQs and policies below.
+You have access to internal FAQs and policies in the user message.
 Use ONLY these to answer. Do not invent new policies or facts.
 
 TASK:
 Given the customer email and relevant knowledge snippets, write a complete email reply.
 
 FORMAT:
-Return ONLY a raw JSON object (NO markdown code fences, NO backticks):
-{{{{
-  "draft_body": "The email reply text",
-  "confidence": 0.95,
-  "snippets_used": ["List of snippet IDs"],
-  "needs_human": false
-}}}}
+Record the reply with the record_draft tool: draft_body, confidence, snippets_used and needs_human.
 
 CRITICAL CONSISTENCY RULE:
 If your draft_body mentions ANY of these phrases, you MUST set "needs_human": true:
@@ -102,61 +381,55 @@ Set "confidence" based on:
 - 0.50-0.69: Mostly guidance, minimal direct answer
 - Below 0.50: No good answer, definite escalation
 
-CUSTOMER MESSAGE:
-{customer_email}
-
-RELEVANT KNOWLEDGE SNIPPETS:
-{snippets_text}
-
 CONSTRAINTS:
 - If customer asks about SPECIFIC order and you lack live data: set "needs_human": true, "confidence": 0.70 or lower
 - If you CAN fully answer from FAQs: set "needs_human": false, "confidence": 0.85+
 - NEVER mix high confidence (0.90+) with escalation phrases
-- Do not invent facts not in snippets
+- Do not invent facts not in snippets"""
+    
+    def _draft_request(self, customer_email: str, knowledge_snippets: List[Dict], brief: bool = False) -> Dict:
+        """Build the messages.create parameters for one draft, within the draft token budget"""
+        
+        length_rule = ""
+        if brief:
+            length_rule = "\n\nKeep draft_body under 80 words: acknowledge the issue and say a specialist will follow up."
+        
+        def build(text: str, snippets: List[Dict]) -> Dict:
+            # Format knowledge snippets
+            snippets_text = self._format_snippets(snippets)
+            
+            # Only the customer message and snippets change between requests
+            prompt = f"""CUSTOMER MESSAGE:
+{text}
 
-Respond with ONLY the JSON object, no additional text:"""
+RELEVANT KNOWLEDGE SNIPPETS:
+{snippets_text}{length_rule}"""
 
-        try:
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1500,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            response_text = message.content[0].text.strip()
-            
-            # Remove markdown code fences if present
-            if response_text.startswith('```'):
-                # Remove opening fence (```json or ```)
-                lines = response_text.split('\n')
-                if lines[0].startswith('```'):
-                    lines = lines[1:]  # Skip first line
-                # Remove closing fence
-                if lines and lines[-1].strip() == '```':
-                    lines = lines[:-1]  # Skip last line
-                response_text = '\n'.join(lines).strip()
-            
-            # Parse JSON response
-            result = json.loads(response_text)
-            
             return {
-                "draft": result.get("draft_body", ""),
-                "confidence": result.get("confidence", 0.0),
-                "snippets_used": result.get("snippets_used", []),
-                "needs_human": result.get("needs_human", True),
-                "persona": self.persona['name']
+                "model": self.model,
+                "max_tokens": BRIEF_MAX_TOKENS if brief else 1500,
+                "system": cacheable_system(self._system_prompt()),
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ],
+                **self.output.request_params()
             }
-            
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON: {e}")
-            print(f"Response was: {response_text}")
-            return self._create_fallback_response(customer_email)
-            
-        except Exception as e:
-            print(f"Error generating draft: {e}")
-            return self._create_fallback_response(customer_email)
+        
+        return self.budget.fit("draft", build, customer_email, knowledge_snippets, min_items=1)
+    
+    def _parse_draft(self, message, customer_email: str, cache_key: Optional[str]) -> Dict:
+        """Turn a Claude response into the draft result dict (raises StructuredOutputError)"""
+        result = self.output.parse(message)
+        draft = {
+            "draft": result["draft_body"],
+            "confidence": result["confidence"],
+            "snippets_used": result["snippets_used"],
+            "needs_human": result["needs_human"],
+            "persona": self.persona['name']
+        }
+        if cache_key is not None:
+            self.cache.set(cache_key, draft)
+        return draft
     
     def _format_snippets(self, snippets: List[Dict]) -> str:
         """Format knowledge snippets for prompt"""
@@ -177,7 +450,7 @@ A: {snippet.get('answer', 'N/A')}
     def _create_fallback_response(self, customer_email: str) -> Dict:
         """Create safe fallback when generation fails"""
         return {
-            "draft": f"Thank you for contacting Harmony Music Store. I want to make sure I give you the most accurate information. I'm forwarding your message to our specialist team who will respond within 24 hours.",
+            "draft": f"Thank you for contacting Harmony Music Store. I want to make sure I give you the most accurate information. I'm forwarding your message to our specialist team, who will get back to you as soon as possible.",
             "confidence": 0.0,
             "snippets_used": [],
             "needs_human": True,
@@ -186,7 +459,7 @@ A: {snippet.get('answer', 'N/A')}
 
 
 def main():
-    """Test draft generation"""
+    """Test draft generation (pass --stream to print the draft as it is written)"""
     
     # Load test data
     with open('../data/test_emails.json', 'r') as f:
@@ -213,12 +486,25 @@ def main():
     print(f"📚 Using {len(relevant_faqs)} knowledge snippets\n")
     
     # Generate draft
-    result = generator.generate_draft(test_email['body'], relevant_faqs)
-    
-    print(f"✉️  DRAFT REPLY (by {result['persona']}):")
-    print("-"*70)
-    print(result['draft'])
-    print("-"*70)
+    if '--stream' in sys.argv:
+        print(f"✉️  DRAFT REPLY (streaming):")
+        print("-"*70)
+        for event in generator.generate_draft_stream(test_email['body'], relevant_faqs):
+            if event['type'] == "text":
+                print(event['text'], end="", flush=True)
+            elif event['type'] == "done":
+                result = event['result']
+        print()
+        print("-"*70)
+        for stage, latency in generator.get_stream_stats().items():
+            print(f"  ⏱️  {stage}: {latency['p50']:.2f}s")
+    else:
+        result = generator.generate_draft(test_email['body'], relevant_faqs)
+        
+        print(f"✉️  DRAFT REPLY (by {result['persona']}):")
+        print("-"*70)
+        print(result['draft'])
+        print("-"*70)
     print(f"\n📊 Metadata:")
     print(f"  Confidence: {result['confidence']:.2f}")
     print(f"  Needs Human Review: {result['needs_human']}")
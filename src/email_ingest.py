@@ -0,0 +1,331 @@
+"""
+Email Ingest Module
+Streams emails out of mbox files, .eml directories and JSONL exports with resumable checkpoints
+"""
+
+import html
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from email import policy
+from email.header import decode_header, make_header
+from email.message import EmailMessage, Message
+from email.parser import BytesParser
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# Readers yield (position, email): the position to resume from *after* this email,
+# a byte offset for mbox / JSONL files and the file name for .eml directories
+Record = Tuple[Any, Dict]
+
+MBOX_SEPARATOR = b"From "
+# mboxrd quoting: body lines starting with "From " are stored as ">From ", ">>From ", ...
+QUOTED_FROM = re.compile(rb"^>(>*From )")
+HTML_TAG = re.compile(r"<[^>]+>")
+HTML_BREAK = re.compile(r"<\s*(?:br|/p|/div|/li|/tr)[^>]*>", re.IGNORECASE)
+
+# The legacy compat32 policy: several times faster than policy.default, whose header
+# objects dominate parse time; headers and bodies are decoded explicitly below
+PARSER = BytesParser()
+
+
+def _text_part(message: Message) -> Optional[Message]:
+    """First inline text/plain part, else the first inline text/html part"""
+    html_part = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == 'attachment':
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/plain':
+            return part
+        if content_type == 'text/html' and html_part is None:
+            html_part = part
+    return html_part
+
+
+def _text_body(message: Message) -> str:
+    """The text/plain body (an HTML body with its tags stripped if there is no plain part)"""
+    part = _text_part(message)
+    if part is None:
+        return ""
+    # Transfer encoding (base64, quoted-printable) first, then the charset
+    payload = part.get_payload(decode=True) or b""
+    try:
+        text = payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+    except LookupError:
+        # Unknown charset name
+        text = payload.decode('utf-8', errors='replace')
+    if part.get_content_type() == 'text/html':
+        text = html.unescape(HTML_TAG.sub(' ', HTML_BREAK.sub('\n', text)))
+    return text.strip()
+
+
+def _header(message: Message, name: str) -> str:
+    """Header value with RFC 2047 encoded words decoded"""
+    value = message.get(name)
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(str(value)))).strip()
+    except (ValueError, LookupError, UnicodeError):
+        # Malformed encoded word or unknown charset: keep the raw text
+        return str(value).strip()
+
+
+def message_to_email(message: Message, fallback_id: Any) -> Dict:
+    """
+    Convert a parsed MIME message into the dict preprocess_email expects
+
+    Returns:
+        Dict with id (Message-ID or fallback_id), subject, body, from and,
+        when the Date header parses, received_at (epoch seconds)
+    """
+    result = {
+        "id": _header(message, 'message-id').strip('<>') or fallback_id,
+        "subject": _header(message, 'subject'),
+        "body": _text_body(message),
+        "from": _header(message, 'from')
+    }
+    try:
+        result['received_at'] = parsedate_to_datetime(message['date']).timestamp()
+    except (TypeError, ValueError, IndexError):
+        # Missing or unparseable Date header
+        pass
+    return result
+
+
+def iter_mbox(path: str, start: Optional[int] = None) -> Iterator[Record]:
+    """
+    Stream the messages of an mbox file
+
+    Reads line by line, so memory is bounded by the largest single message,
+    not the file. mboxrd ">From " quoting is undone.
+
+    Args:
+        path: mbox file
+        start: Byte offset of a "From " line to resume from (None = beginning)
+    """
+    with open(path, 'rb') as f:
+        offset = start or 0
+        f.seek(offset)
+        lines = []
+        in_message = False
+        previous_blank = True
+        for line in f:
+            if line.startswith(MBOX_SEPARATOR) and previous_blank:
+                if in_message:
+                    yield offset, message_to_email(PARSER.parsebytes(b"".join(lines)), f"{path}:{message_offset}")
+                lines = []
+                in_message = True
+                message_offset = offset
+            elif in_message:
+                lines.append(QUOTED_FROM.sub(rb"\1", line))
+            offset += len(line)
+            previous_blank = not line.strip()
+
+        if in_message:
+            yield offset, message_to_email(PARSER.parsebytes(b"".join(lines)), f"{path}:{message_offset}")
+
+
+def iter_eml_dir(path: str, start: Optional[str] = None) -> Iterator[Record]:
+    """
+    Stream a directory of .eml files in name order
+
+    Args:
+        path: Directory
+        start: Name of the last file already ingested (None = beginning)
+    """
+    names = sorted(name for name in os.listdir(path) if name.lower().endswith('.eml'))
+    for name in names:
+        if start is not None and name <= start:
+            continue
+        with open(os.path.join(path, name), 'rb') as f:
+            message = PARSER.parse(f)
+        yield name, message_to_email(message, name)
+
+
+def iter_jsonl(path: str, start: Optional[int] = None) -> Iterator[Record]:
+    """
+    Stream a JSONL export, one email dict per line
+
+    Args:
+        path: JSONL file
+        start: Byte offset of a line to resume from (None = beginning)
+    """
+    with open(path, 'rb') as f:
+        offset = start or 0
+        f.seek(offset)
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping malformed JSONL line at byte {line_offset}: {e}")
+                continue
+            if isinstance(record, dict):
+                yield offset, record
+
+
+def iter_json_file(path: str, start: Optional[int] = None) -> Iterator[Record]:
+    """
+    The legacy {"test_emails": [...]} format (loaded whole; positions are list indexes)
+    """
+    with open(path, 'r') as f:
+        emails = json.load(f)['test_emails']
+    for index in range(start or 0, len(emails)):
+        yield index + 1, emails[index]
+
+
+READERS: Dict[str, Callable[[str, Any], Iterator[Record]]] = {
+    "mbox": iter_mbox,
+    "eml": iter_eml_dir,
+    "jsonl": iter_jsonl,
+    "json": iter_json_file
+}
+
+
+def detect_format(path: str) -> str:
+    """Reader for a path: directories are .eml folders, otherwise by extension (default mbox)"""
+    if os.path.isdir(path):
+        return "eml"
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return "jsonl"
+    if extension == '.json':
+        return "json"
+    return "mbox"
+
+
+class IngestCheckpoint:
+    """
+    Resume position of one ingest, stored as a small JSON file
+
+    Saved atomically (write + fsync + rename), so a crash mid-save leaves the
+    previous checkpoint intact.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, source: str) -> Optional[Dict]:
+        """Saved {"position", "count"} for this source, or None"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state.get('source') != os.path.abspath(source):
+            print(f"Ignoring checkpoint {self.path}: it belongs to {state.get('source')}")
+            return None
+        return state
+
+    def save(self, source: str, position: Any, count: int):
+        state = {"source": os.path.abspath(source), "position": position, "count": count, "saved_at": time.time()}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+
+def stream_emails(path: str, checkpoint_path: Optional[str] = None, save_every: int = 1000,
+                  source_format: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Lazily yield {'subject', 'body', ...} dicts from a mailbox export
+
+    With a checkpoint, an email counts as ingested once the consumer asks for
+    the next one; the checkpoint is saved every `save_every` emails and when
+    the stream is closed (including by an exception in the consumer), so a
+    restarted ingest repeats at most the email that was being handled.
+
+    Args:
+        path: mbox file, directory of .eml files, JSONL file or legacy JSON file
+        checkpoint_path: Optional checkpoint file to resume from and update
+        save_every: Emails between checkpoint saves
+        source_format: "mbox", "eml", "jsonl" or "json" (detected from the path by default)
+    """
+    reader = READERS[source_format or detect_format(path)]
+    checkpoint = IngestCheckpoint(checkpoint_path) if checkpoint_path else None
+    state = checkpoint.load(path) if checkpoint else None
+    position = state['position'] if state else None
+    count = state['count'] if state else 0
+
+    unsaved = 0
+    try:
+        for next_position, email in reader(path, position):
+            yield email
+            position = next_position
+            count += 1
+            unsaved += 1
+            if checkpoint and unsaved >= save_every:
+                checkpoint.save(path, position, count)
+                unsaved = 0
+    finally:
+        if checkpoint and unsaved:
+            checkpoint.save(path, position, count)
+
+
+def write_mbox(emails, path: str):
+    """Write email dicts as an mbox file (used to build test mailboxes)"""
+    with open(path, 'wb') as f:
+        for index, email in enumerate(emails):
+            message = EmailMessage()
+            message['Subject'] = email.get('subject', '')
+            message['From'] = email.get('from', 'customer@example.com')
+            message['Message-ID'] = f"<{index}@example.com>"
+            message.set_content(email.get('body', ''))
+            body = message.as_bytes(policy=policy.default)
+            body = re.sub(rb"(?m)^(>*From )", rb">\1", body)
+            f.write(b"From customer@example.com Thu Jan  1 00:00:00 2026\n" + body + b"\n")
+
+
+def main():
+    """Stream a mailbox (path argument) or a generated one, then resume a half-finished ingest"""
+    generated = len(sys.argv) < 2
+    if generated:
+        with open('../data/test_emails.json', 'r') as f:
+            emails = json.load(f)['test_emails']
+        path = os.path.join(tempfile.mkdtemp(), "backlog.mbox")
+        write_mbox((emails[i % len(emails)] for i in range(5_000)), path)
+    else:
+        path = sys.argv[1]
+
+    print("="*70)
+    print(f"STREAMING INGEST: {path} ({os.path.getsize(path) / 1e6:.1f} MB, {detect_format(path)})")
+    print("="*70)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for email in stream_emails(path):
+        if count < 3:
+            print(f"\n📧 {email['subject']}: {email['body'][:60]}...")
+        count += 1
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"\n📥 {count} emails in {seconds:.1f}s ({count / seconds:.0f}/s), peak memory {peak / 1e6:.2f} MB")
+
+    # Simulate a crash half-way, then resume from the checkpoint
+    checkpoint_path = f"{path}.checkpoint.json"
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    first = 0
+    for email in stream_emails(path, checkpoint_path, save_every=100):
+        first += 1
+        if first == count // 2:
+            break
+    second = sum(1 for _ in stream_emails(path, checkpoint_path, save_every=100))
+    print(f"🔁 Stopped after {first}, resumed with {second} more "
+          f"({first + second - count} re-delivered: the one being handled when it stopped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,17 @@ Handles cleaning and extracting key information from raw emails
 
 import re
 import json
-from typing import Dict, List
+import string
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from request_scheduler import CHARS_PER_TOKEN
+
+URGENT_KEYWORDS = [
+    'urgent', 'asap', 'immediately', 'emergency',
+    'angry', 'unacceptable', 'furious', 'disappointed',
+    'third time', 'still waiting', 'never received'
+]
 
 def extract_order_number(text: str) -> List[str]:
     """Extract order numbers from text"""
@@ -26,11 +36,7 @@ def extract_order_number(text: str) -> List[str]:
 
 def detect_urgency(text: str) -> str:
     """Detect if email is urgent based on language"""
-    urgent_keywords = [
-        'urgent', 'asap', 'immediately', 'emergency',
-        'angry', 'unacceptable', 'furious', 'disappointed',
-        'third time', 'still waiting', 'never received'
-    ]
+    urgent_keywords = URGENT_KEYWORDS
     
     text_lower = text.lower()
     
@@ -84,6 +90,292 @@ def preprocess_email(raw_email: Dict) -> Dict:
     }
 
 
+class Preprocessor:
+    """
+    Precompiled preprocessing engine
+    
+    Produces exactly what preprocess_email produces (which stays as the
+    reference implementation), but compiles its patterns once and does the
+    per-email work in a few C-level passes instead of per-character Python:
+    
+    - whitespace is collapsed with str.split/join (same Unicode whitespace as \\s)
+    - order-number regexes run only when the text contains '#' or 'order',
+      the "order" one case-sensitively on the lowercased text
+    - uppercase letters of ASCII text are counted with one bytes.translate
+    - keywords are matched against the lowercased text once
+    """
+    
+    # Uppercase ASCII letters, deleted to count them
+    ASCII_UPPERCASE = string.ascii_uppercase.encode('ascii')
+    
+    def __init__(self, urgent_keywords: Iterable[str] = URGENT_KEYWORDS):
+        self.urgent_keywords = tuple(keyword.lower() for keyword in urgent_keywords)
+        self.hash_pattern = re.compile(r'#(\d{5,})')
+        # Run on the lowercased text: same matches as the IGNORECASE reference, much faster
+        self.order_pattern = re.compile(r'order[:\s]+#?(\d{5,})')
+    
+    def extract_order_numbers(self, text: str, text_lower: str) -> List[str]:
+        """Same result as extract_order_number(text), including the order of the list"""
+        # Matches are added to the set in the reference's order so iteration order is identical
+        matches = self.hash_pattern.findall(text) if '#' in text else []
+        if 'order' in text_lower:
+            matches += self.order_pattern.findall(text_lower)
+        return list(set(matches))
+    
+    def detect_urgency(self, text: str, text_lower: str) -> str:
+        """Same result as detect_urgency(text)"""
+        if text.isascii():
+            caps = len(text) - len(text.encode('ascii').translate(None, self.ASCII_UPPERCASE))
+        else:
+            caps = sum(1 for c in text if c.isupper())
+        caps_ratio = caps / len(text) if len(text) > 0 else 0
+        
+        urgent_count = 0
+        for keyword in self.urgent_keywords:
+            if keyword in text_lower:
+                urgent_count += 1
+        
+        if urgent_count >= 2 or caps_ratio > 0.3 or '!!!' in text:
+            return "HIGH"
+        elif urgent_count == 1:
+            return "MEDIUM"
+        else:
+            return "LOW"
+    
+    def preprocess(self, raw_email: Dict) -> Dict:
+        """Same result as preprocess_email(raw_email)"""
+        subject = raw_email.get('subject', '')
+        body = raw_email.get('body', '')
+        
+        cleaned = ' '.join(f"{subject}. {body}".split())
+        cleaned_lower = cleaned.lower()
+        order_numbers = self.extract_order_numbers(cleaned, cleaned_lower)
+        
+        return {
+            'subject': subject,
+            'body': body,
+            'cleaned_text': cleaned,
+            'order_numbers': order_numbers,
+            'urgency_level': self.detect_urgency(cleaned, cleaned_lower),
+            'length': len(cleaned),
+            'has_order_number': len(order_numbers) > 0
+        }
+    
+    def preprocess_batch(self, emails: Iterable[Dict]) -> List[Dict]:
+        """preprocess() for every email, in input order"""
+        preprocess = self.preprocess
+        return [preprocess(email) for email in emails]
+
+
+# Lines that start the quoted history of a reply (everything from here on is removed)
+REPLY_HEADER_PATTERN = re.compile(
+    r"^(?:On\b.{0,250}\b(?:wrote|said):"
+    r"|Le\b.{0,250}\ba écrit\s?:"
+    r"|Am\b.{0,250}\bschrieb\b.{0,80}:"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|_{10,})\s*$",
+    re.IGNORECASE
+)
+# Outlook-style header block: "From:" followed within a few lines by "Sent:"/"Date:"
+OUTLOOK_FROM_PATTERN = re.compile(r"^\*?From:\*?\s", re.IGNORECASE)
+OUTLOOK_HEADER_PATTERN = re.compile(r"^\*?(?:Sent|Date|To|Subject):\*?\s", re.IGNORECASE)
+# Forwarded content is kept: nothing after one of these counts as reply history
+FORWARD_MARKER_PATTERN = re.compile(r"^(?:-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)\s*$",
+                                    re.IGNORECASE)
+QUOTED_LINE_PATTERN = re.compile(r"^\s*>")
+SIGNATURE_DELIMITER_PATTERN = re.compile(r"^--\s?$")
+MOBILE_FOOTER_PATTERN = re.compile(
+    r"^(?:Sent from my \w[\w\s-]*|Sent from (?:Mail|Outlook|Yahoo Mail|Gmail)\b.*"
+    r"|Get Outlook for \w+.*|Sent via \w+.*)$",
+    re.IGNORECASE
+)
+# Legal and environmental footers; a paragraph containing one of these is boilerplate
+BOILERPLATE_PATTERN = re.compile(
+    r"intended (?:solely )?(?:only )?for the (?:use of the )?(?:intended )?(?:addressee|recipient)"
+    r"|if you (?:are not|have received this (?:e-?mail|message) in error)"
+    r"|confidentiality notice|this (?:e-?mail|message)(?: and any attachments?)? (?:is|are|may be|contains?) "
+    r"(?:strictly )?(?:confidential|privileged)"
+    r"|consider the environment before printing|scanned for viruses",
+    re.IGNORECASE
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text (same ratio the request scheduler uses)"""
+    return len(text) // CHARS_PER_TOKEN
+
+
+class TextReducer:
+    """
+    Removes what the prompts don't need from an email body
+    
+    - quoted history: everything from a reply header ("On ... wrote:",
+      "-----Original Message-----", an Outlook From:/Sent: block) onwards,
+      and any other "> " quoted lines
+    - signatures: from a "-- " delimiter to the end of the message, and
+      mobile footers such as "Sent from my iPhone"
+    - boilerplate: later paragraphs with legal or environmental disclaimers
+    - anything beyond max_tokens, cut at a word boundary
+    
+    Forwarded messages are kept: a customer forwarding an order
+    confirmation is sending the details on purpose. If nothing would be
+    left, the body is returned unchanged.
+    
+    Every removed span is returned with its kind and its offsets in the
+    original body, so the full text can always be reconstructed.
+    """
+    
+    def __init__(self, max_tokens: Optional[int] = 1000):
+        """
+        Args:
+            max_tokens: Token budget for the reduced body (None = no truncation)
+        """
+        self.max_tokens = max_tokens
+        self.stats = {"emails": 0, "reduced": 0, "original_tokens": 0, "tokens": 0}
+        self.removed = Counter()
+    
+    @staticmethod
+    def _history_start(lines: List[str]) -> Optional[int]:
+        """Index of the line where the quoted reply history begins"""
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if FORWARD_MARKER_PATTERN.match(stripped):
+                return None
+            if REPLY_HEADER_PATTERN.match(stripped):
+                return i
+            # "On <date>, <name> <address>" wrapped onto a second "wrote:" line
+            if (stripped.startswith("On ") and i + 1 < len(lines)
+                    and REPLY_HEADER_PATTERN.match(f"{stripped} {lines[i + 1].strip()}")):
+                return i
+            if OUTLOOK_FROM_PATTERN.match(stripped):
+                following = lines[i + 1:i + 5]
+                if sum(1 for other in following if OUTLOOK_HEADER_PATTERN.match(other.strip())) >= 2:
+                    return i
+        return None
+    
+    def _classify(self, lines: List[str]) -> List[Optional[str]]:
+        """Removal kind per line (None = kept)"""
+        kinds: List[Optional[str]] = [None] * len(lines)
+        end = len(lines)
+        
+        history = self._history_start(lines)
+        if history is not None:
+            kinds[history:] = ["quoted"] * (end - history)
+            end = history
+        
+        for i in range(end):
+            stripped = lines[i].strip()
+            if SIGNATURE_DELIMITER_PATTERN.match(lines[i].rstrip('\r\n')):
+                kinds[i:end] = ["signature"] * (end - i)
+                end = i
+                break
+            if QUOTED_LINE_PATTERN.match(lines[i]):
+                kinds[i] = "quoted"
+            elif MOBILE_FOOTER_PATTERN.match(stripped):
+                kinds[i] = "signature"
+        
+        # Disclaimer paragraphs, never the first one
+        paragraph: List[int] = []
+        seen_content = False
+        for i in range(end + 1):
+            if i < end and lines[i].strip():
+                paragraph.append(i)
+                continue
+            if paragraph:
+                text = " ".join(lines[j].strip() for j in paragraph)
+                if seen_content and BOILERPLATE_PATTERN.search(text):
+                    for j in paragraph:
+                        kinds[j] = kinds[j] or "boilerplate"
+                seen_content = seen_content or any(kinds[j] is None for j in paragraph)
+                paragraph = []
+        return kinds
+    
+    def reduce(self, body: str) -> Dict:
+        """
+        Reduce one email body
+        
+        Returns:
+            Dict with body (the reduced text), removed (list of {kind, start,
+            end, text} spans of the original body, kind being "quoted",
+            "signature", "boilerplate" or "truncated"), original_tokens and tokens
+        """
+        lines = body.splitlines(keepends=True)
+        kinds = self._classify(lines)
+        if all(kind is not None for kind, line in zip(kinds, lines) if line.strip()):
+            # Nothing but history or signature: better the whole thing than nothing
+            kinds = [None] * len(lines)
+        
+        # Segments of the original body: [start, end, kind]
+        segments = []
+        offset = 0
+        for line, kind in zip(lines, kinds):
+            segments.append([offset, offset + len(line), kind])
+            offset += len(line)
+        
+        if self.max_tokens is not None:
+            budget = self.max_tokens * CHARS_PER_TOKEN
+            for index, segment in enumerate(segments):
+                if segment[2] is not None:
+                    continue
+                length = segment[1] - segment[0]
+                if length <= budget:
+                    budget -= length
+                    continue
+                # Cut this line at the last space that fits, drop every kept line after it
+                cut = body.rfind(' ', segment[0], segment[0] + budget)
+                cut = cut if cut > segment[0] else segment[0] + budget
+                tail = [cut, segment[1], "truncated"]
+                segment[1] = cut
+                for later in segments[index + 1:]:
+                    if later[2] is None:
+                        later[2] = "truncated"
+                segments.insert(index + 1, tail)
+                break
+        
+        reduced = "".join(body[start:end] for start, end, kind in segments if kind is None)
+        reduced = re.sub(r"\n\s*\n(?:\s*\n)+", "\n\n", reduced).strip()
+        
+        removed = []
+        for start, end, kind in segments:
+            if kind is None or start == end:
+                continue
+            if removed and removed[-1]['kind'] == kind and removed[-1]['end'] == start:
+                removed[-1]['end'] = end
+            else:
+                removed.append({"kind": kind, "start": start, "end": end})
+        for span in removed:
+            span['text'] = body[span['start']:span['end']]
+        
+        result = {
+            "body": reduced,
+            "removed": removed,
+            "original_tokens": estimate_tokens(body),
+            "tokens": estimate_tokens(reduced)
+        }
+        self.record(result)
+        return result
+    
+    def record(self, result: Dict):
+        """Add a reduce() result to the stats (also for results computed in another process)"""
+        self.stats['emails'] += 1
+        self.stats['reduced'] += 1 if result['removed'] else 0
+        self.stats['original_tokens'] += result['original_tokens']
+        self.stats['tokens'] += result['tokens']
+        self.removed.update(span['kind'] for span in result['removed'])
+    
+    def get_stats(self) -> Dict:
+        """Average body tokens before and after reduction and the spans removed per kind"""
+        stats = dict(self.stats)
+        emails = stats['emails']
+        saved = stats['original_tokens'] - stats['tokens']
+        stats['avg_original_tokens'] = stats['original_tokens'] / emails if emails else 0.0
+        stats['avg_tokens'] = stats['tokens'] / emails if emails else 0.0
+        stats['avg_tokens_saved'] = saved / emails if emails else 0.0
+        stats['saved_rate'] = saved / stats['original_tokens'] if stats['original_tokens'] else 0.0
+        stats['removed_spans'] = dict(self.removed)
+        return stats
+
+
 def main():
     """Test with sample emails"""
     # Load test emails
@@ -104,6 +396,17 @@ def main():
         print(f"✓ Urgency: {result['urgency_level']}")
         print(f"✓ Length: {result['length']} characters")
         print("-"*70)
+    
+    # A reply with a signature, a disclaimer and the quoted history
+    reply = (f"{data['test_emails'][0]['body']}\n\nThanks,\nSam\n\n-- \nSam Lee | Blue Room Studios\n"
+             "+1 (555) 010-2200\n\nThis email and any attachments are confidential and intended solely for "
+             "the addressee.\n\nOn Mon, Mar 2, 2026 at 9:14 AM Harmony Music <support@harmoneymusic.com> wrote:\n"
+             "> Hi there, thanks for your order!\n> Happy playing,\n> Norman\n")
+    reduction = TextReducer().reduce(reply)
+    print(f"\n✂️  Reply reduced from {reduction['original_tokens']} to {reduction['tokens']} tokens:")
+    print(f"   {reduction['body']!r}")
+    for span in reduction['removed']:
+        print(f"   - {span['kind']} ({span['end'] - span['start']} chars): {span['text'][:50]!r}...")
 
 
 if __name__ == "__main__":
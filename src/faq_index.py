@@ -0,0 +1,221 @@
+"""
+FAQ Index Module
+Local search structures used to shortlist knowledge base articles before AI ranking
+"""
+
+import math
+import re
+import heapq
+import zlib
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+NON_WORD_PATTERN = re.compile(r"[^a-z0-9]+")
+
+# Any callable mapping a list of texts to an (n, dim) float matrix can be used
+EmbeddingFunction = Callable[[List[str]], np.ndarray]
+
+# Very common words that carry no retrieval signal
+STOPWORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'can', 'do', 'does',
+    'for', 'from', 'have', 'i', 'if', 'in', 'is', 'it', 'me', 'my', 'of', 'on',
+    'or', 'our', 'so', 'that', 'the', 'this', 'to', 'was', 'we', 'what', 'when',
+    'will', 'with', 'you', 'your'
+])
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase text and split it into alphanumeric terms, dropping stopwords"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over a fixed list of documents
+
+    Documents are addressed by their position in the list passed to the
+    constructor. Scoring only touches the postings of the query terms, so a
+    lookup costs time proportional to the matching documents, not the corpus.
+    """
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(documents)
+
+        # term -> list of (doc_index, term_frequency)
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths: List[int] = []
+
+        for doc_index, text in enumerate(documents):
+            terms = tokenize(text)
+            self.doc_lengths.append(len(terms))
+
+            counts: Dict[str, int] = defaultdict(int)
+            for term in terms:
+                counts[term] += 1
+            for term, tf in counts.items():
+                self.postings[term].append((doc_index, tf))
+
+        total_length = sum(self.doc_lengths)
+        self.avg_doc_length = total_length / self.num_docs if self.num_docs else 0.0
+
+        # Precompute IDF and per-document length normalisation once
+        self.idf = {
+            term: math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+        self._length_norm = [
+            self.k1 * (1 - self.b + self.b * length / self.avg_doc_length) if self.avg_doc_length else self.k1
+            for length in self.doc_lengths
+        ]
+
+    def score(self, query: str, allowed: Optional[Iterable[int]] = None) -> Dict[int, float]:
+        """
+        Score every document that shares at least one term with the query
+
+        Args:
+            query: Free-text query
+            allowed: Optional set of document indexes to restrict scoring to
+
+        Returns:
+            Dict mapping document index to BM25 score
+        """
+        if allowed is not None and not isinstance(allowed, (set, frozenset)):
+            allowed = set(allowed)
+
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_index, tf in postings:
+                if allowed is not None and doc_index not in allowed:
+                    continue
+                scores[doc_index] += idf * tf * (self.k1 + 1) / (tf + self._length_norm[doc_index])
+
+        return scores
+
+    def search(self, query: str, top_n: int = 10,
+               allowed: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Return the top_n (doc_index, score) pairs for a query, best first
+
+        Documents with no query terms in common are never returned, so the
+        result can be shorter than top_n.
+        """
+        scores = self.score(query, allowed)
+        return heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])
+
+
+class HashedNgramEmbedder:
+    """
+    Local embedding function based on hashed character n-grams
+
+    Each word is padded with spaces and cut into character n-grams, which are
+    hashed into a fixed number of buckets. Shared sub-word pieces (for example
+    "amp" in both "amp" and "amplifier") give related texts a positive cosine
+    similarity without any network call or trained model.
+
+    Calling fit() on the indexed corpus adds IDF weights per bucket, so common
+    suffixes such as "ing" stop dominating the similarity.
+    """
+
+    def __init__(self, dim: int = 4096, ngram_sizes: Tuple[int, ...] = (3, 4, 5)):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+        self.idf: Optional[np.ndarray] = None
+
+    def _features(self, text: str) -> Dict[int, float]:
+        counts: Dict[int, float] = defaultdict(float)
+        for word in NON_WORD_PATTERN.split(text.lower()):
+            if not word or word in STOPWORDS:
+                continue
+            padded = f" {word} "
+            for n in self.ngram_sizes:
+                for i in range(max(1, len(padded) - n + 1)):
+                    counts[zlib.crc32(padded[i:i + n].encode()) % self.dim] += 1.0
+        return counts
+
+    def _raw_vectors(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, count in self._features(text).items():
+                # Sublinear term frequency so repeated words don't dominate
+                vectors[row, bucket] = 1.0 + math.log(count)
+        return vectors
+
+    def fit(self, texts: List[str]) -> 'HashedNgramEmbedder':
+        """Learn bucket IDF weights from the corpus that will be indexed"""
+        doc_freq = (self._raw_vectors(texts) > 0).sum(axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + doc_freq)) + 1).astype(np.float32)
+        return self
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = self._raw_vectors(texts)
+        if self.idf is not None:
+            vectors *= self.idf
+        return vectors
+
+
+def top_k_indices(scores: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Indexes of the k highest scores, best first
+
+    Uses argpartition so only the selected k entries are sorted.
+
+    Args:
+        scores: 1-D score array
+        k: Number of indexes to return
+        mask: Optional boolean array; entries that are False are never returned.
+              An integer array of allowed indexes (ascending) works too and
+              skips the O(n) scan of the mask.
+    """
+    if mask is not None:
+        candidates = mask if mask.dtype.kind in 'iu' else np.flatnonzero(mask)
+        scores = scores[candidates]
+    else:
+        candidates = np.arange(len(scores))
+
+    k = min(k, len(candidates))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < len(candidates):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(candidates))
+    order = part[np.argsort(-scores[part], kind='stable')]
+    return candidates[order]
+
+
+class VectorIndex:
+    """
+    Dense vector index stored as one contiguous matrix of L2-normalised rows
+
+    Similarity against every document is a single matrix-vector product.
+    """
+
+    def __init__(self, vectors: np.ndarray):
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+
+    def similarities(self, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity between the query and every indexed vector"""
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return np.zeros(self.matrix.shape[0], dtype=np.float32)
+        return self.matrix @ (query / norm)
+
+    def search(self, query_vector: np.ndarray, top_n: int = 10,
+               mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Return the top_n (doc_index, similarity) pairs, best first"""
+        scores = self.similarities(query_vector)
+        return [(int(i), float(scores[i])) for i in top_k_indices(scores, top_n, mask)]
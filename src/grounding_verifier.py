@@ -0,0 +1,238 @@
+"""
+Grounding Verifier Module
+Scores every draft sentence against the knowledge snippets locally and flags unsupported claims
+"""
+
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from faq_index import EmbeddingFunction, HashedNgramEmbedder
+from pre_quality_check import SENTENCE_RE, content_words
+
+# Factual details a draft must not invent. Order matters: each match is removed
+# from the text before the later patterns run, so "3-5 business days" is one
+# time frame rather than two bare numbers.
+CLAIM_PATTERNS = [
+    ("url", re.compile(r"\b(?:https?://)?(?:www\.)?([a-z0-9-]+(?:\.[a-z0-9-]+)*\.[a-z]{2,}(?:/[\w\-./?=&%#]*)?)", re.IGNORECASE)),
+    ("time_frame", re.compile(r"\b(\d+(?:\s*[-–]\s*\d+)?)[\s-]+(?:business\s+|working\s+|calendar\s+)?"
+                              r"(minute|hour|day|week|month|year)s?\b", re.IGNORECASE)),
+    ("money", re.compile(r"\$\s?(\d[\d,]*(?:\.\d+)?)")),
+    ("percent", re.compile(r"\b(\d+(?:\.\d+)?)\s?%")),
+    # Bare numbers of two or more digits (order numbers, prices without a sign, phone parts)
+    ("number", re.compile(r"\b(\d{2,}(?:[.,]\d+)*)\b"))
+]
+
+# Grounding verdicts, from best to worst
+VERDICTS = ("grounded", "weak", "hallucinated")
+
+RANGE_DASH = re.compile(r"\s*[-–]\s*")
+
+Claim = Tuple[str, str]
+
+
+def extract_claims(text: str) -> List[Tuple[Claim, str]]:
+    """
+    Factual details in a text
+
+    Returns:
+        List of ((kind, normalized value), original text) pairs, e.g.
+        (("time_frame", "3-5 day"), "3-5 business days")
+    """
+    claims = []
+    for kind, pattern in CLAIM_PATTERNS:
+        def take(match):
+            if kind == "url":
+                value = match.group(1).lower().rstrip('./')
+            elif kind == "time_frame":
+                value = f"{RANGE_DASH.sub('-', match.group(1))} {match.group(2).lower()}"
+            else:
+                value = match.group(1).replace(',', '')
+            claims.append(((kind, value), match.group(0).rstrip('.') if kind == "url" else match.group(0)))
+            return ' '
+        text = pattern.sub(take, text)
+    return claims
+
+
+class GroundingVerifier:
+    """
+    Local grounding scorer for draft replies
+
+    Each draft is split into sentences; sentences with enough content words
+    or a factual claim are embedded and compared with the draft's snippets
+    through one sentence × snippet cosine similarity matrix. verify_batch()
+    builds a single matrix for a whole batch of drafts and masks out
+    snippets that belong to other drafts.
+
+    Verdicts:
+    - "hallucinated": a number, URL, price or time frame that appears in no
+      snippet, not in the customer's own message and not in the known texts
+      (e.g. the persona the drafts are written in)
+    - "weak": too many sentences have no snippet above the similarity threshold
+    - "grounded": otherwise
+    """
+
+    def __init__(self, embed_fn: Optional[EmbeddingFunction] = None, threshold: float = 0.3,
+                 min_sentence_words: int = 5, max_unsupported_share: float = 0.5,
+                 known_texts: Sequence[str] = ()):
+        """
+        Args:
+            embed_fn: Embedding function for sentences and snippets (defaults to hashed
+                      character n-grams; pass RAGSystem.embed_fn to reuse its IDF weights)
+            threshold: Minimum cosine similarity for a sentence to count as supported
+            min_sentence_words: Content words that make a sentence worth checking
+            max_unsupported_share: Share of unsupported sentences above which a draft is "weak"
+            known_texts: Texts whose details every draft may repeat, such as the draft
+                         system prompt with its persona (see add_known_text)
+        """
+        self.embed_fn = embed_fn or HashedNgramEmbedder()
+        self.threshold = threshold
+        self.min_sentence_words = min_sentence_words
+        self.max_unsupported_share = max_unsupported_share
+        self.known_claims: frozenset = frozenset()
+        for text in known_texts:
+            self.add_known_text(text)
+
+        self._lock = threading.Lock()
+        self.stats = {verdict: 0 for verdict in VERDICTS}
+        self.stats.update({"drafts": 0, "sentences": 0, "unsupported_claims": 0})
+
+    def add_known_text(self, text: str):
+        """Count the details in a text (e.g. the persona's "44 years" of experience) as supported in every draft"""
+        self.known_claims = self.known_claims | {claim for claim, _ in extract_claims(text)}
+
+    def _sentences(self, draft: str) -> List[str]:
+        """Sentences that make a checkable statement (skips greetings and sign-offs)"""
+        sentences = []
+        for sentence in SENTENCE_RE.split(draft):
+            sentence = sentence.strip()
+            if sentence and (len(content_words(sentence)) >= self.min_sentence_words or extract_claims(sentence)):
+                sentences.append(sentence)
+        return sentences
+
+    @staticmethod
+    def _snippet_text(snippet: Dict) -> str:
+        return f"{snippet.get('question', '')} {snippet.get('answer', '')}"
+
+    @staticmethod
+    def _supported(claim: Claim, known: Set[Claim], known_urls: List[str]) -> bool:
+        if claim in known:
+            return True
+        # A bare domain or a shorter path of a URL the snippets give is fine
+        kind, value = claim
+        return kind == "url" and any(url.startswith(value) for url in known_urls)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """L2-normalised embeddings"""
+        vectors = np.asarray(self.embed_fn(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def verify(self, draft: str, knowledge_snippets: List[Dict], customer_message: str = "") -> Dict:
+        """Check one draft (see verify_batch)"""
+        return self.verify_batch([draft], [knowledge_snippets], [customer_message])[0]
+
+    def verify_batch(self, drafts: List[str], snippets_per_draft: List[List[Dict]],
+                     customer_messages: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Check a batch of drafts with one similarity matrix
+
+        Args:
+            drafts: Draft reply texts
+            snippets_per_draft: Knowledge snippets each draft was written from
+            customer_messages: Optional customer emails; details the customer gave
+                               (e.g. their order number) count as supported
+
+        Returns:
+            One dict per draft with verdict, grounding_score (share of supported
+            sentences), unsupported_sentences, unsupported_claims and issues
+        """
+        customer_messages = customer_messages or [""] * len(drafts)
+
+        # Unique snippets across the batch; membership[d, j] says draft d may cite snippet j
+        snippet_texts: List[str] = []
+        snippet_index: Dict[str, int] = {}
+        members: List[List[int]] = []
+        for snippets in snippets_per_draft:
+            own = []
+            for snippet in snippets:
+                text = self._snippet_text(snippet)
+                if text not in snippet_index:
+                    snippet_index[text] = len(snippet_texts)
+                    snippet_texts.append(text)
+                own.append(snippet_index[text])
+            members.append(own)
+        membership = np.zeros((len(drafts), len(snippet_texts)), dtype=bool)
+        for row, own in enumerate(members):
+            membership[row, own] = True
+
+        sentences_per_draft = [self._sentences(draft) for draft in drafts]
+        sentences = [sentence for draft_sentences in sentences_per_draft for sentence in draft_sentences]
+        owner = np.repeat(np.arange(len(drafts)), [len(s) for s in sentences_per_draft])
+
+        # Best supporting snippet per sentence: (sentences × snippets) similarity, other drafts' snippets masked
+        if sentences and snippet_texts:
+            similarity = self._embed(sentences) @ self._embed(snippet_texts).T
+            similarity[~membership[owner]] = -1.0
+            support = similarity.max(axis=1)
+        else:
+            support = np.full(len(sentences), -1.0, dtype=np.float32)
+
+        results = []
+        offset = 0
+        for row, draft_sentences in enumerate(sentences_per_draft):
+            draft_support = support[offset:offset + len(draft_sentences)]
+            offset += len(draft_sentences)
+            results.append(self._verdict(
+                draft_sentences, draft_support,
+                [snippet_texts[j] for j in members[row]], customer_messages[row]
+            ))
+        return results
+
+    def _verdict(self, sentences: List[str], support: np.ndarray, snippet_texts: List[str],
+                 customer_message: str) -> Dict:
+        known = {claim for text in snippet_texts + [customer_message] for claim, _ in extract_claims(text)}
+        known |= self.known_claims
+        known_urls = [value for kind, value in known if kind == "url"]
+
+        unsupported_claims = []
+        unsupported_sentences = []
+        for sentence, score in zip(sentences, support.tolist()):
+            for claim, original in extract_claims(sentence):
+                if not self._supported(claim, known, known_urls) and original not in unsupported_claims:
+                    unsupported_claims.append(original)
+            if score < self.threshold:
+                unsupported_sentences.append(sentence)
+
+        grounding_score = 1.0 - len(unsupported_sentences) / len(sentences) if sentences else 1.0
+        issues = []
+        if unsupported_claims:
+            verdict = "hallucinated"
+            issues.append(f"Not found in the knowledge snippets: {', '.join(unsupported_claims)}")
+        elif sentences and len(unsupported_sentences) / len(sentences) > self.max_unsupported_share:
+            verdict = "weak"
+            issues.append(f"{len(unsupported_sentences)} of {len(sentences)} sentences have no supporting snippet")
+        else:
+            verdict = "grounded"
+
+        with self._lock:
+            self.stats['drafts'] += 1
+            self.stats['sentences'] += len(sentences)
+            self.stats['unsupported_claims'] += len(unsupported_claims)
+            self.stats[verdict] += 1
+
+        return {
+            "verdict": verdict,
+            "grounding_score": round(grounding_score, 3),
+            "unsupported_sentences": unsupported_sentences,
+            "unsupported_claims": unsupported_claims,
+            "issues": issues
+        }
+
+    def get_stats(self) -> Dict:
+        """Drafts per verdict, sentences checked and unsupported claims found"""
+        with self._lock:
+            return dict(self.stats)
@@ -5,16 +5,251 @@ Uses Claude AI to classify customer emails into categories
 
 import anthropic
 import os
+import sys
 import json
+import time
+import numpy as np
 from dotenv import load_dotenv
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+from email_processor import TextReducer
+from faq_index import tokenize
+from model_cascade import SMALL_MODEL, ModelCascade
+from result_cache import ResultCache
+from prompt_budget import PromptBudget, get_default_budget
+from request_scheduler import RequestScheduler, cacheable_system, get_default_scheduler
+from structured_output import StructuredOutput
 
 # Load environment variables
 load_dotenv()
 
+# Shared by the single and batched prompts so both classify the same way
+CATEGORY_INSTRUCTIONS = """You are an email classifier for Harmony Music Store, a musical instrument retailer.
+
+Your job is to classify customer emails into ONE category:
+
+Categories:
+- ORDER_TRACKING: Questions about order status, shipping, delivery
+- RETURN_REFUND: Return requests, refund inquiries, exchanges
+- PRODUCT_QUESTION: Questions about products, features, recommendations
+- WARRANTY: Warranty claims, coverage questions
+- TECHNICAL_SUPPORT: Help with using products, troubleshooting
+- COMPLAINT: Complaints about service, product quality, delays
+- MULTIPLE: Email contains multiple different questions/issues
+- OTHER: Does not fit any category above"""
+
+INTENT_CATEGORIES = [
+    "ORDER_TRACKING", "RETURN_REFUND", "PRODUCT_QUESTION", "WARRANTY",
+    "TECHNICAL_SUPPORT", "COMPLAINT", "MULTIPLE", "OTHER"
+]
+
+INTENT_PROPERTIES = {
+    "category": {"type": "string", "enum": INTENT_CATEGORIES},
+    "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    "reasoning": {"type": "string", "description": "Brief explanation of why this category was chosen"}
+}
+
+# Claude answers through these tools, so the output always matches the schema
+INTENT_TOOL = {
+    "name": "record_intent",
+    "description": "Record the category of the customer email",
+    "input_schema": {
+        "type": "object",
+        "properties": INTENT_PROPERTIES,
+        "required": ["category", "confidence", "reasoning"]
+    }
+}
+
+INTENT_BATCH_TOOL = {
+    "name": "record_intents",
+    "description": "Record the category of every email in the request",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"id": {"type": ["string", "integer"]}, **INTENT_PROPERTIES},
+                    "required": ["id", "category", "confidence", "reasoning"]
+                }
+            }
+        },
+        "required": ["results"]
+    }
+}
+
+# Static system prompts (cached by the API); only the emails go in the user message
+SINGLE_SYSTEM_PROMPT = f"""{CATEGORY_INSTRUCTIONS}
+
+Record your answer with the record_intent tool."""
+
+BATCH_SYSTEM_PROMPT = f"""{CATEGORY_INSTRUCTIONS}
+
+You will receive several emails, each wrapped in <email id="..."> tags. Classify EACH of them independently.
+
+Record all of them in a single record_intents call, one result per email id."""
+
+DEFAULT_LOCAL_MODEL_PATH = '../models/intent_classifier.npz'
+
+# Reasoning of results that came from the local classifier instead of Claude
+FAST_PATH_REASONING = "Local classifier fast path"
+
+# Bump whenever the classification prompt changes so cached results are not reused
+PROMPT_VERSION = "3"
+
+
+class LocalIntentClassifier:
+    """
+    Multinomial naive Bayes over TF-IDF features, implemented with NumPy
+    
+    Trained from labeled emails in the same shape as data/test_emails.json
+    and used by IntentDetector to skip Claude for easy, confident cases.
+    """
+    
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.vocabulary: Dict[str, int] = {}
+        self.categories: List[str] = []
+        self.idf: Optional[np.ndarray] = None
+        self.feature_log_prob: Optional[np.ndarray] = None
+        self.class_log_prior: Optional[np.ndarray] = None
+    
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        """Unigrams plus bigrams of the tokenized text"""
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    
+    def _tfidf(self, texts: List[str]) -> np.ndarray:
+        """Sublinear TF-IDF matrix with L2-normalised rows; unknown terms are ignored"""
+        matrix = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float64)
+        for row, text in enumerate(texts):
+            for term in self._terms(text):
+                col = self.vocabulary.get(term)
+                if col is not None:
+                    matrix[row, col] += 1.0
+        np.log1p(matrix, out=matrix)
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def train(self, examples: List[Dict], text_key: str = 'body',
+              label_key: str = 'expected_category') -> 'LocalIntentClassifier':
+        """
+        Fit the model on labeled emails
+        
+        Args:
+            examples: List of dicts like the entries of test_emails.json
+            text_key: Field holding the email text
+            label_key: Field holding the category label
+        """
+        texts = [example[text_key] for example in examples]
+        labels = [example[label_key] for example in examples]
+        
+        self.categories = sorted(set(labels))
+        terms = sorted({term for text in texts for term in self._terms(text)})
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        
+        # Document frequency -> smoothed IDF
+        doc_freq = np.zeros(len(terms))
+        for text in texts:
+            for term in set(self._terms(text)):
+                doc_freq[self.vocabulary[term]] += 1
+        self.idf = np.log((1 + len(texts)) / (1 + doc_freq)) + 1
+        
+        features = self._tfidf(texts)
+        label_index = np.array([self.categories.index(label) for label in labels])
+        
+        class_counts = np.bincount(label_index, minlength=len(self.categories))
+        self.class_log_prior = np.log(class_counts / class_counts.sum())
+        
+        feature_totals = np.zeros((len(self.categories), len(terms)))
+        np.add.at(feature_totals, label_index, features)
+        smoothed = feature_totals + self.alpha
+        self.feature_log_prob = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        
+        return self
+    
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Return (category, confidence) where confidence is the posterior probability"""
+        if self.feature_log_prob is None:
+            raise ValueError("LocalIntentClassifier has not been trained")
+        
+        features = self._tfidf([text])[0]
+        if not features.any():
+            # Nothing we have seen before: let Claude decide
+            return "OTHER", 0.0
+        
+        joint = self.class_log_prior + self.feature_log_prob @ features
+        posterior = np.exp(joint - joint.max())
+        posterior /= posterior.sum()
+        best = int(posterior.argmax())
+        return self.categories[best], float(posterior[best])
+    
+    def save(self, path: str = DEFAULT_LOCAL_MODEL_PATH):
+        """Save the trained model as a NumPy .npz archive"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(
+            path,
+            alpha=self.alpha,
+            vocabulary=np.array(terms, dtype=str),
+            categories=np.array(self.categories, dtype=str),
+            idf=self.idf,
+            feature_log_prob=self.feature_log_prob,
+            class_log_prior=self.class_log_prior
+        )
+    
+    @classmethod
+    def load(cls, path: str = DEFAULT_LOCAL_MODEL_PATH) -> 'LocalIntentClassifier':
+        """Load a model written by save()"""
+        with np.load(path, allow_pickle=False) as data:
+            model = cls(alpha=float(data['alpha']))
+            model.vocabulary = {term: i for i, term in enumerate(data['vocabulary'].tolist())}
+            model.categories = data['categories'].tolist()
+            model.idf = data['idf']
+            model.feature_log_prob = data['feature_log_prob']
+            model.class_log_prior = data['class_log_prior']
+        return model
+
+
 class IntentDetector:
-    def __init__(self):
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, local_model_path: Optional[str] = None, fast_path_threshold: float = 0.85,
+                 cache: Optional[ResultCache] = None, scheduler: Optional[RequestScheduler] = None,
+                 cascade: Optional[ModelCascade] = None, budget: Optional[PromptBudget] = None):
+        """
+        Args:
+            local_model_path: Saved LocalIntentClassifier; when set, confident
+                local predictions are returned without calling Claude
+            fast_path_threshold: Minimum local confidence needed to skip Claude
+            cache: Optional shared ResultCache for Claude classifications
+            scheduler: RequestScheduler for API calls (defaults to the shared one)
+            cascade: Models to try in order (defaults to Haiku, escalating to Sonnet below 0.8 confidence)
+            budget: PromptBudget for request sizes (defaults to the shared one)
+        """
+        # Retries are handled by the scheduler
+        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.async_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.model = "claude-sonnet-4-20250514"
+        self.cache = cache
+        self.scheduler = scheduler or get_default_scheduler()
+        self.cascade = cascade or ModelCascade([SMALL_MODEL, self.model], threshold=0.8)
+        self.budget = budget or get_default_budget()
+        self.scheduler.add_observer(self.budget.observe)
+        self.output = StructuredOutput(INTENT_TOOL)
+        self.batch_output = StructuredOutput(INTENT_BATCH_TOOL)
+        self.local_model = LocalIntentClassifier.load(local_model_path) if local_model_path else None
+        self.fast_path_threshold = fast_path_threshold
+        self.fast_path_stats = {
+            "fast_path_hits": 0,
+            "llm_calls": 0,
+            "local_seconds": 0.0,
+            "llm_seconds": 0.0
+        }
         self.categories = [
             "ORDER_TRACKING",
             "RETURN_REFUND",
@@ -28,7 +263,10 @@ class IntentDetector:
     
     def detect_intent(self, email_text: str) -> Dict:
         """
-        Classify email into intent category using Claude
+        Classify email into intent category
+        
+        Uses the local classifier when it is loaded and confident enough,
+        otherwise Claude.
         
         Args:
             email_text: Cleaned email text
@@ -36,77 +274,287 @@ class IntentDetector:
         Returns:
             Dict with category and confidence score
         """
+        known = self._known_intent(email_text)
+        if known is not None:
+            return known
         
-        prompt = f"""You are an email classifier for Harmony Music Store, a musical instrument retailer.
-
-Your job is to classify customer emails into ONE category:
-
-Categories:
-- ORDER_TRACKING: Questions about order status, shipping, delivery
-- RETURN_REFUND: Return requests, refund inquiries, exchanges
-- PRODUCT_QUESTION: Questions about products, features, recommendations
-- WARRANTY: Warranty claims, coverage questions
-- TECHNICAL_SUPPORT: Help with using products, troubleshooting
-- COMPLAINT: Complaints about service, product quality, delays
-- MULTIPLE: Email contains multiple different questions/issues
-- OTHER: Does not fit any category above
-
-Email to classify:
-{email_text}
-
-Respond ONLY with valid JSON in this exact format:
-{{
-  "category": "CATEGORY_NAME",
-  "confidence": 0.95,
-  "reasoning": "Brief explanation of why this category was chosen"
-}}"""
-
+        start = time.perf_counter()
+        result = self._detect_intent_llm(email_text)
+        self.fast_path_stats['llm_calls'] += 1
+        self.fast_path_stats['llm_seconds'] += time.perf_counter() - start
+        return result
+    
+    async def detect_intent_async(self, email_text: str) -> Dict:
+        """Same as detect_intent, using the AsyncAnthropic client"""
+        known = self._known_intent(email_text)
+        if known is not None:
+            return known
+        
+        start = time.perf_counter()
         try:
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=500,
-                messages=[
+            result = await self.output.call_async(
+                lambda: self.cascade.call_async(
+                    self.scheduler, self.async_client.messages.create, self._intent_request(email_text),
+                    score=lambda payload: payload['confidence'], output=self.output
+                ),
+                lambda message: self._parse_intent(message, email_text)
+            )
+        except Exception as e:
+            result = self._intent_error(e)
+        self.fast_path_stats['llm_calls'] += 1
+        self.fast_path_stats['llm_seconds'] += time.perf_counter() - start
+        return result
+    
+    def _known_intent(self, email_text: str) -> Optional[Dict]:
+        """Result available without calling Claude: local fast path or cache"""
+        fast_result = self._fast_path(email_text)
+        if fast_result is not None:
+            return fast_result
+        return self._cache_get(email_text)
+    
+    def _fast_path(self, email_text: str) -> Optional[Dict]:
+        """Local classification, or None when there is no model or it is not confident"""
+        if self.local_model is None:
+            return None
+        
+        start = time.perf_counter()
+        category, confidence = self.local_model.predict(email_text)
+        self.fast_path_stats['local_seconds'] += time.perf_counter() - start
+        
+        if confidence < self.fast_path_threshold:
+            return None
+        
+        self.fast_path_stats['fast_path_hits'] += 1
+        return {
+            "category": category,
+            "confidence": confidence,
+            "reasoning": FAST_PATH_REASONING
+        }
+    
+    def _cache_key(self, email_text: str) -> str:
+        return ResultCache.make_key("intent", email_text, self.cascade.cache_id, PROMPT_VERSION)
+    
+    def _cache_get(self, email_text: str) -> Optional[Dict]:
+        if self.cache is None:
+            return None
+        return self.cache.get(self._cache_key(email_text))
+    
+    def _cache_set(self, email_text: str, result: Dict):
+        if self.cache is not None:
+            self.cache.set(self._cache_key(email_text), result)
+    
+    def get_fast_path_stats(self) -> Dict:
+        """Fast-path hit rate and the Claude latency it saved"""
+        stats = self.fast_path_stats
+        hits = stats['fast_path_hits']
+        total = hits + stats['llm_calls']
+        avg_llm = stats['llm_seconds'] / stats['llm_calls'] if stats['llm_calls'] else 0.0
+        avg_local = stats['local_seconds'] / total if total else 0.0
+        
+        return {
+            "total": total,
+            "fast_path_hits": hits,
+            "llm_calls": stats['llm_calls'],
+            "hit_rate": hits / total if total else 0.0,
+            "avg_llm_latency": avg_llm,
+            "avg_local_latency": avg_local,
+            "estimated_seconds_saved": hits * max(avg_llm - avg_local, 0.0)
+        }
+    
+    def _intent_request(self, email_text: str) -> Dict:
+        """Build the messages.create parameters for one email, within the intent token budget"""
+        
+        def build(text: str, _items: List[Dict]) -> Dict:
+            prompt = f"""Email to classify:
+{text}"""
+
+            return {
+                "model": self.model,
+                "max_tokens": 500,
+                "system": cacheable_system(SINGLE_SYSTEM_PROMPT),
+                "messages": [
                     {"role": "user", "content": prompt}
-                ]
+                ],
+                **self.output.request_params()
+            }
+        
+        return self.budget.fit("intent", build, email_text)
+    
+    def _parse_intent(self, message, email_text: str) -> Dict:
+        """Turn a Claude response into the intent result dict (raises StructuredOutputError)"""
+        result = self.output.parse(message)
+        intent = {
+            "category": result["category"],
+            "confidence": result["confidence"],
+            "reasoning": result["reasoning"]
+        }
+        self._cache_set(email_text, intent)
+        return intent
+    
+    def _intent_error(self, error: Exception) -> Dict:
+        print(f"Error detecting intent: {error}")
+        return {
+            "category": "OTHER",
+            "confidence": 0.0,
+            "reasoning": f"Error: {str(error)}"
+        }
+    
+    def _detect_intent_llm(self, email_text: str) -> Dict:
+        """Classify one email with Claude"""
+        try:
+            return self.output.call(
+                lambda: self.cascade.call(
+                    self.scheduler, self.client.messages.create, self._intent_request(email_text),
+                    score=lambda payload: payload['confidence'], output=self.output
+                ),
+                lambda message: self._parse_intent(message, email_text)
             )
+        except Exception as e:
+            return self._intent_error(e)
+    
+    def detect_intents(self, emails: List[Dict], batch_size: int = 20, max_retries: int = 2,
+                       reducer: Optional[TextReducer] = None, reduce_bodies: bool = False) -> Dict:
+        """
+        Classify many emails, packing up to batch_size emails into each Claude request
+        
+        A batch is closed early when another email would put its request
+        over the "intent_batch" token budget. Bodies are classified as given,
+        so each result matches detect_intent on the same text; pass
+        reduce_bodies=True (or already reduced bodies) to strip quoted
+        history, signatures and disclaimers first.
+        Emails the local classifier is confident about, or that are already
+        cached, are answered without a request.
+        Ids missing from a response (partial parse failure, truncated output)
+        are re-sent on their own batch; anything still missing after
+        max_retries goes through detect_intent one email at a time.
+        
+        Args:
+            emails: List of dicts with 'id' and 'body' keys (same shape as test_emails.json)
+            batch_size: Number of emails per request
+            max_retries: How many times missing ids are retried as a batch
+            reducer: TextReducer for the bodies (defaults to a new one)
+            reduce_bodies: Reduce each body before classifying it
             
-            # Extract response
-            response_text = message.content[0].text.strip()
-            
-            # Parse JSON response
-            result = json.loads(response_text)
+        Returns:
+            Dict mapping email id to the same result dict detect_intent returns
+        """
+        results = {}
+        reducer = (reducer or TextReducer()) if reduce_bodies else None
+        
+        # Confident local predictions and cached results never reach a batch
+        remaining = []
+        for email in emails:
+            text = reducer.reduce(email['body'])['body'] if reducer is not None else email['body']
+            known = self._known_intent(text)
+            if known is not None:
+                results[email['id']] = known
+            else:
+                remaining.append({"id": email['id'], "body": text})
+        
+        batch_start = time.perf_counter()
+        for group in self.budget.split("intent_batch", self._batch_request, remaining, batch_size):
+            pending = {str(email['id']): email for email in group}
             
-            return {
-                "category": result.get("category", "OTHER"),
-                "confidence": result.get("confidence", 0.0),
-                "reasoning": result.get("reasoning", "")
-            }
+            for attempt in range(max_retries + 1):
+                if not pending:
+                    break
+                for key, result in self._classify_batch(list(pending.values())).items():
+                    if key in pending:
+                        email = pending.pop(key)
+                        self._cache_set(email['body'], result)
+                        results[email['id']] = result
             
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON: {e}")
-            print(f"Response was: {response_text}")
-            return {
-                "category": "OTHER",
-                "confidence": 0.0,
-                "reasoning": "Failed to parse response"
-            }
+            # Last resort: one request per email that never came back
+            for email in pending.values():
+                results[email['id']] = self._detect_intent_llm(email['body'])
+        
+        # Latency per email is amortized over the batch
+        self.fast_path_stats['llm_calls'] += len(remaining)
+        self.fast_path_stats['llm_seconds'] += time.perf_counter() - batch_start
+        
+        return results
+    
+    def _batch_request(self, _text: str, emails: List[Dict]) -> Dict:
+        """Build the messages.create parameters for one batch (a PromptBudget request builder)"""
+        
+        emails_text = "\n\n".join(
+            f"<email id=\"{email['id']}\">\n{email['body']}\n</email>"
+            for email in emails
+        )
+        
+        prompt = f"""Classify EACH of the {len(emails)} emails below independently.
+
+Emails to classify:
+{emails_text}"""
+
+        return {
+            "model": self.model,
+            "max_tokens": min(8000, 200 + 150 * len(emails)),
+            "system": cacheable_system(BATCH_SYSTEM_PROMPT),
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            **self.batch_output.request_params()
+        }
+    
+    def _classify_batch(self, emails: List[Dict]) -> Dict[str, Dict]:
+        """Send one batched request and return the results it contained, keyed by str(id)"""
+        
+        # detect_intents already split the emails to fit; fit() records the request's size
+        request = self.budget.fit("intent_batch", self._batch_request, "", emails, min_items=len(emails))
+        
+        try:
+            # One unsure email sends the whole batch to the next tier
+            items = self.batch_output.call(
+                lambda: self.cascade.call(
+                    self.scheduler, self.client.messages.create, request,
+                    score=lambda payload: min(item['confidence'] for item in payload['results']),
+                    output=self.batch_output
+                ),
+                lambda message: self.batch_output.parse(message)['results']
+            )
         except Exception as e:
-            print(f"Error detecting intent: {e}")
-            return {
-                "category": "OTHER",
-                "confidence": 0.0,
-                "reasoning": f"Error: {str(e)}"
+            print(f"Error in batched intent detection: {e}")
+            return {}
+        
+        results = {}
+        for item in items:
+            results[str(item['id'])] = {
+                "category": item["category"],
+                "confidence": item["confidence"],
+                "reasoning": item["reasoning"]
             }
+        
+        return results
 
 
 def main():
-    """Test intent detection with sample emails"""
+    """
+    Test intent detection with sample emails
+    
+    Flags:
+        --train      Train the local classifier on the sample emails and save it
+        --fast-path  Use the saved local classifier before calling Claude
+        --batch      Classify all emails with batched requests
+    """
     
     # Load test emails
     with open('../data/test_emails.json', 'r') as f:
         data = json.load(f)
     
-    detector = IntentDetector()
+    if '--train' in sys.argv:
+        model = LocalIntentClassifier().train(data['test_emails'])
+        model.save(DEFAULT_LOCAL_MODEL_PATH)
+        print(f"✅ Trained local classifier on {len(data['test_emails'])} emails → {DEFAULT_LOCAL_MODEL_PATH}")
+        return
+    
+    detector = IntentDetector(
+        local_model_path=DEFAULT_LOCAL_MODEL_PATH if '--fast-path' in sys.argv else None
+    )
+    
+    batch_results = None
+    if '--batch' in sys.argv:
+        batch_results = detector.detect_intents(data['test_emails'])
     
     print("="*70)
     print("INTENT DETECTION TEST")
@@ -121,7 +569,10 @@ def main():
         print(f"Expected: {email['expected_category']}")
         
         # Detect intent
-        result = detector.detect_intent(email['body'])
+        if batch_results is not None:
+            result = batch_results[email['id']]
+        else:
+            result = detector.detect_intent(email['body'])
         
         print(f"Detected: {result['category']} (confidence: {result['confidence']:.2f})")
         print(f"Reasoning: {result['reasoning']}")
@@ -139,6 +590,11 @@ def main():
     # Show accuracy
     accuracy = (correct / total) * 100
     print(f"\n📊 Accuracy: {correct}/{total} ({accuracy:.1f}%)")
+    
+    if detector.local_model is not None:
+        stats = detector.get_fast_path_stats()
+        print(f"⚡ Fast path: {stats['fast_path_hits']}/{stats['total']} ({stats['hit_rate']*100:.0f}%), "
+              f"~{stats['estimated_seconds_saved']:.1f}s of Claude latency saved")
 
 
 if __name__ == "__main__":
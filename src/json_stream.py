@@ -0,0 +1,169 @@
+"""
+JSON Stream Module
+Incremental parser that extracts top-level fields of a JSON object while it is still being generated
+"""
+
+import json
+from typing import Any, Iterable, List, Optional, Tuple
+
+# Single-character escapes inside JSON strings
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+# Event tuples returned by feed(): ("text", field, chunk) or ("field", field, value)
+Event = Tuple[str, str, Any]
+
+
+class IncrementalJsonParser:
+    """
+    Character-level parser for one streamed JSON object
+
+    Feed it text chunks as they arrive. For string fields listed in
+    `stream_fields` it returns the decoded text as soon as it is seen;
+    every top-level field is also returned with its parsed value the moment
+    the value closes. Anything before the opening brace (e.g. a markdown
+    code fence) and after the closing brace is ignored.
+    """
+
+    def __init__(self, stream_fields: Iterable[str] = ()):
+        self.stream_fields = frozenset(stream_fields)
+        self.depth = 0
+        self.done = False
+
+        self.in_string = False
+        self.escape = False
+        self.unicode_digits: Optional[str] = None
+        self.high_surrogate: Optional[int] = None
+
+        # Position inside the top-level object: "key", "colon", "value" or "comma"
+        self.expect = "key"
+        self.key_chars: List[str] = []
+        self.current_key: Optional[str] = None
+        self.value_chars: List[str] = []
+        self.value_is_string = False
+
+    def feed(self, chunk: str) -> List[Event]:
+        """Consume a chunk of text and return the events it completed"""
+        events: List[Event] = []
+        for char in chunk:
+            if self.done:
+                break
+            self._consume(char, events)
+        return events
+
+    def _consume(self, char: str, events: List[Event]):
+        if self.depth == 0:
+            if char == '{':
+                self.depth = 1
+            return
+
+        reading_key = self.depth == 1 and self.expect == "key"
+        if self.expect == "value" and (self.value_chars or not char.isspace()):
+            self.value_chars.append(char)
+
+        if self.in_string:
+            self._consume_string_char(char, reading_key, events)
+            return
+
+        if char == '"':
+            self.in_string = True
+            if reading_key:
+                self.key_chars = []
+            elif self.depth == 1 and self.expect == "value" and len(self.value_chars) == 1:
+                self.value_is_string = True
+        elif char in '{[':
+            self.depth += 1
+        elif char in '}]':
+            self.depth -= 1
+            if self.depth == 0:
+                if self.value_chars:
+                    # The closing brace itself isn't part of a scalar value
+                    self.value_chars.pop()
+                self._finish_value(events)
+                self.done = True
+            elif self.depth == 1 and self.expect == "value":
+                self._finish_value(events)
+        elif self.depth == 1:
+            if char == ':' and self.expect == "colon":
+                self.expect = "value"
+                self.value_chars = []
+                self.value_is_string = False
+            elif char == ',':
+                if self.value_chars:
+                    self.value_chars.pop()
+                self._finish_value(events)
+                self.expect = "key"
+
+    def _consume_string_char(self, char: str, reading_key: bool, events: List[Event]):
+        decoded = self._decode(char)
+        if decoded is None:
+            return
+
+        if decoded == '':
+            # Closing quote
+            self.in_string = False
+            if reading_key:
+                self.current_key = ''.join(self.key_chars)
+                self.expect = "colon"
+            elif self.depth == 1 and self.value_is_string:
+                self._finish_value(events)
+            return
+
+        if reading_key:
+            self.key_chars.append(decoded)
+        elif self.depth == 1 and self.value_is_string and self.current_key in self.stream_fields:
+            # Merge characters of the same chunk into a single text event
+            if events and events[-1][0] == "text" and events[-1][1] == self.current_key:
+                events[-1] = ("text", self.current_key, events[-1][2] + decoded)
+            else:
+                events.append(("text", self.current_key, decoded))
+
+    def _decode(self, char: str) -> Optional[str]:
+        """
+        Decode one character inside a string
+
+        Returns the decoded text, '' for the closing quote, or None while an
+        escape sequence is still incomplete.
+        """
+        if self.unicode_digits is not None:
+            self.unicode_digits += char
+            if len(self.unicode_digits) < 4:
+                return None
+            code = int(self.unicode_digits, 16)
+            self.unicode_digits = None
+            self.escape = False
+            if 0xD800 <= code < 0xDC00:
+                self.high_surrogate = code
+                return None
+            if 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+                code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self.high_surrogate = None
+            return chr(code)
+
+        if self.escape:
+            if char == 'u':
+                self.unicode_digits = ''
+                return None
+            self.escape = False
+            return ESCAPES.get(char, char)
+
+        if char == '\\':
+            self.escape = True
+            return None
+        if char == '"':
+            return ''
+        return char
+
+    def _finish_value(self, events: List[Event]):
+        """Emit the parsed value of the current top-level field"""
+        if self.expect != "value" or self.current_key is None:
+            return
+        raw = ''.join(self.value_chars).strip()
+        self.expect = "comma"
+        self.value_chars = []
+        if not raw:
+            return
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        events.append(("field", self.current_key, value))
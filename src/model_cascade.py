@@ -0,0 +1,183 @@
+"""
+Model Cascade Module
+Tries a small, fast model first and escalates to a larger one only when its answer is unsure
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from request_scheduler import RequestScheduler
+from structured_output import StructuredOutput, response_payload
+
+SMALL_MODEL = "claude-3-5-haiku-20241022"
+LARGE_MODEL = "claude-sonnet-4-20250514"
+
+# Maps the structured payload of a response to a score; a response is accepted when score >= threshold
+ScoreFunction = Callable[[Any], float]
+
+
+class ModelCascade:
+    """
+    Sends a request to each model in turn until one is confident
+
+    A tier's response is accepted if its score (confidence, relevance, ...)
+    reaches the threshold. Malformed JSON, output that fails the stage's
+    schema, a failing score function or an API error on any tier but the
+    last escalates to the next tier; the last tier's response is always
+    returned. A single-model cascade is a plain call.
+    """
+
+    def __init__(self, models: List[str], threshold: float = 0.8):
+        """
+        Args:
+            models: Model ids from cheapest to most capable
+            threshold: Minimum score to accept a response without escalating
+        """
+        if not models:
+            raise ValueError("A cascade needs at least one model")
+        self.models = list(models)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.stats = {model: self._empty_tier() for model in self.models}
+
+    @staticmethod
+    def _empty_tier() -> Dict:
+        return {
+            "calls": 0,
+            "accepted": 0,
+            "escalated": 0,
+            "malformed": 0,
+            "errors": 0,
+            "seconds": 0.0,
+            "input_tokens": 0,
+            "output_tokens": 0
+        }
+
+    @property
+    def final_model(self) -> str:
+        return self.models[-1]
+
+    @property
+    def cache_id(self) -> str:
+        """Identifies the models and threshold that produce results, for ResultCache keys"""
+        if len(self.models) == 1:
+            return self.models[0]
+        return f"{'>'.join(self.models)}@{self.threshold}"
+
+    def _count(self, model: str, key: str, amount=1):
+        with self._lock:
+            self.stats[model][key] += amount
+
+    def _record(self, model: str, message, seconds: float):
+        usage = getattr(message, 'usage', None)
+        with self._lock:
+            tier = self.stats[model]
+            tier['calls'] += 1
+            tier['seconds'] += seconds
+            if usage is not None:
+                tier['input_tokens'] += (getattr(usage, 'input_tokens', 0) or 0) + \
+                                        (getattr(usage, 'cache_read_input_tokens', 0) or 0) + \
+                                        (getattr(usage, 'cache_creation_input_tokens', 0) or 0)
+                tier['output_tokens'] += getattr(usage, 'output_tokens', 0) or 0
+
+    def _accept(self, model: str, message, score: ScoreFunction,
+                output: Optional[StructuredOutput] = None) -> bool:
+        """Whether a non-final tier's response is valid and good enough to stop"""
+        try:
+            payload = output.payload(message) if output is not None else response_payload(message)
+            value = float(score(payload))
+        except Exception:
+            self._count(model, 'malformed')
+            return False
+        return value >= self.threshold
+
+    def call(self, scheduler: RequestScheduler, create: Callable, params: Dict, score: ScoreFunction,
+             output: Optional[StructuredOutput] = None):
+        """
+        Run the cascade through the scheduler
+
+        Args:
+            scheduler: RequestScheduler used for every tier
+            create: The client's messages.create
+            params: messages.create parameters; 'model' is replaced per tier
+            score: Function from the response payload (tool input) to a confidence-like score
+            output: The stage's StructuredOutput; a non-final tier's payload must pass its
+                    schema, so invalid output escalates instead of failing the whole stage
+
+        Returns:
+            The accepted response; the last tier's errors are raised
+        """
+        for tier, model in enumerate(self.models):
+            final = tier == len(self.models) - 1
+            start = time.perf_counter()
+            try:
+                message = scheduler.call(create, **{**params, "model": model})
+            except Exception:
+                if final:
+                    raise
+                self._count(model, 'errors')
+                self._count(model, 'escalated')
+                continue
+            self._record(model, message, time.perf_counter() - start)
+            if final or self._accept(model, message, score, output):
+                self._count(model, 'accepted')
+                return message
+            self._count(model, 'escalated')
+
+    async def call_async(self, scheduler: RequestScheduler, create: Callable, params: Dict, score: ScoreFunction,
+                         output: Optional[StructuredOutput] = None):
+        """Async version of call() for the AsyncAnthropic client"""
+        for tier, model in enumerate(self.models):
+            final = tier == len(self.models) - 1
+            start = time.perf_counter()
+            try:
+                message = await scheduler.call_async(create, **{**params, "model": model})
+            except Exception:
+                if final:
+                    raise
+                self._count(model, 'errors')
+                self._count(model, 'escalated')
+                continue
+            self._record(model, message, time.perf_counter() - start)
+            if final or self._accept(model, message, score, output):
+                self._count(model, 'accepted')
+                return message
+            self._count(model, 'escalated')
+
+    def review(self, model: str, message, score: ScoreFunction,
+               output: Optional[StructuredOutput] = None) -> Optional[str]:
+        """
+        Record a response obtained outside call(), e.g. a Message Batches result
+
+        Batch results have no per-request latency, so they add calls but no seconds.
+
+        Returns:
+            The next tier's model when the response is escalated, None when it is accepted
+        """
+        tier = self.models.index(model)
+        self._record(model, message, 0.0)
+        if tier == len(self.models) - 1 or self._accept(model, message, score, output):
+            self._count(model, 'accepted')
+            return None
+        self._count(model, 'escalated')
+        return self.models[tier + 1]
+
+    def review_error(self, model: str) -> Optional[str]:
+        """Record a request that failed outside call(); returns the next tier's model, or None on the last tier"""
+        tier = self.models.index(model)
+        if tier == len(self.models) - 1:
+            return None
+        self._count(model, 'errors')
+        self._count(model, 'escalated')
+        return self.models[tier + 1]
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Per tier: calls, hit rate (share of its calls that were final), average latency and tokens"""
+        with self._lock:
+            stats = {model: dict(tier) for model, tier in self.stats.items()}
+        for tier in stats.values():
+            tier['hit_rate'] = tier['accepted'] / (tier['calls'] + tier['errors']) \
+                if tier['calls'] + tier['errors'] else 0.0
+            tier['avg_seconds'] = tier['seconds'] / tier['calls'] if tier['calls'] else 0.0
+        return stats
@@ -0,0 +1,289 @@
+"""
+Near-Duplicate Module
+MinHash + LSH index that groups near-identical emails so a cluster's intent and retrieval are computed once
+"""
+
+import heapq
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from email_processor import Preprocessor
+
+# Details that differ between otherwise identical emails. Applied in order to
+# preprocess_email's cleaned_text (original case, so names are the capitalised words)
+IDENTIFIER_MASKS = [
+    (re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"), " EMAIL "),
+    (re.compile(r"\b((?i:my name is|this is))\s+[A-Z][a-z]+(?:\s+[A-Z][a-z]+)?"), r"\1 NAME"),
+    (re.compile(r"\b((?i:hi|hello|hey|dear))\s+[A-Z][a-z]+\b"), r"\1 NAME"),
+    (re.compile(r"\b((?i:thanks|thank you|regards|best|cheers|sincerely|thx))\b[,.!]*\s+"
+                r"[A-Z][a-z]+(?:\s+[A-Z][a-z]*\.?)?[.!]*\s*$"), r"\1 NAME"),
+    # Order numbers, phone numbers, dates, amounts
+    (re.compile(r"#?\d[\d\-/.,]*"), " NUM ")
+]
+
+WORD_RE = re.compile(r"[a-z]+")
+
+# Mersenne prime for the MinHash permutations (a * h + b) mod p
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64(0xFFFFFFFF)
+
+# Cluster size buckets for the report
+SIZE_BUCKETS = [(1, "1"), (4, "2-4"), (9, "5-9"), (49, "10-49"), (float('inf'), "50+")]
+
+
+def mask_identifiers(cleaned_text: str) -> str:
+    """cleaned_text with email addresses, names and numbers replaced by placeholders"""
+    for pattern, replacement in IDENTIFIER_MASKS:
+        cleaned_text = pattern.sub(replacement, cleaned_text)
+    return cleaned_text
+
+
+def size_bucket(size: int) -> str:
+    for limit, label in SIZE_BUCKETS:
+        if size <= limit:
+            return label
+
+
+class NearDuplicateIndex:
+    """
+    Clusters of near-identical recent emails
+
+    Each email is masked (mask_identifiers), cut into word shingles and
+    summarised by a MinHash signature. The signature's bands are hashed into
+    LSH buckets, so a lookup only compares against the clusters sharing a
+    bucket instead of every recent email. An email joins the most similar
+    candidate cluster when their estimated Jaccard similarity reaches
+    `threshold`; otherwise it starts a new cluster as its representative.
+
+    Only representatives are indexed, so every member is close to the email
+    whose results it reuses. Clusters expire when they haven't matched for
+    `max_age_seconds` or when more than `max_clusters` are live (least
+    recently matched first).
+
+    Clusters are plain dicts; callers may attach the representative's
+    results to them (see Pipeline).
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 32, threshold: float = 0.8,
+                 shingle_size: int = 3, max_clusters: int = 10_000,
+                 max_age_seconds: Optional[float] = 24 * 3600, seed: int = 1):
+        """
+        Args:
+            num_perm: MinHash signature length
+            bands: LSH bands of num_perm / bands rows each (more bands = more candidates)
+            threshold: Minimum estimated Jaccard similarity of the word shingles
+            shingle_size: Words per shingle
+            max_clusters: Live clusters kept for matching
+            max_age_seconds: Clusters not matched for this long expire (None = never)
+            seed: Seed of the permutation parameters
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.max_clusters = max_clusters
+        self.max_age_seconds = max_age_seconds
+
+        rng = random.Random(seed)
+        prime = int(MERSENNE_PRIME)
+        self._a = np.array([rng.randrange(1, prime) for _ in range(num_perm)], dtype=np.uint64)
+        self._b = np.array([rng.randrange(0, prime) for _ in range(num_perm)], dtype=np.uint64)
+
+        self.clusters: "OrderedDict[int, Dict]" = OrderedDict()
+        self.buckets: List[Dict[bytes, set]] = [{} for _ in range(bands)]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.stats = {"emails": 0, "clusters": 0, "duplicates": 0, "expired": 0,
+                      "candidates_compared": 0, "calls_saved": 0, "largest_cluster": 0}
+        self.expired_sizes = Counter()
+
+    def _shingles(self, text: str) -> np.ndarray:
+        """crc32 hashes of the masked text's word shingles"""
+        words = WORD_RE.findall(mask_identifiers(text).lower())
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        return np.array([zlib.crc32(s.encode()) for s in shingles], dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature (num_perm values) of a cleaned text"""
+        hashes = self._shingles(text)
+        # (num_perm × shingles) permuted hashes; the uint64 wrap-around is part of the hash
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _expire(self, now: float):
+        while self.clusters:
+            cluster_id, cluster = next(iter(self.clusters.items()))
+            too_old = self.max_age_seconds is not None and now - cluster['last_seen'] > self.max_age_seconds
+            if len(self.clusters) <= self.max_clusters and not too_old:
+                break
+            self._remove(cluster_id)
+            self.stats['expired'] += 1
+
+    def _remove(self, cluster_id: int):
+        cluster = self.clusters.pop(cluster_id)
+        self.expired_sizes[size_bucket(cluster['size'])] += 1
+        for band, key in enumerate(cluster['band_keys']):
+            members = self.buckets[band].get(key)
+            if members is not None:
+                members.discard(cluster_id)
+                if not members:
+                    del self.buckets[band][key]
+
+    def assign(self, preprocessed: Dict, email_id: Any = None) -> Tuple[Dict, bool, float]:
+        """
+        Put an email into its cluster, starting a new one if nothing recent is similar enough
+
+        Args:
+            preprocessed: preprocess_email result (its cleaned_text is compared)
+            email_id: Identifier recorded as the representative of a new cluster
+
+        Returns:
+            (cluster, is_new, similarity): the cluster dict (id, representative,
+            size, ...), whether this email started it, and its estimated
+            similarity to the representative
+        """
+        signature = self.signature(preprocessed['cleaned_text'])
+        band_keys = self._band_keys(signature)
+        now = time.time()
+
+        with self._lock:
+            self._expire(now)
+            self.stats['emails'] += 1
+
+            candidates = set()
+            for band, key in enumerate(band_keys):
+                candidates |= self.buckets[band].get(key, set())
+            self.stats['candidates_compared'] += len(candidates)
+
+            best_id, best_similarity = None, 0.0
+            for cluster_id in candidates:
+                similarity = float(np.mean(self.clusters[cluster_id]['signature'] == signature))
+                if similarity > best_similarity:
+                    best_id, best_similarity = cluster_id, similarity
+
+            if best_id is not None and best_similarity >= self.threshold:
+                cluster = self.clusters[best_id]
+                self.clusters.move_to_end(best_id)
+                cluster['size'] += 1
+                cluster['last_seen'] = now
+                self.stats['duplicates'] += 1
+                self.stats['largest_cluster'] = max(self.stats['largest_cluster'], cluster['size'])
+                return cluster, False, best_similarity
+
+            cluster = {
+                "id": self._next_id,
+                "representative": email_id,
+                "size": 1,
+                "signature": signature,
+                "band_keys": band_keys,
+                "last_seen": now
+            }
+            self._next_id += 1
+            self.clusters[cluster['id']] = cluster
+            for band, key in enumerate(band_keys):
+                self.buckets[band].setdefault(key, set()).add(cluster['id'])
+            self.stats['clusters'] += 1
+            self.stats['largest_cluster'] = max(self.stats['largest_cluster'], 1)
+            return cluster, True, 1.0
+
+    def discard(self, cluster_id: int):
+        """Drop a cluster (e.g. its representative failed), so the next similar email starts a new one"""
+        with self._lock:
+            if cluster_id in self.clusters:
+                self._remove(cluster_id)
+
+    def record_reuse(self, calls_saved: int):
+        """Count API calls a cluster member skipped by reusing the representative's results"""
+        with self._lock:
+            self.stats['calls_saved'] += calls_saved
+
+    def get_stats(self, top: int = 5) -> Dict:
+        """Clusters, duplicate rate, cluster size distribution, largest live clusters and API calls saved"""
+        with self._lock:
+            stats = dict(self.stats)
+            sizes = self.expired_sizes.copy()
+            sizes.update(size_bucket(cluster['size']) for cluster in self.clusters.values())
+            largest = heapq.nlargest(top, self.clusters.values(), key=lambda cluster: cluster['size'])
+            stats['live_clusters'] = len(self.clusters)
+
+        stats['duplicate_rate'] = stats['duplicates'] / stats['emails'] if stats['emails'] else 0.0
+        stats['avg_cluster_size'] = stats['emails'] / stats['clusters'] if stats['clusters'] else 0.0
+        stats['cluster_sizes'] = {label: sizes[label] for _, label in SIZE_BUCKETS if sizes[label]}
+        stats['largest_clusters'] = [
+            {"representative": cluster['representative'], "size": cluster['size']}
+            for cluster in largest if cluster['size'] > 1
+        ]
+        return stats
+
+
+def outage_backlog(count: int, seed: int = 7) -> List[Dict]:
+    """The test emails plus a burst of personalised copies of two outage complaints"""
+    with open('../data/test_emails.json', 'r') as f:
+        emails = json.load(f)['test_emails']
+
+    names = ["Alex Morgan", "Sam Lee", "Jordan Blake", "Priya Shah", "Chris Novak", "Maria Costa"]
+    outage = [
+        ("Where is my order?", "Hi Norman, I placed order #{order} on {day} and the tracking page still says "
+                               "label created. Where is my order? Please let me know. Thanks, {name}"),
+        ("Site is down", "Hello, your website has been down all morning and I can't log in to check order "
+                         "{order}. Is the site down for everyone? Regards, {name}")
+    ]
+    rng = random.Random(seed)
+    backlog = list(emails)
+    for i in range(count):
+        subject, body = outage[rng.random() < 0.4]
+        backlog.append({
+            "id": f"outage-{i}",
+            "subject": subject,
+            "body": body.format(order=rng.randint(10000, 99999), day=f"March {rng.randint(1, 28)}",
+                                name=rng.choice(names))
+        })
+    rng.shuffle(backlog)
+    return backlog
+
+
+def main():
+    """Cluster an outage-day backlog (pass a number for the size of the burst)"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    backlog = outage_backlog(count)
+    preprocessor = Preprocessor()
+    index = NearDuplicateIndex()
+
+    print("="*70)
+    print(f"NEAR-DUPLICATE CLUSTERING ({len(backlog)} emails)")
+    print("="*70)
+
+    start = time.perf_counter()
+    for email in backlog:
+        index.assign(preprocessor.preprocess(email), email['id'])
+    seconds = time.perf_counter() - start
+
+    stats = index.get_stats()
+    print(f"\n🧬 {stats['emails']} emails → {stats['clusters']} clusters "
+          f"({stats['duplicate_rate']*100:.0f}% near-duplicates, {seconds / len(backlog) * 1e3:.2f} ms/email)")
+    print(f"   Candidates compared per email: {stats['candidates_compared'] / stats['emails']:.2f}")
+    print(f"   Cluster sizes: {stats['cluster_sizes']}")
+    for cluster in stats['largest_clusters']:
+        print(f"   #{cluster['representative']}: {cluster['size']} emails")
+    # Each duplicate skips the intent call and the Claude ranking call
+    print(f"\n💰 Up to {stats['duplicates'] * 2} intent + ranking API calls avoided")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+"""
+Pipeline Module
+Runs the full workflow concurrently: each stage is an asyncio worker pool
+connected to the next by a bounded queue
+"""
+
+import asyncio
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+
+from cpu_pool import CPUStagePool
+from email_ingest import stream_emails
+from email_processor import Preprocessor, TextReducer
+from intent_detector import FAST_PATH_REASONING, IntentDetector
+from rag_system import RAGSystem
+from draft_generator import DraftGenerator
+from quality_checker import QualityChecker
+from near_duplicate import NearDuplicateIndex
+from priority_queue import LatencyTracker, PriorityJobQueue, priority_key, received_time
+from stage_planner import StagePlanner
+
+STAGES = ["preprocess", "intent", "rag", "draft", "quality"]
+
+# Workers per stage. Draft generation is the slowest call, so it gets the most.
+DEFAULT_CONCURRENCY = {
+    "preprocess": 1,
+    "intent": 16,
+    "rag": 16,
+    "draft": 32,
+    "quality": 24
+}
+
+ACTION_ICONS = {
+    "ESCALATE_TO_HUMAN": "🚨",
+    "HUMAN_REVIEW_WITH_DRAFT": "👤",
+    "AUTO_SEND": "✅"
+}
+
+
+def choose_top_k(email: Dict, intent_result: Dict) -> int:
+    """Number of FAQs to retrieve, based on email complexity"""
+    if email.get('complexity') == 'complex':
+        return 5
+    elif intent_result['category'] == 'MULTIPLE':
+        return 5
+    else:
+        return 3
+
+
+def route_email(preprocessed: Dict, draft_result: Dict, quality_result: Dict) -> Dict:
+    """
+    Final routing decision matrix, in priority order
+
+    Returns:
+        Dict with action, reason, final_confidence and a display label
+    """
+    needs_human = draft_result['needs_human'] or quality_result['needs_human_review']
+    final_confidence = min(draft_result['confidence'], quality_result['quality_score'])
+    is_urgent = preprocessed['urgency_level'] == "HIGH"
+
+    # is_safe is None when QC was skipped: no verdict either way
+    if quality_result['is_safe'] is False:
+        action = "ESCALATE_TO_HUMAN"
+        reason = "Safety concern detected"
+    elif is_urgent:
+        action = "ESCALATE_TO_HUMAN"
+        reason = f"Customer urgency: {preprocessed['urgency_level']} (overrides quality metrics)"
+    elif needs_human:
+        action = "HUMAN_REVIEW_WITH_DRAFT"
+        reason = "Draft or QC flagged for review"
+    elif final_confidence >= 0.85:
+        action = "AUTO_SEND"
+        reason = "High confidence, safe to auto-send"
+    else:
+        action = "HUMAN_REVIEW_WITH_DRAFT"
+        reason = f"Confidence too low ({final_confidence:.2f})"
+
+    label = f"{ACTION_ICONS[action]} {action}"
+    if is_urgent and quality_result['is_safe'] is not False:
+        label += " (HIGH URGENCY)"
+
+    return {
+        "action": action,
+        "reason": reason,
+        "final_confidence": final_confidence,
+        "label": label
+    }
+
+
+class Pipeline:
+    """
+    Concurrent email pipeline built on the async methods of the four modules
+
+    preprocess → intent → RAG → draft → QC → routing. Each stage has its own
+    worker pool; queues between stages are bounded, so a slow stage
+    naturally applies backpressure to the stages before it.
+    
+    Once preprocessed, emails wait in priority queues ordered by urgency,
+    age and optional SLA deadline (see priority_queue.priority_key), so a
+    HIGH-urgency email overtakes the backlog in front of the LLM stages.
+    
+    A StagePlanner skips draft and QC calls that can't change the routing.
+    
+    With speculative retrieval, the local FAQ search across all categories
+    runs alongside intent detection; the RAG stage then only cuts the
+    category shortlist from the prefetched scores.
+    
+    With a CPUStagePool, preprocessing and FAQ scoring run in chunks on
+    worker processes instead of the event loop's thread; their results
+    stream back in input order and the jobs enter the LLM stages with both
+    already filled in.
+    
+    Near-duplicate emails (NearDuplicateIndex, e.g. the same "where is my
+    order" on an outage day) share one intent call and one retrieval: the
+    cluster representative's results are reused and only the draft and QC
+    run per email. A member that reaches the intent stage before its
+    representative starts the representative's lookup as a separate task,
+    so waiting members never hold up the workers the representative needs.
+    
+    Every LLM stage sees the body after TextReducer removed quoted history,
+    signatures and disclaimers (job['text']); job['reduction'] keeps the
+    removed spans.
+    """
+
+    def __init__(self, detector: IntentDetector, rag: RAGSystem, generator: DraftGenerator,
+                 checker: QualityChecker, concurrency: Optional[Dict[str, int]] = None,
+                 queue_size: int = 64, intake_size: int = 10_000,
+                 urgency_offsets: Optional[Dict[str, float]] = None,
+                 planner: Optional[StagePlanner] = None, speculative_retrieval: bool = True,
+                 cpu_pool: Optional[CPUStagePool] = None,
+                 near_duplicates: Optional[NearDuplicateIndex] = None, reuse_near_duplicates: bool = True,
+                 reducer: Optional[TextReducer] = None, reduce_bodies: bool = True):
+        """
+        Args:
+            detector, rag, generator, checker: The stage implementations
+            concurrency: Workers per stage, merged over DEFAULT_CONCURRENCY
+            queue_size: Capacity of each inter-stage queue
+            intake_size: Capacity of the prioritized backlog between preprocessing and intent
+            urgency_offsets: Per-urgency delay in seconds used for aging (see priority_key)
+            planner: Decides which stages to skip (defaults to StagePlanner's default policy;
+                     pass StagePlanner(FULL_STAGE_POLICY) to run every stage)
+            speculative_retrieval: Score FAQs concurrently with intent detection
+            cpu_pool: Optional process pool for preprocessing and FAQ scoring
+                      (its rag_options must match `rag`)
+            near_duplicates: Index of recent emails (defaults to NearDuplicateIndex();
+                             share one across runs to match against earlier backlogs)
+            reuse_near_duplicates: Reuse a cluster representative's intent and FAQs
+            reducer: Body reducer (defaults to TextReducer())
+            reduce_bodies: Strip quoted history, signatures and boilerplate before the LLM stages
+                           (with a cpu_pool, set the pool's reduce_bodies the same way)
+        """
+        self.detector = detector
+        self.rag = rag
+        self.generator = generator
+        self.checker = checker
+        self.concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self.queue_size = queue_size
+        self.intake_size = intake_size
+        self.urgency_offsets = urgency_offsets
+        self.planner = planner or StagePlanner()
+        self.speculative_retrieval = speculative_retrieval
+        self.cpu_pool = cpu_pool
+        self.near_duplicates = (near_duplicates or NearDuplicateIndex()) if reuse_near_duplicates else None
+        self.reducer = (reducer or TextReducer()) if reduce_bodies else None
+        if checker.grounding_verifier is not None:
+            # Drafts may repeat what the system prompt tells the model about the persona
+            checker.grounding_verifier.add_known_text(generator._system_prompt())
+        self.preprocessor = Preprocessor()
+        self.stats = self._empty_stats()
+        self.latency = LatencyTracker()
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
+            "emails": 0,
+            "errors": 0,
+            "wall_seconds": 0.0,
+            "stages": {stage: {"count": 0, "seconds": 0.0} for stage in STAGES}
+        }
+
+    async def _preprocess(self, job: Dict):
+        local = job.pop('local', None)
+        if local is not None:
+            # Already done by the CPU pool
+            job['preprocessed'] = local['preprocessed']
+            job['faq_scores'] = local['faq_scores']
+            job['reduction'] = local['reduction']
+            if job['reduction'] is not None and self.reducer is not None:
+                self.reducer.record(job['reduction'])
+        else:
+            job['preprocessed'] = self.preprocessor.preprocess(job['email'])
+            job['reduction'] = self.reducer.reduce(job['email']['body']) if self.reducer is not None else None
+        # The body the LLM stages see
+        job['text'] = job['reduction']['body'] if job['reduction'] is not None else job['email']['body']
+        job['priority'] = priority_key(
+            job['preprocessed']['urgency_level'],
+            job['received_at'],
+            job['email'].get('sla_deadline'),
+            self.urgency_offsets
+        )
+        if self.near_duplicates is not None:
+            cluster, is_new, similarity = self.near_duplicates.assign(job['preprocessed'], job['email'].get('id'))
+            if is_new:
+                cluster['email'] = job['email']
+                cluster['text'] = job['text']
+            job['cluster'] = cluster
+            job['near_duplicate'] = {
+                "cluster": cluster['id'],
+                "representative": cluster['representative'],
+                "is_representative": is_new,
+                "similarity": round(similarity, 3)
+            }
+
+    @staticmethod
+    def _loop_future(cluster: Dict) -> Optional[asyncio.Future]:
+        """The cluster's pending lookup, if it belongs to this run's event loop"""
+        future = cluster.get('future')
+        if future is not None and future.get_loop() is asyncio.get_running_loop():
+            return future
+        return None
+
+    async def _lookup_representative(self, cluster: Dict, future: asyncio.Future):
+        """Intent and FAQs for a representative whose own job is still queued"""
+        email = cluster['email']
+        try:
+            intent = await self.detector.detect_intent_async(cluster['text'])
+            relevant_faqs = await self.rag.search_relevant_faqs_async(
+                customer_question=cluster['text'],
+                category=intent['category'],
+                top_k=choose_top_k(email, intent)
+            )
+            cluster['result'] = {"intent": intent, "relevant_faqs": relevant_faqs}
+        except Exception as e:
+            print(f"Error looking up near-duplicate cluster {cluster['id']}: {e}")
+            self.near_duplicates.discard(cluster['id'])
+        future.set_result(cluster.get('result'))
+
+    async def _reuse_cluster(self, job: Dict) -> bool:
+        """Fill intent and FAQs from the job's cluster; False when the job must compute them itself"""
+        cluster = job.get('cluster')
+        if cluster is None:
+            return False
+        is_representative = job['near_duplicate']['is_representative']
+
+        shared = cluster.get('result')
+        if shared is None:
+            future = self._loop_future(cluster)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                cluster['future'] = future
+                if is_representative:
+                    # Computed by this job's own intent and RAG stages, published in _rag
+                    return False
+                cluster['lookup'] = asyncio.create_task(self._lookup_representative(cluster, future))
+            shared = await future
+            if shared is None:
+                # The representative failed; compute this one independently
+                return False
+
+        job['intent'] = dict(shared['intent'])
+        job['relevant_faqs'] = [dict(faq) for faq in shared['relevant_faqs']]
+        job.pop('faq_scores', None)
+        if not is_representative:
+            calls_saved = int(shared['intent'].get('reasoning') != FAST_PATH_REASONING)
+            calls_saved += int(any(faq.get('relevance_source') == "claude" for faq in shared['relevant_faqs']))
+            self.near_duplicates.record_reuse(calls_saved)
+        return True
+
+    def _release_cluster(self, job: Dict):
+        """Unblock members waiting on a representative that won't publish (it failed)"""
+        cluster = job.get('cluster')
+        if cluster is None or not job['near_duplicate']['is_representative'] or 'result' in cluster:
+            return
+        future = self._loop_future(cluster)
+        if future is not None and not future.done():
+            future.set_result(None)
+        self.near_duplicates.discard(cluster['id'])
+
+    async def _intent(self, job: Dict):
+        if await self._reuse_cluster(job):
+            return
+        body = job['text']
+        if not self.speculative_retrieval or 'faq_scores' in job:
+            job['intent'] = await self.detector.detect_intent_async(body)
+            return
+        # Local scoring is CPU work, so it runs in a thread while the intent call is awaited
+        job['intent'], job['faq_scores'] = await asyncio.gather(
+            self.detector.detect_intent_async(body),
+            asyncio.to_thread(self.rag.prefetch_scores, body)
+        )
+
+    async def _rag(self, job: Dict):
+        if 'relevant_faqs' in job:
+            # Reused from the near-duplicate cluster
+            return
+        top_k = choose_top_k(job['email'], job['intent'])
+        job['relevant_faqs'] = await self.rag.search_relevant_faqs_async(
+            customer_question=job['text'],
+            category=job['intent']['category'],
+            top_k=top_k,
+            prefetched_scores=job.pop('faq_scores', None)
+        )
+        cluster = job.get('cluster')
+        if cluster is not None and job['near_duplicate']['is_representative']:
+            cluster['result'] = {"intent": job['intent'], "relevant_faqs": job['relevant_faqs']}
+            future = self._loop_future(cluster)
+            if future is not None and not future.done():
+                future.set_result(cluster['result'])
+
+    async def _draft(self, job: Dict):
+        mode = self.planner.plan_draft(job['preprocessed'])
+        if mode == "none":
+            job['draft'] = self.planner.skipped_draft(self.generator.persona['name'])
+            return
+        job['draft'] = await self.generator.generate_draft_async(
+            job['text'],
+            job['relevant_faqs'],
+            brief=mode == "brief",
+            preprocessed=job['preprocessed']
+        )
+
+    async def _quality(self, job: Dict):
+        skip_reason = self.planner.plan_quality(job['preprocessed'], job['draft'])
+        if skip_reason is not None:
+            job['quality'] = self.planner.skipped_quality(job['draft'], skip_reason)
+        else:
+            job['quality'] = await self.checker.check_quality_async(
+                job['text'],
+                job['draft']['draft'],
+                job['relevant_faqs'],
+                full_message=job['preprocessed']['cleaned_text']
+            )
+        job['routing'] = route_email(job['preprocessed'], job['draft'], job['quality'])
+
+    async def _worker(self, stage: str, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue], results: List):
+        handler = getattr(self, f"_{stage}")
+        while True:
+            job = await inbox.get()
+            try:
+                start = time.perf_counter()
+                try:
+                    await handler(job)
+                except Exception as e:
+                    print(f"Error in {stage} stage for email {job['email'].get('id')}: {e}")
+                    job['error'] = f"{stage}: {e}"
+                    job['routing'] = {
+                        "action": "ESCALATE_TO_HUMAN",
+                        "reason": f"Pipeline error in {stage} stage",
+                        "final_confidence": 0.0,
+                        "label": "🚨 ESCALATE_TO_HUMAN"
+                    }
+                    self.stats['errors'] += 1
+                stage_stats = self.stats['stages'][stage]
+                stage_stats['count'] += 1
+                stage_stats['seconds'] += time.perf_counter() - start
+
+                if outbox is not None and 'error' not in job:
+                    await outbox.put(job)
+                else:
+                    self._finish(job, results)
+            finally:
+                inbox.task_done()
+
+    @staticmethod
+    async def _submit(queue: asyncio.Queue, results: List, email: Dict, local: Optional[Dict] = None):
+        job = {
+            "index": len(results),
+            "email": email,
+            "received_at": received_time(email),
+            "submitted_at": time.perf_counter()
+        }
+        if local is not None:
+            job['local'] = local
+        results.append(None)
+        await queue.put(job)
+
+    def _finish(self, job: Dict, results: List):
+        self._release_cluster(job)
+        job.pop('cluster', None)
+        job['latency'] = time.perf_counter() - job['submitted_at']
+        urgency = job.get('preprocessed', {}).get('urgency_level', 'UNKNOWN')
+        self.latency.record(urgency, job['latency'])
+        results[job['index']] = job
+
+    async def run(self, emails: Iterable[Dict]) -> List[Dict]:
+        """
+        Process emails concurrently
+
+        Args:
+            emails: Iterable of dicts with 'subject' and 'body' keys (read lazily).
+                Optional 'received_at' and 'sla_deadline' (epoch seconds) feed prioritization.
+
+        Returns:
+            One job dict per email, in input order, with preprocessed, intent,
+            relevant_faqs, draft, quality and routing keys
+        """
+        self.stats = self._empty_stats()
+        self.latency = LatencyTracker()
+        run_start = time.perf_counter()
+
+        # Arrival order into preprocessing, priority order everywhere after it
+        queues = [asyncio.Queue(maxsize=self.queue_size), PriorityJobQueue(maxsize=self.intake_size)]
+        queues += [PriorityJobQueue(maxsize=self.queue_size) for _ in STAGES[2:]]
+        results: List[Optional[Dict]] = []
+        workers = []
+        for i, stage in enumerate(STAGES):
+            outbox = queues[i + 1] if i + 1 < len(STAGES) else None
+            workers.append([
+                asyncio.create_task(self._worker(stage, queues[i], outbox, results))
+                for _ in range(self.concurrency[stage])
+            ])
+
+        try:
+            # Feeding blocks while the first queue is full (backpressure)
+            if self.cpu_pool is not None:
+                async for email, local in self.cpu_pool.process_async(emails):
+                    await self._submit(queues[0], results, email, local)
+            else:
+                for email in emails:
+                    await self._submit(queues[0], results, email)
+
+            # A stage's queue is drained only after every job was forwarded, so join in order
+            for queue in queues:
+                await queue.join()
+        finally:
+            for pool in workers:
+                for task in pool:
+                    task.cancel()
+            await asyncio.gather(*[task for pool in workers for task in pool], return_exceptions=True)
+
+        self.stats['emails'] = len(results)
+        self.stats['wall_seconds'] = time.perf_counter() - run_start
+        return results
+
+    def run_sync(self, emails: Iterable[Dict]) -> List[Dict]:
+        """Blocking wrapper around run()"""
+        return asyncio.run(self.run(emails))
+
+    def get_stats(self) -> Dict:
+        """Throughput, average time per stage and time-to-route per urgency level for the last run"""
+        stats = self.stats
+        wall = stats['wall_seconds']
+        return {
+            "latency_by_urgency": self.latency.report(),
+            "emails": stats['emails'],
+            "errors": stats['errors'],
+            "wall_seconds": wall,
+            "emails_per_minute": stats['emails'] / wall * 60 if wall else 0.0,
+            "avg_stage_seconds": {
+                stage: s['seconds'] / s['count'] if s['count'] else 0.0
+                for stage, s in stats['stages'].items()
+            }
+        }
+
+
+def main():
+    """
+    Run the concurrent pipeline over the test emails (or a mailbox export passed as an argument)
+    
+    Pass --processes to run preprocessing and FAQ scoring on a process pool.
+    """
+
+    # Streamed: the pipeline reads emails lazily as its intake queue has room
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    emails = stream_emails(paths[0] if paths else '../data/test_emails.json')
+
+    cpu_pool = CPUStagePool() if '--processes' in sys.argv else None
+    pipeline = Pipeline(IntentDetector(), RAGSystem(), DraftGenerator(), QualityChecker(), cpu_pool=cpu_pool)
+
+    print("="*70)
+    print("CONCURRENT PIPELINE TEST")
+    print("="*70)
+
+    results = pipeline.run_sync(emails)
+
+    for job in results:
+        routing = job['routing']
+        print(f"\n📧 Email #{job['email']['id']}: {job['email']['subject']}")
+        if 'intent' in job:
+            print(f"   Category: {job['intent']['category']}")
+        print(f"   → {routing['label']}: {routing['reason']}")
+        duplicate = job.get('near_duplicate')
+        if duplicate and not duplicate['is_representative']:
+            print(f"   ♻️  Intent and FAQs reused from #{duplicate['representative']} "
+                  f"(similarity {duplicate['similarity']:.2f})")
+        print(f"   Latency: {job['latency']:.1f}s")
+
+    stats = pipeline.get_stats()
+    print(f"\n📊 {stats['emails']} emails in {stats['wall_seconds']:.1f}s "
+          f"({stats['emails_per_minute']:.0f} emails/minute, {stats['errors']} errors)")
+    for stage, seconds in stats['avg_stage_seconds'].items():
+        print(f"   {stage}: {seconds:.2f}s average")
+    
+    print(f"\n⏱️  Time to route by urgency:")
+    for urgency, latency in stats['latency_by_urgency'].items():
+        print(f"   {urgency}: p50 {latency['p50']:.1f}s, p95 {latency['p95']:.1f}s ({latency['count']} emails)")
+    
+    planner_stats = pipeline.planner.get_stats()
+    print(f"\n✂️  Planner: {planner_stats['calls_saved']} API calls saved "
+          f"({planner_stats['drafts_skipped']} drafts, {planner_stats['quality_checks_skipped']} quality checks skipped), "
+          f"{planner_stats['brief_drafts']} brief drafts")
+    
+    if pipeline.reducer is not None:
+        reducer_stats = pipeline.reducer.get_stats()
+        print(f"\n📉 Text reduction: {reducer_stats['avg_original_tokens']:.0f} → {reducer_stats['avg_tokens']:.0f} "
+              f"body tokens per email ({reducer_stats['reduced']} emails had quoted history, signatures or disclaimers)")
+    
+    if pipeline.near_duplicates is not None:
+        dedup_stats = pipeline.near_duplicates.get_stats()
+        print(f"\n♻️  Near-duplicates: {dedup_stats['duplicates']}/{dedup_stats['emails']} emails "
+              f"in {dedup_stats['clusters']} clusters, {dedup_stats['calls_saved']} intent/ranking calls saved")
+        print(f"   Cluster sizes: {dedup_stats['cluster_sizes']}")
+    
+    template_stats = pipeline.generator.get_template_stats()
+    print(f"\n📋 Template drafts: {template_stats['template_hits']}/{template_stats['total']} "
+          f"({template_stats['hit_rate']*100:.0f}%), ~{template_stats['estimated_seconds_saved']:.1f}s of generation saved")
+    for name, template in template_stats['by_template'].items():
+        if template['hits']:
+            print(f"   {name}: {template['hits']} drafts, ~{template['estimated_seconds_saved']:.1f}s saved")
+    
+    if pipeline.checker.pre_checker is not None:
+        pre_stats = pipeline.checker.pre_checker.get_stats()
+        print(f"\n📏 Rule-based pre-QC: {pre_stats['settled_rate']*100:.0f}% of {pre_stats['checked']} drafts settled locally "
+              f"({pre_stats['escalated']} escalated, {pre_stats['passed']} passed, {pre_stats['ambiguous']} sent to Claude)")
+    
+    if pipeline.checker.grounding_verifier is not None:
+        grounding_stats = pipeline.checker.grounding_verifier.get_stats()
+        print(f"\n🔎 Grounding: {grounding_stats['grounded']} grounded, {grounding_stats['weak']} weak, "
+              f"{grounding_stats['hallucinated']} with unsupported details ({grounding_stats['unsupported_claims']} claims)")
+    
+    print(f"\n🪜 Model cascades:")
+    for name, module in (("intent", pipeline.detector), ("rag", pipeline.rag),
+                         ("draft", pipeline.generator), ("quality", pipeline.checker)):
+        for model, tier in module.cascade.get_stats().items():
+            if tier['calls'] or tier['errors']:
+                print(f"   {name} / {model}: {tier['calls']} calls, {tier['hit_rate']*100:.0f}% final, "
+                      f"{tier['avg_seconds']:.2f}s avg, {tier['input_tokens']} in / {tier['output_tokens']} out tokens")
+    
+    print(f"\n🧩 Structured output:")
+    for name, module in (("intent", pipeline.detector), ("rag", pipeline.rag),
+                         ("draft", pipeline.generator), ("quality", pipeline.checker)):
+        output = module.output.get_stats()
+        print(f"   {name}: {output['failure_rate']*100:.1f}% invalid responses "
+              f"({output['retries']} retries, {output['exhausted']} gave up)")
+    
+    scheduler_stats = pipeline.detector.scheduler.get_stats()
+    print(f"\n🚦 Scheduler: {scheduler_stats['requests']} requests, {scheduler_stats['retries']} retries, "
+          f"{scheduler_stats['throttle_events']} throttle events, max queue depth {scheduler_stats['max_queue_depth']}, "
+          f"concurrency limit {scheduler_stats['concurrency_limit']}")
+    print(f"   Tokens: {scheduler_stats['input_tokens']} input, {scheduler_stats['output_tokens']} output, "
+          f"{scheduler_stats['cache_read_input_tokens']} cache read, {scheduler_stats['cache_creation_input_tokens']} cache write "
+          f"({scheduler_stats['prompt_cache_hit_rate']*100:.0f}% of prompt tokens from cache)")
+    
+    print(f"\n📐 Prompt budgets (tokens per call, estimated / actual / budget):")
+    for stage, budget in pipeline.detector.budget.get_stats().items():
+        print(f"   {stage}: {budget['avg_estimated_tokens']:.0f} / {budget['avg_actual_tokens']:.0f} / {budget['budget']} "
+              f"({budget['over_budget_actual']} over; {budget['items_dropped']} items dropped, "
+              f"{budget['texts_truncated']} texts and {budget['answers_truncated']} answers truncated)")
+    
+    if cpu_pool is not None:
+        pool_stats = cpu_pool.get_stats()
+        print(f"\n🧮 CPU pool: {pool_stats['items']} emails in {pool_stats['chunks']} chunks "
+              f"across {pool_stats['workers']} worker processes")
+        cpu_pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Pre-Quality Check Module
+Deterministic rules that settle clear-cut drafts locally so only ambiguous ones reach the Claude quality check
+"""
+
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+# Phrases that mean the draft itself hands the case to a person (QC prompt + draft prompt lists)
+ESCALATION_PHRASES = [
+    "I'll need to look into",
+    "I'll need to check",
+    "have our team check",
+    "pass this to",
+    "forward this to",
+    "our team will",
+    "look into this for you",
+    "have someone reach out",
+    "reaches out to you",
+    "specialist will contact"
+]
+
+# Template slots and drafting leftovers that must never reach a customer
+PLACEHOLDER_PATTERNS = [
+    r"\[[A-Za-z][A-Za-z _/-]*\]",              # [Customer Name], [ORDER NUMBER]
+    r"\{\{?\s*[A-Za-z_][\w.]*\s*\}?\}",          # {name}, {{ order_id }}
+    r"<\s*(?:insert|your|customer)[^>]*>",      # <insert tracking link>
+    r"\b(?:TODO|TBD|XXX+|lorem ipsum)\b"
+]
+
+# Words ignored when measuring overlap with the snippets
+STOPWORDS = frozenset("""
+a an the and or but if so of to in on at by for from with about as into is are was were be been being
+it its this that these those there here i i'm i'll i'd we we'll we're our you you're your yours he she they
+them their my me us do does did have has had can could will would should may might just also very
+please thanks thank hi hello dear best regards sure happy glad help let know any
+""".split())
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+APOSTROPHES = str.maketrans({"’": "'", "‘": "'"})
+
+
+def content_words(text: str) -> List[str]:
+    """Lowercased words of a text without stopwords"""
+    return [w for w in WORD_RE.findall(text.lower().translate(APOSTROPHES)) if w not in STOPWORDS]
+
+
+def ngrams(words: List[str], n: int) -> Set[Tuple[str, ...]]:
+    """Set of word n-grams (a single n-gram of the whole list when it is shorter than n)"""
+    if len(words) < n:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+class RuleBasedPreChecker:
+    """
+    Fast local pre-check for drafts
+
+    Returns one of three outcomes:
+    - "escalate": an escalation phrase, a placeholder or a draft too short
+      to be a reply; Claude would escalate these anyway
+    - "pass": every claim sentence is grounded in the snippets (n-gram
+      overlap), no rule fired and the length is normal
+    - "ambiguous": anything else, left to the Claude quality check
+    """
+
+    def __init__(self, ngram_size: int = 2, sentence_overlap: float = 0.5, min_claim_words: int = 5,
+                 min_words: int = 8, max_words: int = 350, pass_score: float = 0.9):
+        """
+        Args:
+            ngram_size: Length of the content-word n-grams compared with the snippets
+            sentence_overlap: Share of a sentence's n-grams that must occur in the snippets
+            min_claim_words: Content words that make a sentence a claim that needs grounding
+            min_words: Drafts shorter than this are escalated
+            max_words: Drafts longer than this are left to Claude
+            pass_score: quality_score given to drafts that pass locally
+        """
+        self.ngram_size = ngram_size
+        self.sentence_overlap = sentence_overlap
+        self.min_claim_words = min_claim_words
+        self.min_words = min_words
+        self.max_words = max_words
+        self.pass_score = pass_score
+
+        # One alternation for all phrases; longest first so overlapping phrases report the full match
+        phrases = sorted(ESCALATION_PHRASES, key=len, reverse=True)
+        self.escalation_re = re.compile("|".join(re.escape(p.lower()) for p in phrases))
+        self.placeholder_re = re.compile("|".join(PLACEHOLDER_PATTERNS), re.IGNORECASE)
+
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "escalated": 0, "passed": 0, "ambiguous": 0}
+
+    def check(self, draft_reply: str, knowledge_snippets: List[Dict], grounding: Optional[Dict] = None) -> Dict:
+        """
+        Run the rules on a draft
+
+        Args:
+            grounding: Optional GroundingVerifier result; a "hallucinated" verdict escalates
+                       and anything but "grounded" rules out a local pass
+
+        Returns:
+            Dict with outcome ("escalate", "pass" or "ambiguous"), issues and overlap
+            (share of claim sentences found in the snippets, None without claims)
+        """
+        issues = []
+        text = draft_reply.translate(APOSTROPHES)
+
+        phrases = sorted(set(m.group(0) for m in self.escalation_re.finditer(text.lower())))
+        if phrases:
+            issues.append(f"Draft requests human follow-up: {', '.join(phrases)}")
+        placeholders = sorted(set(m.group(0) for m in self.placeholder_re.finditer(text)))
+        if placeholders:
+            issues.append(f"Unfilled placeholders: {', '.join(placeholders)}")
+        word_count = len(WORD_RE.findall(text.lower()))
+        if word_count < self.min_words:
+            issues.append(f"Draft too short ({word_count} words)")
+        if grounding is not None and grounding['verdict'] == "hallucinated":
+            issues.extend(grounding['issues'])
+
+        overlap = self._grounding(text, knowledge_snippets)
+        verified = grounding is None or grounding['verdict'] == "grounded"
+
+        if issues:
+            outcome = "escalate"
+        elif word_count <= self.max_words and verified and overlap is not None and overlap >= 1.0:
+            outcome = "pass"
+        else:
+            outcome = "ambiguous"
+
+        with self._lock:
+            self.stats['checked'] += 1
+            self.stats[{"escalate": "escalated", "pass": "passed", "ambiguous": "ambiguous"}[outcome]] += 1
+
+        return {
+            "outcome": outcome,
+            "issues": issues,
+            "overlap": overlap,
+            "placeholders": placeholders
+        }
+
+    def _grounding(self, text: str, knowledge_snippets: List[Dict]) -> Optional[float]:
+        """Share of claim sentences whose n-grams overlap the snippets enough"""
+        snippet_ngrams = set()
+        for snippet in knowledge_snippets:
+            snippet_text = f"{snippet.get('question', '')} {snippet.get('answer', '')}"
+            snippet_ngrams |= ngrams(content_words(snippet_text), self.ngram_size)
+
+        claims = grounded = 0
+        for sentence in SENTENCE_RE.split(text):
+            words = content_words(sentence)
+            if len(words) < self.min_claim_words:
+                continue
+            claims += 1
+            sentence_ngrams = ngrams(words, self.ngram_size)
+            if len(sentence_ngrams & snippet_ngrams) >= self.sentence_overlap * len(sentence_ngrams):
+                grounded += 1
+
+        return grounded / claims if claims else None
+
+    def get_stats(self) -> Dict:
+        """Outcome counts and the share of drafts settled without an API call"""
+        with self._lock:
+            stats = dict(self.stats)
+        settled = stats['escalated'] + stats['passed']
+        stats['settled_rate'] = settled / stats['checked'] if stats['checked'] else 0.0
+        return stats
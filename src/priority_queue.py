@@ -0,0 +1,95 @@
+"""
+Priority Queue Module
+Orders pipeline work by urgency, age and optional SLA deadline
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Dict, List, Optional
+
+# How much later than a HIGH email an equally old email of each level is due.
+# Ordering by (received_at + offset) ages every email: a LOW email waiting
+# longer than its offset overtakes newly arrived HIGH mail, so it can't starve.
+DEFAULT_URGENCY_OFFSETS = {
+    "HIGH": 0.0,
+    "MEDIUM": 300.0,
+    "LOW": 900.0
+}
+
+
+def priority_key(urgency: str, received_at: float, sla_deadline: Optional[float] = None,
+                 offsets: Optional[Dict[str, float]] = None) -> float:
+    """
+    Virtual deadline of an email; smaller is served first
+
+    Args:
+        urgency: urgency_level from preprocess_email
+        received_at: Arrival time (epoch seconds)
+        sla_deadline: Optional absolute SLA deadline (epoch seconds); wins if earlier
+        offsets: Per-urgency delay in seconds (defaults to DEFAULT_URGENCY_OFFSETS)
+    """
+    offsets = offsets or DEFAULT_URGENCY_OFFSETS
+    key = received_at + offsets.get(urgency, offsets["LOW"])
+    if sla_deadline is not None:
+        key = min(key, sla_deadline)
+    return key
+
+
+class PriorityJobQueue(asyncio.Queue):
+    """
+    asyncio.Queue that hands out the job with the smallest job['priority']
+
+    Ties are served in arrival order. Supports maxsize, join() and
+    task_done() exactly like asyncio.Queue, so it can replace one directly.
+    """
+
+    def _init(self, maxsize):
+        self._queue = []
+        self._sequence = itertools.count()
+
+    def _put(self, job: Dict):
+        heapq.heappush(self._queue, (job['priority'], next(self._sequence), job))
+
+    def _get(self) -> Dict:
+        return heapq.heappop(self._queue)[2]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list (0.0 for an empty list)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class LatencyTracker:
+    """Records time-to-route per urgency level"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+
+    def record(self, urgency: str, seconds: float):
+        self.latencies.setdefault(urgency, []).append(seconds)
+
+    def report(self) -> Dict[str, Dict]:
+        """count, p50, p95 and max latency for each urgency level"""
+        return {
+            urgency: {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "max": max(values)
+            }
+            for urgency, values in self.latencies.items()
+        }
+
+
+def received_time(email: Dict, default: Optional[float] = None) -> float:
+    """Arrival time of an email: its 'received_at' field, else `default`, else now"""
+    if email.get('received_at') is not None:
+        return float(email['received_at'])
+    return default if default is not None else time.time()
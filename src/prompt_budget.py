@@ -0,0 +1,257 @@
+"""
+Prompt Budget Module
+Fits every stage's request into a token budget and records estimated vs. actual prompt sizes
+"""
+
+import json
+import sys
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence
+
+from request_scheduler import CHARS_PER_TOKEN, estimate_request_tokens
+
+# Input tokens per request (system prompt, tools and message), about twice today's typical size
+DEFAULT_BUDGETS = {
+    "intent": 1000,
+    "rag": 1500,
+    "draft": 2500,
+    "quality": 2500,
+    # One batched intent request; detect_intents splits its emails across requests to stay under it
+    "intent_batch": 8000
+}
+
+TRUNCATION_MARK = " [...]"
+
+# Builds a stage's request from the (possibly shortened) text and items
+RequestBuilder = Callable[[str, List[Dict]], Dict]
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """Cut a text to at most max_chars at a word boundary, marking the cut"""
+    if len(text) <= max_chars:
+        return text
+    limit = max(max_chars - len(TRUNCATION_MARK), 0)
+    cut = text.rfind(' ', 0, limit + 1)
+    cut = cut if cut > limit // 2 else limit
+    return text[:cut].rstrip() + TRUNCATION_MARK
+
+
+class PromptBudget:
+    """
+    Shared prompt builder with a token budget per stage
+
+    fit() builds a stage's request and, while its local token estimate is
+    over the stage budget:
+    1. drops items (snippets, ranking candidates) with the lowest
+       relevance_score, down to min_items
+    2. truncates the customer text to what is left
+    Knowledge-base answers longer than max_answer_tokens are always cut.
+
+    observe() is registered with the RequestScheduler and records, for every
+    response, the real prompt size the API reports next to the estimate and
+    the budget. The stage is recognised by the request's forced tool name,
+    which fit() learns from the requests it builds.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, max_answer_tokens: int = 300,
+                 recent_calls: int = 1000):
+        """
+        Args:
+            budgets: Input-token budget per stage, merged over DEFAULT_BUDGETS (a stage
+                     set to None is unlimited)
+            max_answer_tokens: Longest FAQ answer included in a prompt
+            recent_calls: Per-call records kept for inspection
+        """
+        self.budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+        self.max_answer_tokens = max_answer_tokens
+        self.stage_by_tool: Dict[str, str] = {}
+        self.recent = deque(maxlen=recent_calls)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict] = {}
+
+    def _stage_stats(self, stage: str) -> Dict:
+        if stage not in self.stats:
+            self.stats[stage] = {
+                "fitted": 0, "estimated_tokens": 0, "items_dropped": 0, "answers_truncated": 0,
+                "texts_truncated": 0, "over_budget_estimated": 0,
+                "calls": 0, "actual_tokens": 0, "max_actual_tokens": 0, "over_budget_actual": 0
+            }
+        return self.stats[stage]
+
+    def _cap_answer(self, item: Dict) -> Dict:
+        answer = item.get('answer')
+        max_chars = self.max_answer_tokens * CHARS_PER_TOKEN
+        if not isinstance(answer, str) or len(answer) <= max_chars:
+            return item
+        return {**item, "answer": truncate_text(answer, max_chars)}
+
+    @staticmethod
+    def _least_relevant(items: List[Dict]) -> int:
+        """Index of the lowest relevance_score (the later one on ties, i.e. the lower-ranked)"""
+        scores = [item.get('relevance_score', 0.0) for item in items]
+        lowest = min(scores)
+        return len(scores) - 1 - scores[::-1].index(lowest)
+
+    def fit(self, stage: str, build: RequestBuilder, text: str, items: Sequence[Dict] = (),
+            min_items: int = 0) -> Dict:
+        """
+        Build a request that fits the stage budget
+
+        Args:
+            stage: "intent", "rag", "draft" or "quality"
+            build: Function (text, items) -> messages.create parameters
+            text: Customer text to include
+            items: Snippets or candidates, each optionally with a relevance_score
+            min_items: Items that are never dropped (e.g. the top_k the ranking must return)
+
+        Returns:
+            The request parameters (the items passed to build are copies when answers were cut)
+        """
+        budget = self.budgets.get(stage)
+        capped = [self._cap_answer(item) for item in items]
+        answers_truncated = sum(1 for original, item in zip(items, capped) if item is not original)
+        items = capped
+
+        request = build(text, items)
+        estimated = estimate_request_tokens(request)
+        dropped = 0
+        text_truncated = False
+        if budget is not None:
+            while estimated > budget and len(items) > min_items:
+                index = self._least_relevant(items)
+                items = items[:index] + items[index + 1:]
+                dropped += 1
+                request = build(text, items)
+                estimated = estimate_request_tokens(request)
+            # JSON escaping makes the estimate slightly non-linear in the text length
+            for _ in range(3):
+                if estimated <= budget or not text:
+                    break
+                keep = len(text) - (estimated - budget) * CHARS_PER_TOKEN
+                text = truncate_text(text, max(keep, 0))
+                text_truncated = True
+                request = build(text, items)
+                estimated = estimate_request_tokens(request)
+
+        tool = request.get('tool_choice', {}).get('name')
+        with self._lock:
+            if tool:
+                self.stage_by_tool[tool] = stage
+            stats = self._stage_stats(stage)
+            stats['fitted'] += 1
+            stats['estimated_tokens'] += estimated
+            stats['items_dropped'] += dropped
+            stats['answers_truncated'] += answers_truncated
+            stats['texts_truncated'] += int(text_truncated)
+            stats['over_budget_estimated'] += int(budget is not None and estimated > budget)
+        return request
+
+    def split(self, stage: str, build: RequestBuilder, items: Sequence[Dict], max_items: int) -> List[List[Dict]]:
+        """
+        Split items into consecutive groups whose requests each fit the stage budget
+
+        A group is closed when it reaches max_items or when adding the next
+        item would put the request over budget; an item too large on its own
+        still gets a group of its own. Build each group's request with fit().
+
+        Args:
+            stage: Budget to pack against, e.g. "intent_batch"
+            build: Function (text, items) -> messages.create parameters
+            items: Items to pack, in order
+            max_items: Most items per group
+        """
+        budget = self.budgets.get(stage)
+        groups: List[List[Dict]] = []
+        group: List[Dict] = []
+        for item in items:
+            if group and (len(group) >= max_items or (
+                    budget is not None and estimate_request_tokens(build("", group + [item])) > budget)):
+                groups.append(group)
+                group = []
+            group.append(item)
+        if group:
+            groups.append(group)
+        return groups
+
+    def observe(self, params: Dict, estimated_tokens: int, message):
+        """RequestScheduler observer: record the prompt size the API reported for a response"""
+        usage = getattr(message, 'usage', None)
+        if usage is None:
+            return
+        actual = sum((getattr(usage, key, 0) or 0) for key in
+                     ('input_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens'))
+        tool = (params.get('tool_choice') or {}).get('name')
+        with self._lock:
+            stage = self.stage_by_tool.get(tool)
+            if stage is None:
+                return
+            budget = self.budgets.get(stage)
+            stats = self._stage_stats(stage)
+            stats['calls'] += 1
+            stats['actual_tokens'] += actual
+            stats['max_actual_tokens'] = max(stats['max_actual_tokens'], actual)
+            stats['over_budget_actual'] += int(budget is not None and actual > budget)
+            self.recent.append({
+                "stage": stage,
+                "model": params.get('model'),
+                "budget": budget,
+                "estimated_tokens": estimated_tokens,
+                "actual_tokens": actual
+            })
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """
+        Per stage: budget, average estimated and actual prompt tokens, how
+        often trimming kicked in and how many calls still exceeded the budget
+        """
+        with self._lock:
+            snapshot = {stage: dict(stats) for stage, stats in self.stats.items()}
+        for stage, stats in snapshot.items():
+            budget = self.budgets.get(stage)
+            stats['budget'] = budget
+            stats['avg_estimated_tokens'] = stats['estimated_tokens'] / stats['fitted'] if stats['fitted'] else 0.0
+            stats['avg_actual_tokens'] = stats['actual_tokens'] / stats['calls'] if stats['calls'] else 0.0
+            stats['budget_utilization'] = stats['avg_actual_tokens'] / budget if budget and stats['calls'] else 0.0
+        return snapshot
+
+
+_default_budget: Optional[PromptBudget] = None
+
+
+def get_default_budget() -> PromptBudget:
+    """Process-wide budget used by every module unless one is passed in"""
+    global _default_budget
+    if _default_budget is None:
+        _default_budget = PromptBudget()
+    return _default_budget
+
+
+def main():
+    """Fit the test emails' draft prompts into shrinking budgets (no API calls; pass budgets to try)"""
+    from draft_generator import DraftGenerator
+    from rag_system import RAGSystem
+
+    budgets = [int(arg) for arg in sys.argv[1:]] or [2500, 1200, 900, 700]
+    with open('../data/test_emails.json', 'r') as f:
+        emails = json.load(f)['test_emails']
+    rag = RAGSystem(use_llm=False)
+    generator = DraftGenerator(templates_file=None)
+    jobs = [(email['body'], rag.search_relevant_faqs(email['body'], top_k=5)) for email in emails]
+
+    print("="*70)
+    print(f"PROMPT BUDGETS ({len(emails)} draft prompts with 5 snippets each)")
+    print("="*70)
+
+    print(f"\n{'budget':>8} {'avg tokens':>11} {'max':>6} {'snippets dropped':>17} {'texts cut':>10} {'over':>5}")
+    for tokens in budgets:
+        generator.budget = PromptBudget({"draft": tokens})
+        sizes = [estimate_request_tokens(generator._draft_request(body, snippets)) for body, snippets in jobs]
+        stats = generator.budget.get_stats()['draft']
+        print(f"{tokens:>8} {stats['avg_estimated_tokens']:>11.0f} {max(sizes):>6} {stats['items_dropped']:>17} "
+              f"{stats['texts_truncated']:>10} {stats['over_budget_estimated']:>5}")
+    print("\n📐 Snippets go first (lowest relevance first, one always kept), then the customer text is cut")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,30 +5,24 @@ Implements your advanced quality control prompt
 
 import anthropic
 import os
-import json
 from dotenv import load_dotenv
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+from grounding_verifier import GroundingVerifier
+from model_cascade import ModelCascade
+from pre_quality_check import RuleBasedPreChecker
+from result_cache import ResultCache
+from prompt_budget import PromptBudget, get_default_budget
+from request_scheduler import RequestScheduler, cacheable_system, get_default_scheduler
+from structured_output import StructuredOutput
 
 load_dotenv()
 
+# Bump whenever the quality-control prompt changes so cached results are not reused
+PROMPT_VERSION = "3"
 
-class QualityChecker:
-    def __init__(self):
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        self.threshold = 0.85  # Minimum score for auto-send
-    
-    def check_quality(self, customer_message: str, draft_reply: str, 
-                     knowledge_snippets: List[Dict]) -> Dict:
-        """
-        Evaluate draft quality using AI
-        
-        Returns quality score, safety check, and review recommendation
-        """
-        
-        snippets_text = self._format_snippets(knowledge_snippets)
-        
-        prompt = f"""SYSTEM:
-You are an AI quality-control assistant that evaluates email replies written by another AI.
+# Rubric and output contract: the static, cacheable part of the prompt
+QUALITY_SYSTEM_PROMPT = """You are an AI quality-control assistant that evaluates email replies written by another AI.
 
 Your job:
 1) Check accuracy against the provided knowledge snippets
@@ -36,7 +30,7 @@ Your job:
 3) Check if the reply avoids hallucinations and unsafe statements
 4) Check if the draft itself requests human escalation
 
-You MUST respond in valid JSON only, no extra text.
+Record your evaluation with the record_quality_check tool.
 
 EVALUATION CRITERIA:
 - Accuracy (40%): Does the reply stay consistent with the knowledge snippets?
@@ -44,21 +38,6 @@ EVALUATION CRITERIA:
 - Voice and tone (20%): Does it sound warm, reassuring, and confident?
 - Policy adherence (15%): Any contradictions with policy? Any promises we can't guarantee?
 
-JSON FORMAT (respond with ONLY raw JSON, NO markdown, NO code fences):
-{{{{
-  "quality_score": 0.92,
-  "is_safe": true,
-  "needs_human_review": false,
-  "issues": ["list of problems found, empty if none"],
-  "suggested_edits": "revised version if needed, empty string if not needed",
-  "breakdown": {{{{
-    "accuracy": 0.95,
-    "completeness": 0.90,
-    "voice_tone": 0.92,
-    "policy_adherence": 0.90
-  }}}}
-}}}}
-
 CRITICAL RULES:
 - If the reply contradicts or goes beyond the snippets → "is_safe": false and "needs_human_review": true
 - If important parts of the question are not answered → "needs_human_review": true
@@ -76,12 +55,191 @@ CRITICAL RULES:
 - Voice should be: Warm, reassuring, expert, simple language. No overpromising.
 
 IMPORTANT: Even if the email is well-written (high quality score), if it mentions needing human follow-up, 
-you MUST set "needs_human_review": true because the email itself is requesting escalation.
+you MUST set "needs_human_review": true because the email itself is requesting escalation."""
 
----
+SCORE = {"type": "number", "minimum": 0, "maximum": 1}
+
+QUALITY_TOOL = {
+    "name": "record_quality_check",
+    "description": "Record the evaluation of the draft reply",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "quality_score": SCORE,
+            "is_safe": {"type": "boolean"},
+            "needs_human_review": {"type": "boolean"},
+            "issues": {"type": "array", "items": {"type": "string"}, "description": "Problems found, empty if none"},
+            "suggested_edits": {"type": "string", "description": "Revised version if needed, empty string if not"},
+            "breakdown": {
+                "type": "object",
+                "properties": {
+                    "accuracy": SCORE,
+                    "completeness": SCORE,
+                    "voice_tone": SCORE,
+                    "policy_adherence": SCORE
+                }
+            }
+        },
+        "required": ["quality_score", "is_safe", "needs_human_review", "issues"]
+    }
+}
 
-CUSTOMER_MESSAGE:
-{customer_message}
+
+class QualityChecker:
+    def __init__(self, cache: Optional[ResultCache] = None, scheduler: Optional[RequestScheduler] = None,
+                 cascade: Optional[ModelCascade] = None, pre_checker: Optional[RuleBasedPreChecker] = None,
+                 pre_check: bool = True, grounding_verifier: Optional[GroundingVerifier] = None,
+                 verify_grounding: bool = True, budget: Optional[PromptBudget] = None):
+        """
+        Args:
+            cache: Optional shared ResultCache for quality-check results
+            scheduler: RequestScheduler for API calls (defaults to the shared one)
+            cascade: Models to try in order, escalating when "quality_score" is below its
+                     threshold (defaults to Sonnet only)
+            pre_checker: Local rules that settle clear-cut drafts without an API call
+            pre_check: Set False to send every draft to Claude
+            grounding_verifier: Local sentence × snippet scorer; drafts with details found in
+                                no snippet are escalated without an API call
+            verify_grounding: Set False to skip the grounding verifier
+            budget: PromptBudget for quality-check prompts (defaults to the shared one)
+        """
+        # Retries are handled by the scheduler
+        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.async_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.model = "claude-sonnet-4-20250514"
+        self.cache = cache
+        self.scheduler = scheduler or get_default_scheduler()
+        self.cascade = cascade or ModelCascade([self.model])
+        self.budget = budget or get_default_budget()
+        self.scheduler.add_observer(self.budget.observe)
+        self.output = StructuredOutput(QUALITY_TOOL)
+        self.pre_checker = (pre_checker or RuleBasedPreChecker()) if pre_check else None
+        self.grounding_verifier = (grounding_verifier or GroundingVerifier()) if verify_grounding else None
+        self.threshold = 0.85  # Minimum score for auto-send
+    
+    def check_quality(self, customer_message: str, draft_reply: str, 
+                     knowledge_snippets: List[Dict], grounding: Optional[Dict] = None,
+                     full_message: Optional[str] = None) -> Dict:
+        """
+        Evaluate draft quality using AI
+        
+        Args:
+            grounding: Result of GroundingVerifier.verify_batch for this draft, if already
+                       computed for a batch (otherwise it is computed here)
+            full_message: Unreduced customer text (subject and body) whose details the
+                          grounding verifier counts as known (defaults to customer_message)
+        
+        Returns quality score, safety check, and review recommendation
+        """
+        local, grounding = self._pre_check(full_message or customer_message, draft_reply, knowledge_snippets,
+                                           grounding)
+        if local is not None:
+            return local
+        
+        cache_key, cached = self._cache_lookup(customer_message, draft_reply, knowledge_snippets)
+        if cached is not None:
+            return cached
+        
+        try:
+            return self.output.call(
+                lambda: self.cascade.call(
+                    self.scheduler, self.client.messages.create,
+                    self._quality_request(customer_message, draft_reply, knowledge_snippets),
+                    score=lambda payload: payload['quality_score'], output=self.output
+                ),
+                lambda message: self._parse_quality(message, cache_key, grounding)
+            )
+        except Exception as e:
+            return self._quality_error(e)
+    
+    async def check_quality_async(self, customer_message: str, draft_reply: str,
+                                  knowledge_snippets: List[Dict], grounding: Optional[Dict] = None,
+                                  full_message: Optional[str] = None) -> Dict:
+        """Same as check_quality, using the AsyncAnthropic client"""
+        local, grounding = self._pre_check(full_message or customer_message, draft_reply, knowledge_snippets,
+                                           grounding)
+        if local is not None:
+            return local
+        
+        cache_key, cached = self._cache_lookup(customer_message, draft_reply, knowledge_snippets)
+        if cached is not None:
+            return cached
+        
+        try:
+            return await self.output.call_async(
+                lambda: self.cascade.call_async(
+                    self.scheduler, self.async_client.messages.create,
+                    self._quality_request(customer_message, draft_reply, knowledge_snippets),
+                    score=lambda payload: payload['quality_score'], output=self.output
+                ),
+                lambda message: self._parse_quality(message, cache_key, grounding)
+            )
+        except Exception as e:
+            return self._quality_error(e)
+    
+    def _pre_check(self, customer_message: str, draft_reply: str, knowledge_snippets: List[Dict],
+                   grounding: Optional[Dict] = None):
+        """
+        Run the local checks
+        
+        Returns:
+            (local_result, grounding): local_result is None when the draft needs Claude;
+            grounding is None when the verifier is off
+        """
+        if grounding is None and self.grounding_verifier is not None:
+            grounding = self.grounding_verifier.verify(draft_reply, knowledge_snippets, customer_message)
+        hallucinated = grounding is not None and grounding['verdict'] == "hallucinated"
+        
+        if self.pre_checker is not None:
+            check = self.pre_checker.check(draft_reply, knowledge_snippets, grounding)
+        elif hallucinated:
+            check = {"outcome": "escalate", "issues": list(grounding['issues']), "placeholders": []}
+        else:
+            return None, grounding
+        
+        if check['outcome'] == "ambiguous":
+            return None, grounding
+        
+        if check['outcome'] == "pass":
+            result = {
+                "quality_score": self.pre_checker.pass_score,
+                "is_safe": True,
+                "needs_human_review": False,
+                "issues": []
+            }
+        else:
+            result = {
+                "quality_score": 0.0,
+                # Unfilled template slots and invented details must never be sent
+                "is_safe": not check['placeholders'] and not hallucinated,
+                "needs_human_review": True,
+                "issues": check['issues']
+            }
+        result['grounding'] = grounding
+        result['action'] = self._determine_action(result)
+        result['pre_check'] = check['outcome']
+        return result, grounding
+    
+    def _cache_lookup(self, customer_message: str, draft_reply: str, knowledge_snippets: List[Dict]):
+        """Return (cache_key, cached_result); both are None when caching is off"""
+        if self.cache is None:
+            return None, None
+        cache_key = ResultCache.make_key(
+            "quality", [customer_message, draft_reply, self._format_snippets(knowledge_snippets), self.threshold],
+            self.cascade.cache_id, PROMPT_VERSION
+        )
+        return cache_key, self.cache.get(cache_key)
+    
+    def _quality_request(self, customer_message: str, draft_reply: str,
+                         knowledge_snippets: List[Dict]) -> Dict:
+        """Build the messages.create parameters for one quality check, within the quality token budget"""
+        
+        # The draft under review is never shortened; only the customer message and snippets are
+        def build(text: str, snippets: List[Dict]) -> Dict:
+            snippets_text = self._format_snippets(snippets)
+            
+            prompt = f"""CUSTOMER_MESSAGE:
+{text}
 
 DRAFT_REPLY:
 {draft_reply}
@@ -89,52 +247,51 @@ DRAFT_REPLY:
 KNOWLEDGE_SNIPPETS:
 {snippets_text}
 
-Now evaluate and return JSON:"""
+Now evaluate the draft:"""
 
-        try:
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1000,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            response_text = message.content[0].text.strip()
-            
-            # Remove markdown code fences if present
-            if response_text.startswith('```'):
-                lines = response_text.split('\n')
-                if lines[0].startswith('```'):
-                    lines = lines[1:]
-                if lines and lines[-1].strip() == '```':
-                    lines = lines[:-1]
-                response_text = '\n'.join(lines).strip()
-            
-            result = json.loads(response_text)
-            
-            # Add routing decision
-            result['action'] = self._determine_action(result)
-            
-            return result
-            
-        except Exception as e:
-            print(f"Error in quality check: {e}")
             return {
-                "quality_score": 0.0,
-                "is_safe": False,
-                "needs_human_review": True,
-                "issues": [f"Quality check failed: {str(e)}"],
-                "action": "ESCALATE_TO_HUMAN"
+                "model": self.model,
+                "max_tokens": 1000,
+                "system": cacheable_system(QUALITY_SYSTEM_PROMPT),
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ],
+                **self.output.request_params()
             }
+        
+        return self.budget.fit("quality", build, customer_message, knowledge_snippets, min_items=1)
+    
+    def _parse_quality(self, message, cache_key: Optional[str], grounding: Optional[Dict] = None) -> Dict:
+        """Turn a Claude response into the quality result dict (raises StructuredOutputError)"""
+        result = dict(self.output.parse(message))
+        result['grounding'] = grounding
+        
+        # Add routing decision
+        result['action'] = self._determine_action(result)
+        
+        if cache_key is not None:
+            self.cache.set(cache_key, result)
+        return result
+    
+    def _quality_error(self, error: Exception) -> Dict:
+        print(f"Error in quality check: {error}")
+        return {
+            "quality_score": 0.0,
+            "is_safe": False,
+            "needs_human_review": True,
+            "issues": [f"Quality check failed: {str(error)}"],
+            "action": "ESCALATE_TO_HUMAN"
+        }
     
     def _determine_action(self, quality_result: Dict) -> str:
         """Determine routing action based on quality score"""
         score = quality_result.get('quality_score', 0)
         is_safe = quality_result.get('is_safe', False)
         needs_human = quality_result.get('needs_human_review', True)
+        # Details found in no snippet are a safety problem whatever the score says
+        hallucinated = (quality_result.get('grounding') or {}).get('verdict') == "hallucinated"
         
-        if not is_safe or needs_human:
+        if not is_safe or needs_human or hallucinated:
             return "ESCALATE_TO_HUMAN"
         elif score >= self.threshold:
             return "AUTO_SEND"
@@ -196,6 +353,10 @@ Norman"""
         for metric, score in result['breakdown'].items():
             print(f"  {metric}: {score:.2f}")
     
+    if result.get('grounding'):
+        grounding = result['grounding']
+        print(f"\n🔎 Grounding: {grounding['verdict']} ({grounding['grounding_score']:.2f} of sentences supported)")
+    
     if result.get('issues'):
         print(f"\n⚠️  Issues Found:")
         for issue in result['issues']:
@@ -1,133 +1,356 @@
 """
 RAG System - Retrieval Augmented Generation
-Searches knowledge base and retrieves relevant information using AI ranking
+Searches knowledge base with a local hybrid index and optional AI reranking
 """
 
 import json
+import hashlib
 import anthropic
 import os
+import sys
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from faq_index import BM25Index, EmbeddingFunction, HashedNgramEmbedder, VectorIndex, top_k_indices
+from model_cascade import SMALL_MODEL, ModelCascade
+from result_cache import ResultCache
+from prompt_budget import PromptBudget, get_default_budget
+from request_scheduler import RequestScheduler, cacheable_system, get_default_scheduler
+from structured_output import StructuredOutput
 
 load_dotenv()
 
+# Bump whenever the ranking prompt changes so cached results are not reused
+PROMPT_VERSION = "3"
+
+# Static part of the ranking prompt (cached by the API)
+RANKING_SYSTEM_PROMPT = """You are a relevance ranking system for a customer support knowledge base.
+
+Your task: Rank which FAQs are most relevant to answer the customer's question.
+
+INSTRUCTIONS:
+1. Analyze the customer's question and identify what they're asking about
+2. Compare each FAQ to see which ones would help answer their question
+3. Rank the requested number of most relevant FAQs
+
+Consider:
+- Exact topic match (e.g., if they ask about shipping, prioritize shipping FAQs)
+- Semantic similarity (similar concepts even if different words)
+- Completeness (does the FAQ fully answer their question?)
+- Specificity (specific FAQs are better than generic ones)
+
+Record the ranking, most relevant first, with the record_ranking tool."""
+
+RANKING_TOOL = {
+    "name": "record_ranking",
+    "description": "Record the most relevant FAQs, most relevant first",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "ranked_faqs": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer", "description": "FAQ ID from the list"},
+                        "relevance_score": {"type": "number", "minimum": 0, "maximum": 1},
+                        "reason": {"type": "string", "description": "Why this FAQ helps, e.g. 'Directly answers the question'"}
+                    },
+                    "required": ["id", "relevance_score", "reason"]
+                }
+            }
+        },
+        "required": ["ranked_faqs"]
+    }
+}
+
+
+class FAQRecord:
+    """
+    One knowledge-base entry, stored as slots instead of a per-FAQ dict
+    
+    The ranking prompt line is rendered once at load time. Search results are
+    built from records as fresh dicts (see scored), so callers can annotate
+    them without touching the knowledge base.
+    """
+    __slots__ = ("id", "category", "question", "answer", "prompt_line")
+    
+    def __init__(self, id: int, category: str, question: str, answer: str):
+        self.id = id
+        self.category = category
+        self.question = question
+        self.answer = answer
+        self.prompt_line = f"[ID: {id}] Q: {question}"
+    
+    @classmethod
+    def from_dict(cls, faq: Dict) -> 'FAQRecord':
+        return cls(faq['id'], faq['category'], faq['question'], faq['answer'])
+    
+    def to_dict(self) -> Dict:
+        return {"id": self.id, "category": self.category, "question": self.question, "answer": self.answer}
+    
+    def scored(self, relevance_score: float, reason: str, source: str) -> Dict:
+        """The FAQ as a search result with its relevance metadata"""
+        return {"id": self.id, "category": self.category, "question": self.question, "answer": self.answer,
+                "relevance_score": relevance_score, "relevance_reason": reason, "relevance_source": source}
+
 
 class RAGSystem:
-    def __init__(self, faq_file='../data/faqs.json'):
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, faq_file='../data/faqs.json', use_llm: bool = True, shortlist_size: int = 15,
+                 embed_fn: Optional[EmbeddingFunction] = None, vector_weight: float = 0.5,
+                 cache: Optional[ResultCache] = None, scheduler: Optional[RequestScheduler] = None,
+                 cascade: Optional[ModelCascade] = None, budget: Optional[PromptBudget] = None):
+        """
+        Args:
+            faq_file: Path to the FAQ knowledge base
+            use_llm: If False, rank with the local hybrid index only and never call Claude
+            shortlist_size: Number of local candidates passed on to the Claude reranker
+            embed_fn: Embedding function for the vector index (defaults to hashed character n-grams)
+            vector_weight: Weight of the vector score in the hybrid score (0 = BM25 only, 1 = vectors only)
+            cache: Optional shared ResultCache for Claude rankings
+            scheduler: RequestScheduler for API calls (defaults to the shared one)
+            cascade: Models to try for the rerank (defaults to Haiku, escalating to Sonnet
+                     when the top relevance score is below 0.7)
+            budget: PromptBudget for the rerank prompt (defaults to the shared one)
+        """
+        self.use_llm = use_llm
+        self.shortlist_size = shortlist_size
+        self.vector_weight = vector_weight
+        self.embed_fn = embed_fn or HashedNgramEmbedder()
+        self.client = None
+        self.async_client = None
+        if use_llm:
+            # Retries are handled by the scheduler
+            self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+            self.async_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        self.model = "claude-sonnet-4-20250514"
+        self.cache = cache
+        self.scheduler = scheduler or get_default_scheduler()
+        self.cascade = cascade or ModelCascade([SMALL_MODEL, self.model], threshold=0.7)
+        self.budget = budget or get_default_budget()
+        self.scheduler.add_observer(self.budget.observe)
+        self.output = StructuredOutput(RANKING_TOOL)
         
         # Load FAQ database
-        with open(faq_file, 'r') as f:
-            data = json.load(f)
-            self.faqs = data['faqs']
+        with open(faq_file, 'rb') as f:
+            raw = f.read()
+        self.faqs: Tuple[FAQRecord, ...] = tuple(FAQRecord.from_dict(faq) for faq in json.loads(raw)['faqs'])
+        # Position of each FAQ id, so ranked ids resolve without scanning
+        self.faq_index: Dict[int, int] = {faq.id: i for i, faq in enumerate(self.faqs)}
+        # Cached rankings are only valid for the knowledge base they were made from
+        self.kb_version = hashlib.sha256(raw).hexdigest()[:16]
+        
+        # Build the lexical and vector indexes used as the first retrieval stage
+        documents = [f"{faq.question} {faq.question} {faq.answer}" for faq in self.faqs]
+        self.index = BM25Index(documents)
+        if hasattr(self.embed_fn, 'fit'):
+            self.embed_fn.fit(documents)
+        self.vector_index = VectorIndex(self.embed_fn(documents))
+        
+        # Per-category views, built once instead of filtering the knowledge base on every search
+        self.category_indexes: Dict[str, np.ndarray] = {}
+        self.category_faqs: Dict[str, Tuple[FAQRecord, ...]] = {}
+        categories = np.array([faq.category for faq in self.faqs])
+        for category in set(categories.tolist()):
+            self.category_indexes[category] = np.flatnonzero(categories == category)
+            self.category_faqs[category] = tuple(self.faqs[i] for i in self.category_indexes[category])
+        self.no_indexes = np.empty(0, dtype=np.intp)
         
         print(f"✅ Loaded {len(self.faqs)} FAQs from knowledge base")
     
-    def search_relevant_faqs(self, customer_question: str, category: str = None, top_k: int = 3) -> List[Dict]:
+    def _hybrid_scores(self, customer_question: str) -> np.ndarray:
+        """
+        Fuse BM25 and vector similarity into one score per FAQ
+        
+        BM25 scores are scaled by the best match so both signals lie in [0, 1].
+        """
+        lexical = np.zeros(len(self.faqs), dtype=np.float32)
+        for doc_index, score in self.index.score(customer_question).items():
+            lexical[doc_index] = score
+        if lexical.max() > 0:
+            lexical /= lexical.max()
+        
+        vector = np.clip(self.vector_index.similarities(self.embed_fn([customer_question])[0]), 0.0, None)
+        return (1 - self.vector_weight) * lexical + self.vector_weight * vector
+    
+    def prefetch_scores(self, customer_question: str) -> np.ndarray:
+        """
+        Score every FAQ for a question before its category is known
+        
+        The hybrid scores don't depend on the category filter, so this can run
+        while intent detection is still in flight. Pass the result to
+        search_relevant_faqs(prefetched_scores=...) to skip the local search there.
+        """
+        return self._hybrid_scores(customer_question)
+    
+    def _shortlist(self, customer_question: str, candidate_mask: Optional[np.ndarray], size: int,
+                   scores: Optional[np.ndarray] = None) -> List[Dict]:
+        """Return the best `size` candidates by hybrid score as scored FAQ copies"""
+        if scores is None:
+            scores = self._hybrid_scores(customer_question)
+        top = top_k_indices(scores, size, candidate_mask)
+        best_score = float(scores[top[0]]) if len(top) else 0.0
+        
+        # Relevance is relative to the best candidate, not an absolute match quality
+        return [
+            self.faqs[doc_index].scored(
+                round(float(scores[doc_index]) / best_score, 3) if best_score > 0 else 0.0,
+                "Hybrid keyword + vector match", "local"
+            )
+            for doc_index in top
+        ]
+    
+    def search_relevant_faqs(self, customer_question: str, category: str = None, top_k: int = 3,
+                             prefetched_scores: Optional[np.ndarray] = None) -> List[Dict]:
         """
         Find the most relevant FAQs for a customer question
-        Uses Claude to rank relevance
+        Shortlists candidates with the local hybrid index, then optionally uses Claude to rerank them
         
         Args:
             customer_question: The customer's question
             category: Optional category filter (e.g., "ORDER_TRACKING")
             top_k: Number of FAQs to return
+            prefetched_scores: Output of prefetch_scores for this question; the category
+                               shortlist is then cut from it instead of searching again
             
         Returns:
             List of most relevant FAQs with relevance scores
         """
+        results, search = self._prepare_search(customer_question, category, top_k, prefetched_scores)
+        if results is not None:
+            return results
+        
+        try:
+            return self.output.call(
+                lambda: self.cascade.call(self.scheduler, self.client.messages.create, search['request'],
+                                          score=self._ranking_score, output=self.output),
+                lambda message: self._parse_ranking(message, search)
+            )
+        except Exception as e:
+            return self._ranking_fallback(e, search)
+    
+    async def search_relevant_faqs_async(self, customer_question: str, category: str = None, top_k: int = 3,
+                                         prefetched_scores: Optional[np.ndarray] = None) -> List[Dict]:
+        """Same as search_relevant_faqs, using the AsyncAnthropic client for the rerank"""
+        results, search = self._prepare_search(customer_question, category, top_k, prefetched_scores)
+        if results is not None:
+            return results
+        
+        try:
+            return await self.output.call_async(
+                lambda: self.cascade.call_async(self.scheduler, self.async_client.messages.create,
+                                                search['request'], score=self._ranking_score, output=self.output),
+                lambda message: self._parse_ranking(message, search)
+            )
+        except Exception as e:
+            return self._ranking_fallback(e, search)
+    
+    @staticmethod
+    def _ranking_score(result: Dict) -> float:
+        """Cascade score of a ranking: relevance of the best FAQ"""
+        return result['ranked_faqs'][0]['relevance_score']
+    
+    def _prepare_search(self, customer_question: str, category: Optional[str], top_k: int,
+                        scores: Optional[np.ndarray] = None):
+        """
+        Run the local stages of a search
+        
+        Returns:
+            (results, None) when no Claude call is needed, otherwise
+            (None, search) where search holds the rerank request and its context
+        """
         
         # Filter by category if provided
         if category and category not in ["OTHER", "MULTIPLE"]:
-            candidate_faqs = [faq for faq in self.faqs if faq['category'] == category]
+            candidate_mask = self.category_indexes.get(category, self.no_indexes)
+            candidate_faqs = self.category_faqs.get(category, ())
         else:
+            candidate_mask = None
             candidate_faqs = self.faqs
         
         # If we have very few FAQs, return them all
         if len(candidate_faqs) <= top_k:
-            return candidate_faqs
+            return [faq.to_dict() for faq in candidate_faqs], None
         
-        # Build the ranking prompt
-        faq_list = "\n".join([
-            f"{i+1}. [ID: {faq['id']}] Q: {faq['question']}"
-            for i, faq in enumerate(candidate_faqs)
-        ])
+        # Pure-local mode: the hybrid ranking is the final answer
+        if not self.use_llm:
+            return self._shortlist(customer_question, candidate_mask, top_k, scores), None
         
-        prompt = f"""You are a relevance ranking system for a customer support knowledge base.
-
-Your task: Rank which FAQs are most relevant to answer the customer's question.
-
-CUSTOMER QUESTION:
-{customer_question}
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResultCache.make_key(
+                "rag",
+                [customer_question, category if candidate_mask is not None else None, top_k,
+                 self.shortlist_size, self.vector_weight, type(self.embed_fn).__name__, self.kb_version],
+                self.cascade.cache_id, PROMPT_VERSION
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached, None
+        
+        # Only the local shortlist goes into the Claude rerank prompt
+        candidate_faqs = self._shortlist(customer_question, candidate_mask, max(self.shortlist_size, top_k), scores)
+        
+        # Build the ranking prompt
+        def build(question: str, candidates: List[Dict]) -> Dict:
+            faq_list = "\n".join([
+                f"{i+1}. {self.faqs[self.faq_index[faq['id']]].prompt_line}"
+                for i, faq in enumerate(candidates)
+            ])
+            
+            prompt = f"""CUSTOMER QUESTION:
+{question}
 
 AVAILABLE FAQs:
 {faq_list}
 
-INSTRUCTIONS:
-1. Analyze the customer's question and identify what they're asking about
-2. Compare each FAQ to see which ones would help answer their question
-3. Rank the top {top_k} most relevant FAQs
-
-Consider:
-- Exact topic match (e.g., if they ask about shipping, prioritize shipping FAQs)
-- Semantic similarity (similar concepts even if different words)
-- Completeness (does the FAQ fully answer their question?)
-- Specificity (specific FAQs are better than generic ones)
-
-Return ONLY a JSON array (NO markdown, NO code fences) with the top {top_k} FAQ IDs ranked by relevance:
-{{{{
-  "ranked_faqs": [
-    {{{{"id": 1, "relevance_score": 0.95, "reason": "Directly answers the question"}}}}
-    {{{{"id": 3, "relevance_score": 0.80, "reason": "Provides related information"}}}},
-    {{{{"id": 7, "relevance_score": 0.60, "reason": "Tangentially relevant"}}}}
-  ]
-}}}}
-
-Now rank the FAQs:"""
+Rank the top {top_k} most relevant FAQs:"""
 
-        try:
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1000,
-                messages=[
+            return {
+                "model": self.model,
+                "max_tokens": 1000,
+                "system": cacheable_system(RANKING_SYSTEM_PROMPT),
+                "messages": [
                     {"role": "user", "content": prompt}
-                ]
-            )
-            
-            response_text = message.content[0].text.strip()
-            
-            # Remove markdown code fences if present
-            if response_text.startswith('```'):
-                lines = response_text.split('\n')
-                if lines[0].startswith('```'):
-                    lines = lines[1:]
-                if lines and lines[-1].strip() == '```':
-                    lines = lines[:-1]
-                response_text = '\n'.join(lines).strip()
-            
-            # Parse JSON response
-            result = json.loads(response_text)
-            ranked_ids = result.get('ranked_faqs', [])
-            
-            # Retrieve the full FAQ objects
-            relevant_faqs = []
-            for ranked in ranked_ids[:top_k]:
-                faq_id = ranked['id']
-                faq = next((f for f in candidate_faqs if f['id'] == faq_id), None)
-                if faq:
-                    # Add relevance metadata
-                    faq_with_score = faq.copy()
-                    faq_with_score['relevance_score'] = ranked.get('relevance_score', 0.5)
-                    faq_with_score['relevance_reason'] = ranked.get('reason', '')
-                    relevant_faqs.append(faq_with_score)
-            
-            return relevant_faqs
-            
-        except Exception as e:
-            print(f"Error in RAG search: {e}")
-            print(f"Falling back to simple category-based retrieval")
-            # Fallback: return first N FAQs from category
-            return candidate_faqs[:top_k]
+                ],
+                **self.output.request_params()
+            }
+        
+        # Over budget, the weakest local candidates are left out (never below top_k)
+        request = self.budget.fit("rag", build, customer_question, candidate_faqs, min_items=top_k)
+        return None, {
+            "request": request,
+            "candidate_faqs": candidate_faqs,
+            "candidate_ids": {faq['id'] for faq in candidate_faqs},
+            "top_k": top_k,
+            "cache_key": cache_key
+        }
+    
+    def _parse_ranking(self, message, search: Dict) -> List[Dict]:
+        """Map Claude's ranked ids back onto the shortlisted FAQs (raises StructuredOutputError)"""
+        candidate_ids = search['candidate_ids']
+        ranked_ids = self.output.parse(message)['ranked_faqs']
+        
+        # Retrieve the full FAQ records, ignoring ids that weren't in the shortlist
+        relevant_faqs = []
+        for ranked in ranked_ids[:search['top_k']]:
+            faq_id = ranked['id']
+            if faq_id in candidate_ids:
+                # Replace the local metadata with Claude's ranking
+                faq = self.faqs[self.faq_index[faq_id]]
+                relevant_faqs.append(faq.scored(ranked['relevance_score'], ranked['reason'], "claude"))
+        
+        if search['cache_key'] is not None:
+            self.cache.set(search['cache_key'], relevant_faqs)
+        return relevant_faqs
+    
+    def _ranking_fallback(self, error: Exception, search: Dict) -> List[Dict]:
+        print(f"Error in RAG search: {error}")
+        print(f"Falling back to local hybrid ranking")
+        # Fallback: return the best N FAQs from the local shortlist
+        return search['candidate_faqs'][:search['top_k']]
     
     def search_multi_category(self, customer_question: str, top_k: int = 5) -> List[Dict]:
         """
@@ -144,9 +367,9 @@ Now rank the FAQs:"""
 
 
 def main():
-    """Test RAG system"""
+    """Test RAG system (pass --local to rank with the local index only, without Claude)"""
     
-    rag = RAGSystem()
+    rag = RAGSystem(use_llm='--local' not in sys.argv)
     
     # Test cases
     test_questions = [
@@ -0,0 +1,376 @@
+"""
+Request Scheduler Module
+Shared gatekeeper for every messages.create call: token-bucket rate limits,
+AIMD concurrency control and jittered retries that honor retry-after
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+import anthropic
+
+# Rough characters-per-token ratio used to estimate prompt size before sending
+CHARS_PER_TOKEN = 4
+
+
+def estimate_request_tokens(params: Dict) -> int:
+    """Estimate the input tokens of a messages.create request from its text size"""
+    size = len(json.dumps(params.get('messages', []), ensure_ascii=False))
+    size += len(json.dumps(params.get('system', ''), ensure_ascii=False))
+    size += len(json.dumps(params.get('tools', []), ensure_ascii=False))
+    return max(1, size // CHARS_PER_TOKEN)
+
+
+def cacheable_system(text: str) -> List[Dict]:
+    """
+    System prompt marked for prompt caching
+    
+    Everything up to and including this block is cached by the API, so later
+    requests with the same static instructions read it from the cache.
+    Prefixes shorter than the model's minimum cacheable length are simply
+    not cached.
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to capacity; may go negative after corrections"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)"""
+        self._refill(now)
+        # Never ask for more than a full bucket, or a huge request would wait forever
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+
+class RequestScheduler:
+    """
+    Admission control shared by all modules
+
+    A request is admitted when a concurrency slot is free and both the
+    requests-per-minute and tokens-per-minute buckets can cover it. The
+    concurrency limit grows additively on success and halves on every 429 /
+    overload (AIMD). Throttled requests are retried with full-jitter
+    exponential backoff; a retry-after header pauses all admissions until
+    it expires.
+    """
+
+    def __init__(self, requests_per_minute: float = 50, tokens_per_minute: float = 40_000,
+                 max_concurrency: int = 32, min_concurrency: int = 1, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        Args:
+            requests_per_minute: Request rate limit of the API key
+            tokens_per_minute: Input-token rate limit of the API key
+            max_concurrency: Upper bound (and starting value) of the adaptive concurrency limit
+            min_concurrency: Lower bound of the adaptive concurrency limit
+            max_retries: Retries per request for throttling, overload and server errors
+            base_delay: First backoff delay in seconds
+            max_delay: Cap on a single backoff delay
+        """
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self.observers: List[Callable] = []
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "requests": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "throttle_events": 0,
+            "max_queue_depth": 0,
+            "wait_seconds": 0.0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Admission
+    # ------------------------------------------------------------------
+
+    def _try_admit(self, estimated_tokens: int) -> float:
+        """Admit the request and return 0, or return how long to wait before retrying"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.in_flight >= int(self.concurrency_limit):
+                return 0.05
+            wait = max(self.request_bucket.wait_time(1, now),
+                       self.token_bucket.wait_time(estimated_tokens, now))
+            if wait > 0:
+                return wait
+            self.request_bucket.take(1)
+            self.token_bucket.take(estimated_tokens)
+            self.in_flight += 1
+            self.stats['requests'] += 1
+            return 0.0
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _enter_queue(self):
+        with self._lock:
+            self.waiting += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.waiting)
+
+    def _leave_queue(self, waited: float):
+        with self._lock:
+            self.waiting -= 1
+            self.stats['wait_seconds'] += waited
+
+    def acquire(self, estimated_tokens: int):
+        """Block until the request may be sent"""
+        self._enter_queue()
+        start = time.monotonic()
+        try:
+            while True:
+                wait = self._try_admit(estimated_tokens)
+                if wait == 0:
+                    return
+                time.sleep(wait)
+        finally:
+            self._leave_queue(time.monotonic() - start)
+
+    async def acquire_async(self, estimated_tokens: int):
+        """Wait (without blocking the event loop) until the request may be sent"""
+        self._enter_queue()
+        start = time.monotonic()
+        try:
+            while True:
+                wait = self._try_admit(estimated_tokens)
+                if wait == 0:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self._leave_queue(time.monotonic() - start)
+
+    def release(self, estimated_tokens: int, message=None, throttled: bool = False):
+        """Free the slot, correct the token bucket with real usage and adapt concurrency"""
+        with self._lock:
+            self.in_flight -= 1
+            usage = getattr(message, 'usage', None)
+            if usage is not None:
+                for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+                    self.stats[key] += getattr(usage, key, 0) or 0
+                # Cache reads don't count towards the input-token rate limit
+                actual = (getattr(usage, 'input_tokens', 0) or 0) + \
+                         (getattr(usage, 'cache_creation_input_tokens', 0) or 0)
+                self.token_bucket.take(actual - estimated_tokens)
+
+            if throttled:
+                self.stats['throttle_events'] += 1
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+            elif message is not None:
+                self.concurrency_limit = min(self.max_concurrency,
+                                             self.concurrency_limit + 1 / self.concurrency_limit)
+
+    def add_observer(self, observer: Callable):
+        """Call observer(params, estimated_tokens, message) after every successful request"""
+        with self._lock:
+            if observer not in self.observers:
+                self.observers.append(observer)
+
+    def _notify(self, params: Dict, estimated_tokens: int, message):
+        for observer in list(self.observers):
+            observer(params, estimated_tokens, message)
+
+    # ------------------------------------------------------------------
+    # Retry policy
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _is_throttle(error: Exception) -> bool:
+        """429 rate limit or 529 overloaded"""
+        if isinstance(error, anthropic.RateLimitError):
+            return True
+        return isinstance(error, anthropic.APIStatusError) and error.status_code == 529
+
+    @classmethod
+    def _is_retryable(cls, error: Exception) -> bool:
+        if cls._is_throttle(error):
+            return True
+        if isinstance(error, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+            return True
+        return isinstance(error, anthropic.APIStatusError) and error.status_code >= 500
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        value = response.headers.get('retry-after')
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        """Delay before the next attempt; a retry-after header also pauses admissions"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            with self._lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        return delay
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def call(self, create: Callable, **params):
+        """
+        Send a request through the scheduler
+
+        Args:
+            create: The client's messages.create
+            **params: messages.create parameters
+
+        Returns:
+            The API response; raises the last error once retries are exhausted
+        """
+        estimated = estimate_request_tokens(params)
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated)
+            try:
+                message = create(**params)
+            except Exception as e:
+                throttled = self._is_throttle(e)
+                self.release(estimated, throttled=throttled)
+                if not self._is_retryable(e) or attempt == self.max_retries:
+                    self._count('failed')
+                    raise
+                self._count('retries')
+                time.sleep(self._backoff(e, attempt))
+                continue
+            self.release(estimated, message)
+            self._count('succeeded')
+            self._notify(params, estimated, message)
+            return message
+
+    async def call_async(self, create: Callable, **params):
+        """Async version of call() for the AsyncAnthropic client"""
+        estimated = estimate_request_tokens(params)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(estimated)
+            try:
+                message = await create(**params)
+            except Exception as e:
+                throttled = self._is_throttle(e)
+                self.release(estimated, throttled=throttled)
+                if not self._is_retryable(e) or attempt == self.max_retries:
+                    self._count('failed')
+                    raise
+                self._count('retries')
+                await asyncio.sleep(self._backoff(e, attempt))
+                continue
+            self.release(estimated, message)
+            self._count('succeeded')
+            self._notify(params, estimated, message)
+            return message
+
+    @contextmanager
+    def stream(self, open_stream: Callable, **params) -> Iterator:
+        """
+        Open a streaming request through the scheduler
+        
+        Opening the stream is admitted and retried like call(); once events
+        flow, errors are raised to the caller. The slot is held until the
+        with-block exits.
+        
+        Args:
+            open_stream: The client's messages.stream
+            **params: messages.stream parameters
+        
+        Yields:
+            The open MessageStream
+        """
+        estimated = estimate_request_tokens(params)
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated)
+            try:
+                manager = open_stream(**params)
+                stream = manager.__enter__()
+                break
+            except Exception as e:
+                throttled = self._is_throttle(e)
+                self.release(estimated, throttled=throttled)
+                if not self._is_retryable(e) or attempt == self.max_retries:
+                    self._count('failed')
+                    raise
+                self._count('retries')
+                time.sleep(self._backoff(e, attempt))
+        
+        message = None
+        try:
+            yield stream
+            message = stream.get_final_message()
+        except BaseException as e:
+            manager.__exit__(type(e), e, e.__traceback__)
+            self.release(estimated, throttled=self._is_throttle(e))
+            # GeneratorExit etc. means the consumer stopped early, not that the request failed
+            if isinstance(e, Exception):
+                self._count('failed')
+            raise
+        manager.__exit__(None, None, None)
+        self.release(estimated, message)
+        self._count('succeeded')
+        self._notify(params, estimated, message)
+    
+    def get_stats(self) -> Dict:
+        """Current queue depth, concurrency, throttle counters and token usage"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['queue_depth'] = self.waiting
+            stats['in_flight'] = self.in_flight
+            stats['concurrency_limit'] = int(self.concurrency_limit)
+        prompt_tokens = stats['input_tokens'] + stats['cache_read_input_tokens'] + stats['cache_creation_input_tokens']
+        stats['prompt_cache_hit_rate'] = stats['cache_read_input_tokens'] / prompt_tokens if prompt_tokens else 0.0
+        return stats
+
+
+_default_scheduler: Optional[RequestScheduler] = None
+
+
+def get_default_scheduler() -> RequestScheduler:
+    """Process-wide scheduler used by every module unless one is passed in"""
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = RequestScheduler()
+    return _default_scheduler
@@ -0,0 +1,190 @@
+"""
+Result Cache Module
+Content-addressed cache for intent, retrieval, draft and quality-check results
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_PATH = '../cache/results.sqlite3'
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_payload(value: Any) -> Any:
+    """Collapse whitespace and case in every string so near-identical inputs share a key"""
+    if isinstance(value, str):
+        return WHITESPACE_PATTERN.sub(' ', value).strip().casefold()
+    if isinstance(value, dict):
+        return {str(k): normalize_payload(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_payload(v) for v in value]
+    return value
+
+
+class ResultCache:
+    """
+    In-memory LRU backed by an on-disk SQLite store
+
+    Keys are SHA-256 hashes of the normalized input plus the model and prompt
+    version, so changing either one naturally invalidates old entries.
+    Values must be JSON-serializable; every get() returns a fresh copy.
+    """
+
+    def __init__(self, db_path: Optional[str] = DEFAULT_CACHE_PATH, max_memory_entries: int = 1024,
+                 max_disk_entries: int = 100_000, ttl_seconds: Optional[float] = 7 * 24 * 3600):
+        """
+        Args:
+            db_path: SQLite file for the persistent tier (None keeps the cache in memory only)
+            max_memory_entries: LRU capacity of the in-memory tier
+            max_disk_entries: Row limit of the SQLite tier; least recently used rows are evicted
+            ttl_seconds: Maximum age of an entry (None disables expiry)
+        """
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expirations": 0,
+            "writes": 0
+        }
+
+        self._db = None
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(namespace: str, payload: Any, model: str, prompt_version: str) -> str:
+        """
+        Build a cache key
+
+        Args:
+            namespace: Stage name, e.g. "intent"
+            payload: JSON-serializable input of the stage
+            model: Model used to produce the result (a cascade passes its cache_id)
+            prompt_version: Version string of the stage's prompt
+        """
+        material = json.dumps(
+            [namespace, model, prompt_version, normalize_payload(payload)],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return f"{namespace}:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.stats['hits'] += 1
+                    self.stats['memory_hits'] += 1
+                    return json.loads(value)
+                self._delete(key)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at, now):
+                        self._db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, value, created_at)
+                        self.stats['hits'] += 1
+                        self.stats['disk_hits'] += 1
+                        return json.loads(value)
+                    self._delete(key)
+                    self.stats['expirations'] += 1
+
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, key: str, value: Any):
+        """Store a JSON-serializable value in both tiers"""
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, serialized, now)
+            self.stats['writes'] += 1
+
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, serialized, now, now)
+                )
+                overflow = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_disk_entries
+                if overflow > 0:
+                    self._db.execute(
+                        "DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY accessed_at ASC LIMIT ?)",
+                        (overflow,)
+                    )
+                    self.stats['disk_evictions'] += overflow
+                self._db.commit()
+
+    def _remember(self, key: str, serialized: str, created_at: float):
+        """Insert into the memory tier, evicting the least recently used entries"""
+        self._memory[key] = (serialized, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats['memory_evictions'] += 1
+
+    def _delete(self, key: str):
+        self._memory.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._db.commit()
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def get_stats(self) -> Dict:
+        """Counters plus hit rate; every hit is one API call that was not made"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['api_calls_saved'] = stats['hits']
+        return stats
@@ -0,0 +1,124 @@
+"""
+Stage Planner Module
+Decides which LLM stages can still change the routing decision and skips the rest
+"""
+
+from typing import Dict, Optional
+
+# Default deployment policy
+DEFAULT_STAGE_POLICY = {
+    # Draft for HIGH-urgency email: "full", "brief" (short, cheap) or "none".
+    # HIGH urgency is always escalated, so the draft only helps the human who picks it up.
+    "high_urgency_draft": "brief",
+    # QC can't change the action of a HIGH-urgency email: unsafe and urgent both escalate
+    "high_urgency_quality_check": False,
+    # When the draft already asks for a human, QC can only turn review-with-draft into an
+    # escalation. Deployments that accept review-with-draft without a safety check can opt in.
+    "skip_quality_when_draft_needs_human": False
+}
+
+# Runs every stage for every email (the behavior before the planner existed)
+FULL_STAGE_POLICY = {
+    "high_urgency_draft": "full",
+    "high_urgency_quality_check": True,
+    "skip_quality_when_draft_needs_human": False
+}
+
+DRAFT_MODES = ("full", "brief", "none")
+
+
+class StagePlanner:
+    """
+    Routing-aware stage planner
+
+    Mirrors the decision matrix in pipeline.route_email: a stage is only run
+    if its output can still change the action under the deployment's policy.
+    Skipped stages get a synthesized result so routing works unchanged.
+    """
+
+    def __init__(self, policy: Optional[Dict] = None):
+        """
+        Args:
+            policy: Overrides merged over DEFAULT_STAGE_POLICY
+        """
+        self.policy = {**DEFAULT_STAGE_POLICY, **(policy or {})}
+        if self.policy['high_urgency_draft'] not in DRAFT_MODES:
+            raise ValueError(f"high_urgency_draft must be one of {DRAFT_MODES}")
+
+        self.stats = {
+            "planned": 0,
+            "drafts_skipped": 0,
+            "brief_drafts": 0,
+            "quality_checks_skipped": 0
+        }
+
+    def plan_draft(self, preprocessed: Dict) -> str:
+        """
+        Choose how to generate the draft
+
+        Returns:
+            "full", "brief" or "none"
+        """
+        self.stats['planned'] += 1
+        mode = "full"
+        if preprocessed['urgency_level'] == "HIGH":
+            mode = self.policy['high_urgency_draft']
+
+        if mode == "none":
+            self.stats['drafts_skipped'] += 1
+        elif mode == "brief":
+            self.stats['brief_drafts'] += 1
+        return mode
+
+    def plan_quality(self, preprocessed: Dict, draft_result: Dict) -> Optional[str]:
+        """
+        Decide whether the quality check can still change routing
+
+        Returns:
+            None to run QC, otherwise the reason it is skipped
+        """
+        reason = None
+        if preprocessed['urgency_level'] == "HIGH" and not self.policy['high_urgency_quality_check']:
+            reason = "HIGH urgency is escalated regardless of QC"
+        elif draft_result['needs_human'] and self.policy['skip_quality_when_draft_needs_human']:
+            reason = "Draft already requests human review"
+
+        if reason is not None:
+            self.stats['quality_checks_skipped'] += 1
+        return reason
+
+    @staticmethod
+    def skipped_draft(persona: str) -> Dict:
+        """Draft result used when generation is skipped"""
+        return {
+            "draft": "",
+            "confidence": 0.0,
+            "snippets_used": [],
+            "needs_human": True,
+            "persona": persona,
+            "skipped": True
+        }
+
+    @staticmethod
+    def skipped_quality(draft_result: Dict, reason: str) -> Dict:
+        """
+        Quality result used when QC is skipped
+
+        The draft's own confidence stands in for the quality score, so
+        route_email computes the same final confidence it would from the draft.
+        Nothing was checked, so the safety verdict is unknown (None).
+        """
+        return {
+            "quality_score": draft_result['confidence'],
+            "is_safe": None,
+            "needs_human_review": True,
+            "issues": [f"Quality check skipped: {reason}"],
+            "action": "HUMAN_REVIEW_WITH_DRAFT",
+            "skipped": True
+        }
+
+    def get_stats(self) -> Dict:
+        """Skip counters; every skipped draft or quality check is one API call not made"""
+        stats = dict(self.stats)
+        stats['calls_saved'] = stats['drafts_skipped'] + stats['quality_checks_skipped']
+        return stats
@@ -0,0 +1,178 @@
+"""
+Structured Output Module
+Tool-use schemas, one validated response parser and per-stage retry for every LLM module
+"""
+
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+T = TypeVar('T')
+
+# JSON Schema type name -> accepted Python types (bool is deliberately not a number)
+SCHEMA_TYPES = {
+    "object": (dict,),
+    "array": (list,),
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,),
+    "null": (type(None),)
+}
+
+
+class StructuredOutputError(ValueError):
+    """A response did not contain valid output for the stage's schema"""
+
+
+def strip_code_fence(text: str) -> str:
+    """Remove a surrounding markdown code fence (```json ... ```) if present"""
+    text = text.strip()
+    if text.startswith('```'):
+        lines = text.split('\n')[1:]
+        if lines and lines[-1].strip() == '```':
+            lines = lines[:-1]
+        text = '\n'.join(lines).strip()
+    return text
+
+
+def response_payload(message, tool_name: Optional[str] = None) -> Any:
+    """
+    Structured payload of a response
+
+    Returns the input of the (named) tool_use block; responses without one
+    fall back to the JSON in the text. Raises StructuredOutputError.
+    """
+    text_parts = []
+    for block in message.content:
+        block_type = getattr(block, 'type', 'text')
+        if block_type == 'tool_use' and (tool_name is None or block.name == tool_name):
+            return block.input
+        if block_type == 'text':
+            text_parts.append(block.text)
+
+    text = strip_code_fence(''.join(text_parts))
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        stop_reason = getattr(message, 'stop_reason', None)
+        raise StructuredOutputError(f"No tool call and no JSON in response (stop_reason={stop_reason}): {e}")
+
+
+def validate(value: Any, schema: Dict, path: str = "$"):
+    """
+    Check a value against the JSON Schema subset used by the tool definitions
+
+    Supports type (including lists of types), properties, required, items,
+    enum, minimum and maximum. Raises StructuredOutputError on the first mismatch.
+    """
+    expected = schema.get('type')
+    if expected is not None:
+        names = expected if isinstance(expected, list) else [expected]
+        if not any(isinstance(value, SCHEMA_TYPES[name]) and not (isinstance(value, bool) and name in ("number", "integer"))
+                   for name in names):
+            raise StructuredOutputError(f"{path}: expected {expected}, got {type(value).__name__}")
+
+    if 'enum' in schema and value not in schema['enum']:
+        raise StructuredOutputError(f"{path}: {value!r} is not one of {schema['enum']}")
+    if 'minimum' in schema and value < schema['minimum']:
+        raise StructuredOutputError(f"{path}: {value} is below {schema['minimum']}")
+    if 'maximum' in schema and value > schema['maximum']:
+        raise StructuredOutputError(f"{path}: {value} is above {schema['maximum']}")
+
+    if isinstance(value, dict):
+        for key in schema.get('required', []):
+            if key not in value:
+                raise StructuredOutputError(f"{path}: missing required field '{key}'")
+        for key, subschema in schema.get('properties', {}).items():
+            if key in value:
+                validate(value[key], subschema, f"{path}.{key}")
+    elif isinstance(value, list) and 'items' in schema:
+        for i, item in enumerate(value):
+            validate(item, schema['items'], f"{path}[{i}]")
+
+
+class StructuredOutput:
+    """
+    Schema-constrained output of one stage
+
+    request_params() forces the model to answer through the stage's tool,
+    parse() validates the tool input against its schema, and call() retries
+    the stage when a response still fails to parse.
+    """
+
+    def __init__(self, tool: Dict, max_attempts: int = 2):
+        """
+        Args:
+            tool: Tool definition with name, description and input_schema
+            max_attempts: Requests per stage call before the parse error is raised
+        """
+        self.tool = tool
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.stats = {"responses": 0, "failures": 0, "retries": 0, "exhausted": 0}
+
+    def request_params(self) -> Dict:
+        """messages.create parameters that force a call of the stage's tool"""
+        return {
+            "tools": [self.tool],
+            "tool_choice": {"type": "tool", "name": self.tool['name']}
+        }
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def payload(self, message) -> Any:
+        """Validated payload without touching the metrics (used to score cascade tiers)"""
+        payload = response_payload(message, self.tool['name'])
+        validate(payload, self.tool['input_schema'])
+        return payload
+
+    def parse(self, message) -> Any:
+        """Validated payload of a response; raises StructuredOutputError"""
+        self._count('responses')
+        try:
+            return self.payload(message)
+        except StructuredOutputError:
+            self._count('failures')
+            raise
+
+    def call(self, send: Callable[[], Any], handle: Callable[[Any], T]) -> T:
+        """
+        Send a request and handle its response, retrying on parse failures
+
+        Args:
+            send: Makes the API request and returns the response
+            handle: Turns the response into the stage result (calls parse())
+        """
+        for attempt in range(self.max_attempts):
+            message = send()
+            try:
+                return handle(message)
+            except StructuredOutputError as e:
+                if attempt == self.max_attempts - 1:
+                    self._count('exhausted')
+                    raise
+                print(f"Retrying {self.tool['name']} after invalid output: {e}")
+                self._count('retries')
+
+    async def call_async(self, send: Callable[[], Awaitable[Any]], handle: Callable[[Any], T]) -> T:
+        """Async version of call()"""
+        for attempt in range(self.max_attempts):
+            message = await send()
+            try:
+                return handle(message)
+            except StructuredOutputError as e:
+                if attempt == self.max_attempts - 1:
+                    self._count('exhausted')
+                    raise
+                print(f"Retrying {self.tool['name']} after invalid output: {e}")
+                self._count('retries')
+
+    def get_stats(self) -> Dict:
+        """Responses parsed, parse failures, retries, calls that ran out of attempts and the failure rate"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['failure_rate'] = stats['failures'] / stats['responses'] if stats['responses'] else 0.0
+        return stats
@@ -4,11 +4,15 @@ Intent Detection → RAG Search → Draft Generation → Quality Check → Routi
 """
 
 import json
-from email_processor import preprocess_email
+from email_processor import TextReducer, preprocess_email
 from intent_detector import IntentDetector
 from rag_system import RAGSystem
 from draft_generator import DraftGenerator
 from quality_checker import QualityChecker
+from result_cache import ResultCache
+from pipeline import choose_top_k, route_email
+from stage_planner import StagePlanner
+from request_scheduler import get_default_scheduler
 
 
 def main():
@@ -16,11 +20,18 @@ def main():
     with open('../data/test_emails.json', 'r') as f:
         emails = json.load(f)['test_emails']
     
-    # Initialize all systems
-    detector = IntentDetector()
-    rag = RAGSystem()
-    generator = DraftGenerator()
-    checker = QualityChecker()
+    # Initialize all systems (sharing one result cache so re-runs skip repeated API calls)
+    cache = ResultCache()
+    detector = IntentDetector(cache=cache)
+    rag = RAGSystem(cache=cache)
+    generator = DraftGenerator(cache=cache)
+    checker = QualityChecker(cache=cache)
+    # Drafts may repeat what the system prompt tells the model about the persona
+    checker.grounding_verifier.add_known_text(generator._system_prompt())
+    # Skips draft/QC calls that can't change routing (StagePlanner(FULL_STAGE_POLICY) runs everything)
+    planner = StagePlanner()
+    # Quoted history, signatures and disclaimers are stripped before any prompt sees the body
+    reducer = TextReducer()
     
     print("="*70)
     print("COMPLETE AI AUTOMATION WORKFLOW TEST")
@@ -54,10 +65,15 @@ def main():
         print(f"   Order Numbers: {preprocessed['order_numbers']}")
         print(f"   Urgency: {preprocessed['urgency_level']}")
         print(f"   Text Length: {preprocessed['length']} characters")
+        reduction = reducer.reduce(test_email['body'])
+        body = reduction['body']
+        if reduction['removed']:
+            kinds = ", ".join(sorted({span['kind'] for span in reduction['removed']}))
+            print(f"   Reduced: {reduction['original_tokens']} → {reduction['tokens']} tokens (removed {kinds})")
         
         # Step 2: Detect Intent
         print(f"\n2️⃣  INTENT DETECTION:")
-        intent_result = detector.detect_intent(test_email['body'])
+        intent_result = detector.detect_intent(body)
         print(f"   Category: {intent_result['category']}")
         print(f"   Confidence: {intent_result['confidence']:.2f}")
         print(f"   Reasoning: {intent_result['reasoning'][:100]}...")
@@ -66,15 +82,10 @@ def main():
         print(f"\n3️⃣  RAG SEARCH:")
         
         # Dynamic top_k based on email complexity (if field exists)
-        if test_email.get('complexity') == 'complex':
-            top_k = 5
-        elif intent_result['category'] == 'MULTIPLE':
-            top_k = 5
-        else:
-            top_k = 3
+        top_k = choose_top_k(test_email, intent_result)
         
         relevant_faqs = rag.search_relevant_faqs(
-            customer_question=test_email['body'],
+            customer_question=body,
             category=intent_result['category'],
             top_k=top_k
         )
@@ -88,7 +99,17 @@ def main():
         
         # Step 4: Generate Draft
         print(f"\n4️⃣  DRAFT GENERATION:")
-        draft_result = generator.generate_draft(test_email['body'], relevant_faqs)
+        draft_mode = planner.plan_draft(preprocessed)
+        if draft_mode == "none":
+            print(f"   ⏭️  Skipped by planner (HIGH urgency)")
+            draft_result = planner.skipped_draft(generator.persona['name'])
+        else:
+            if draft_mode == "brief":
+                print(f"   Brief draft (HIGH urgency)")
+            draft_result = generator.generate_draft(body, relevant_faqs, brief=draft_mode == "brief",
+                                                    preprocessed=preprocessed)
+            if draft_result.get('template'):
+                print(f"   📋 Template draft: {draft_result['template']}")
         
         # Display FULL draft message
         print(f"\n   📝 FULL DRAFT EMAIL:")
@@ -106,13 +127,19 @@ def main():
         
         # Step 5: Quality Check
         print(f"\n5️⃣  QUALITY CHECK:")
-        quality_result = checker.check_quality(
-            test_email['body'],
-            draft_result['draft'],
-            relevant_faqs
-        )
+        skip_reason = planner.plan_quality(preprocessed, draft_result)
+        if skip_reason is not None:
+            print(f"   ⏭️  Skipped by planner: {skip_reason}")
+            quality_result = planner.skipped_quality(draft_result, skip_reason)
+        else:
+            quality_result = checker.check_quality(
+                body,
+                draft_result['draft'],
+                relevant_faqs,
+                full_message=preprocessed['cleaned_text']
+            )
         print(f"   Quality Score: {quality_result['quality_score']:.2f}")
-        print(f"   Is Safe: {quality_result['is_safe']}")
+        print(f"   Is Safe: {'not checked' if quality_result['is_safe'] is None else quality_result['is_safe']}")
         print(f"   Needs Human: {quality_result['needs_human_review']}")
         
         if quality_result.get('breakdown'):
@@ -127,30 +154,16 @@ def main():
         
         # Step 6: Final Routing Decision
         print(f"\n6️⃣  ROUTING DECISION:")
-        needs_human = draft_result['needs_human'] or quality_result['needs_human_review']
-        final_confidence = min(draft_result['confidence'], quality_result['quality_score'])
-        is_urgent = preprocessed['urgency_level'] == "HIGH"
-        
-        # Decision matrix with priority order
-        if not quality_result['is_safe']:
-            action = "🚨 ESCALATE_TO_HUMAN"
-            reason = "Safety concern detected"
-            escalate_count += 1
-        elif is_urgent:
-            action = "🚨 ESCALATE_TO_HUMAN (HIGH URGENCY)"
-            reason = f"Customer urgency: {preprocessed['urgency_level']} (overrides quality metrics)"
+        routing = route_email(preprocessed, draft_result, quality_result)
+        action = routing['label']
+        reason = routing['reason']
+        final_confidence = routing['final_confidence']
+        
+        if routing['action'] == "ESCALATE_TO_HUMAN":
             escalate_count += 1
-        elif needs_human:
-            action = "👤 HUMAN_REVIEW_WITH_DRAFT"
-            reason = "Draft or QC flagged for review"
-            human_review_count += 1
-        elif final_confidence >= 0.85:
-            action = "✅ AUTO_SEND"
-            reason = "High confidence, safe to auto-send"
+        elif routing['action'] == "AUTO_SEND":
             auto_send_count += 1
         else:
-            action = "👤 HUMAN_REVIEW_WITH_DRAFT"
-            reason = f"Confidence too low ({final_confidence:.2f})"
             human_review_count += 1
         
         print(f"\n   Decision Factors:")
@@ -178,6 +191,30 @@ def main():
         print(f"   👤 Human Review: {human_review_count} ({human_review_count/total_processed*100:.0f}%)")
         print(f"   🚨 Escalate: {escalate_count} ({escalate_count/total_processed*100:.0f}%)")
     
+    cache_stats = cache.get_stats()
+    print(f"\n💾 RESULT CACHE:")
+    print(f"   Hits: {cache_stats['hits']} / Misses: {cache_stats['misses']} ({cache_stats['hit_rate']*100:.0f}% hit rate)")
+    print(f"   API calls saved: {cache_stats['api_calls_saved']}")
+    print(f"   Evictions: {cache_stats['memory_evictions']} memory, {cache_stats['disk_evictions']} disk, {cache_stats['expirations']} expired")
+    
+    scheduler_stats = get_default_scheduler().get_stats()
+    print(f"\n🧾 TOKEN USAGE:")
+    print(f"   Input: {scheduler_stats['input_tokens']} / Output: {scheduler_stats['output_tokens']}")
+    print(f"   Prompt cache: {scheduler_stats['cache_read_input_tokens']} read, "
+          f"{scheduler_stats['cache_creation_input_tokens']} written "
+          f"({scheduler_stats['prompt_cache_hit_rate']*100:.0f}% of prompt tokens from cache)")
+    
+    reducer_stats = reducer.get_stats()
+    print(f"\n📉 TEXT REDUCTION:")
+    print(f"   Body tokens: {reducer_stats['avg_original_tokens']:.0f} → {reducer_stats['avg_tokens']:.0f} per email "
+          f"({reducer_stats['avg_tokens_saved']:.0f} saved in each of the intent, ranking, draft and QC prompts)")
+    
+    planner_stats = planner.get_stats()
+    print(f"\n✂️  STAGE PLANNER:")
+    print(f"   API calls saved: {planner_stats['calls_saved']} "
+          f"({planner_stats['drafts_skipped']} drafts, {planner_stats['quality_checks_skipped']} quality checks)")
+    print(f"   Brief drafts: {planner_stats['brief_drafts']}")
+    
     print("\n💡 YOUR AI AUTOMATION SYSTEM INCLUDES:")
     print("  1. Email preprocessing (order extraction, urgency detection)")
     print("  2. Intent classification (AI-powered categorization)")